@@ -5,12 +5,51 @@ import hashlib
 import json
 import os
 import re
+import threading
 import time
+import weakref
 from pathlib import Path
-from typing import Dict, Iterator, List
+from typing import Callable, Dict, Iterator, List
 
 from ai_pipeline.generate_cli import generate as pipeline_generate
-from ai_pipeline.types import GenerateRequest
+from ai_pipeline.types import AgentEvent, GenerateRequest
+
+EventCallback = Callable[[AgentEvent], None]
+PLAN_INSTRUCTION = "你是 MusicShader AI 助手，Plan 模式。简短回复（2-4 句），不生成代码。"
+
+# 跟随设置切换 provider 的实例；订阅在第一次创建实例时注册
+_provider_services: "weakref.WeakSet[AIService]" = weakref.WeakSet()
+_provider_lock = threading.Lock()
+_provider_subscribed = False
+
+
+def _default_provider() -> str:
+    try:
+        from WebEngine.settings import get_settings
+        has_key = get_settings().has_api_key
+    except Exception:
+        has_key = bool(os.getenv("OPENAI_API_KEY"))
+    return "openai" if has_key else "mock"
+
+
+def _on_api_key_changed(changed: dict) -> None:
+    provider = "openai" if changed.get("api_key") else "mock"
+    for service in list(_provider_services):
+        service.provider = provider
+
+
+def _track_provider(service: "AIService") -> None:
+    global _provider_subscribed
+    with _provider_lock:
+        _provider_services.add(service)
+        if _provider_subscribed:
+            return
+        _provider_subscribed = True
+    try:
+        from WebEngine.settings import get_settings
+        get_settings().subscribe(_on_api_key_changed, ("api_key",))
+    except Exception:
+        pass
 
 
 class AIService:
@@ -19,18 +58,14 @@ class AIService:
     def __init__(self, model: str = "", timeout: int = 120, session_id: str = ""):
         self.model = model or os.getenv("OPENAI_MODEL", "gpt-4.1-mini")
         self.timeout = timeout
-        self.history: List[Dict[str, str]] = []
+        self._history: List[Dict[str, str]] | None = []
 
-        # provider 策略：有 API key（环境变量或 settings.json）则 openai，否则 mock
+        # provider 策略：AI_PROVIDER 固定；否则有 API key（环境变量或 settings.json）则 openai，否则 mock，
+        # 并随设置页修改 api_key 自动切换
         self.provider = os.getenv("AI_PROVIDER", "").strip().lower()
         if self.provider not in {"openai", "mock"}:
-            try:
-                from WebEngine.settings import Settings
-                s = Settings()
-                has_key = bool(s.api_key)
-            except Exception:
-                has_key = bool(os.getenv("OPENAI_API_KEY"))
-            self.provider = "openai" if has_key else "mock"
+            self.provider = _default_provider()
+            _track_provider(self)
 
         self.session_id = session_id or ""
         self._dirty = False
@@ -63,29 +98,48 @@ class AIService:
                 continue
         return values
 
+    @property
+    def history(self) -> List[Dict[str, str]]:
+        """会话历史；load_history() 之后首次访问时才从会话缓存取出。"""
+        if self._history is None:
+            from ai_pipeline.tools.session_tools import load_messages
+            self._history = load_messages(self.session_id)
+        return self._history
+
+    @history.setter
+    def history(self, messages: List[Dict[str, str]]) -> None:
+        self._history = messages
+
     def load_history(self, session_id: str = "") -> None:
-        """从 conversations.json 加载会话历史到 self.history。"""
+        """切换到 session_id 的历史（延迟到首次访问 self.history 时加载）。"""
         if not session_id:
             session_id = self.session_id
         if not session_id:
             self.history = []
             return
-        from ai_pipeline.tools.session_tools import load_messages
-        self.history = load_messages(session_id)
+        self._history = None
         self.session_id = session_id
         self._dirty = False
 
     def save(self) -> None:
-        """保存当前 history 到 conversations.json 并更新元数据。"""
+        """保存当前 history（只追加新增消息）并更新元数据。"""
         if not self._dirty or not self.session_id:
             if not self.session_id:
                 import logging
                 logging.warning("[AIService.save] session_id 为空，跳过保存")
             return
-        from ai_pipeline.tools.session_tools import save_messages, update_meta
+        from ai_pipeline.tools.session_tools import save_messages
         save_messages(self.session_id, self.history)
-        update_meta(self.session_id)
         self._dirty = False
+        # 后台把超出上下文预算的旧消息折叠进滚动摘要，供下一轮使用
+        from ai_pipeline.context import get_context_manager
+        get_context_manager().schedule_summary(self.session_id, self.history, self.provider)
+        try:
+            from WebEngine.search_index import get_conversation_index
+            get_conversation_index().index_conversation(self.session_id, self.history)
+        except Exception as e:
+            import logging
+            logging.warning("[AIService.save] 更新检索索引失败: %s", e)
 
     def switch_to(self, session_id: str) -> list[dict]:
         """保存当前会话，切换到指定会话。返回新会话的消息列表。"""
@@ -103,18 +157,57 @@ class AIService:
         self.history.append({"role": "assistant", "content": content})
         self._dirty = True
 
-    def _build_history_messages(self, max_messages: int = 20) -> list:
-        """将 self.history 转换为 HumanMessage/AIMessage 消息列表，用于注入 agent/LLM。"""
-        from langchain_core.messages import AIMessage, HumanMessage
-        msgs = []
-        for h in self.history:
-            role = h.get("role", "")
-            content = h.get("content", "")
-            if role == "user":
-                msgs.append(HumanMessage(content=content))
-            elif role == "assistant":
-                msgs.append(AIMessage(content=content))
-        return msgs[-max_messages:]
+    def _build_history_messages(self, budget: int | None = None, exclude_last: bool = False) -> list:
+        """将 self.history 按 token 预算压缩（代码换成描述、更早的轮次换成滚动摘要）后
+        转换为 SystemMessage/HumanMessage/AIMessage 列表，用于注入 agent/LLM。"""
+        from ai_pipeline.context import get_context_manager
+        from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+        types = {"system": SystemMessage, "user": HumanMessage, "assistant": AIMessage}
+        history = self.history[:-1] if exclude_last else self.history
+        return [types[m["role"]](content=m["content"])
+                for m in get_context_manager().history(self.session_id, history, budget)]
+
+    def _response_cache_key(self, kind: str, prompt: str, llm, **parts):
+        """(缓存, 键)；mock provider 或缓存关闭时为 (None, None)。"""
+        if self.provider != "openai":
+            return None, None
+        from ai_pipeline.response_cache import get_response_cache
+        cache = get_response_cache()
+        if cache is None:
+            return None, None
+        return cache, cache.make_key(kind, prompt, model=getattr(llm, "model_name", ""), **parts)
+
+    @staticmethod
+    def _history_digest(history_msgs: list) -> str:
+        """注入的历史消息的哈希：回复依赖上下文，计入缓存键。"""
+        from ai_pipeline.response_cache import text_digest
+        return text_digest(json.dumps([[m.type, m.content] for m in history_msgs], ensure_ascii=False))
+
+    def _replay_cached(self, cache, key, prompt: str, on_event: EventCallback | None) -> str | None:
+        """缓存命中时回放为 token 事件并记入历史，返回回复；未命中返回 None。"""
+        reply = cache.lookup(key) if cache is not None else None
+        if reply is None:
+            return None
+        from ai_pipeline.response_cache import stream_cached
+        stream_cached(reply, on_event)
+        self._append_user(prompt)
+        self._append_assistant(reply)
+        self.save()
+        return reply
+
+    @staticmethod
+    def _llm_reply(llm, messages: list, on_event: EventCallback | None = None) -> str:
+        """调用 LLM；提供 on_event 时走 llm.stream 并逐 token 回调。"""
+        if on_event is None:
+            resp = llm.invoke(messages)
+            return str(resp.content) if hasattr(resp, "content") else str(resp)
+        parts: list[str] = []
+        for chunk in llm.stream(messages):
+            text = chunk.content if hasattr(chunk, "content") else str(chunk)
+            if isinstance(text, str) and text:
+                parts.append(text)
+                on_event(AgentEvent("token", text=text))
+        return "".join(parts)
 
     def _infer_style(self, prompt: str) -> str:
         low = prompt.lower()
@@ -126,14 +219,15 @@ class AIService:
             return "glitch"
         return "minimal"
 
-    def generate(self, prompt: str, adjust: bool = False, temperature: float = 0.7, top_p: float = 0.9, mode: str = "plan") -> str:
-        """根据 mode 分发：plan → 对话，build → Shader Agent 生成。"""
+    def generate(self, prompt: str, adjust: bool = False, temperature: float = 0.7, top_p: float = 0.9, mode: str = "plan",
+                 on_event: EventCallback | None = None) -> str:
+        """根据 mode 分发：plan → 对话，build → Shader Agent 生成。on_event 用于实时转发 token / tool 事件。"""
         del temperature, top_p
 
         if mode == "build":
             return "Build 模式已升级为两阶段流程。请先调用 analyze 端点进行需求分析，确认后再调用 build 端点生成代码。"
 
-        return self._plan_chat(prompt)
+        return self._plan_chat(prompt, on_event=on_event)
 
     def _find_music_files(self, prompt: str) -> list[Path]:
         """从 prompt 中提取引用的音乐文件路径。"""
@@ -185,10 +279,10 @@ class AIService:
         except Exception:
             return f"音频文件: {filepath.name}（加载失败）"
 
-    def analyze(self, prompt: str) -> str:
+    def analyze(self, prompt: str, on_event: EventCallback | None = None) -> str:
         """Analyze 阶段：调用 LangGraph Agent（仅音频+技能 tool）分析音频并输出结构化报告。
 
-        自动检测 prompt 中的音乐文件引用。
+        自动检测 prompt 中的音乐文件引用。on_event 不为空时实时回调 Agent 的 token / tool 事件。
         """
         music_files = self._find_music_files(prompt)
         audio_array: list[float] = []
@@ -200,8 +294,9 @@ class AIService:
             os.environ["AI_AUDIO_ARRAY_FILE"] = str(music_files[0].resolve()) if music_files else ""
 
         try:
-            from ai_pipeline.agent import build_shader_agent
+            from ai_pipeline.agent import get_shader_agent, run_agent
             from ai_pipeline.llm.adapter import build_llm
+            from ai_pipeline.response_cache import audio_fingerprint, file_identity, text_digest
             from ai_pipeline.tools.audio_tools import summarize_audio, load_audio_from_file, list_music_files, find_music_by_name
             from ai_pipeline.tools.skill_tools import get_skill_template
             from ai_pipeline.tools.utility_tools import infer_shader_style
@@ -219,7 +314,19 @@ class AIService:
             skill_spec = SKILL_LIBRARY.get("audio_analysis")
             skill_text = skill_spec.template if skill_spec else ""
 
-            analyze_agent = build_shader_agent(llm, analyze_tools, system_prompt=analyze_sys_prompt, max_iterations=6)
+            # 注入对话历史作为上下文（不包含当前 prompt，_append_user 在 invoke 后）
+            history_msgs = self._build_history_messages()
+
+            # 同样的文件 + 相同需求 + 相同的注入上下文：直接回放缓存的分析
+            cache, cache_key = self._response_cache_key(
+                "analyze", prompt, llm, source=file_identity(music_files),
+                audio=audio_fingerprint(audio_array), skill=text_digest(skill_text),
+                context=self._history_digest(history_msgs))
+            cached = self._replay_cached(cache, cache_key, prompt, on_event)
+            if cached is not None:
+                return cached
+
+            analyze_agent = get_shader_agent(llm, analyze_tools, system_prompt=analyze_sys_prompt, max_iterations=6)
 
             file_refs = "\n".join(f"- {f.name}" for f in music_files) if music_files else ""
             user_content = (
@@ -228,19 +335,21 @@ class AIService:
                 + (f"\n\n## 分析流程（必须遵循）\n\n{skill_text}" if skill_text else "")
             )
 
-            # 注入对话历史作为上下文（不包含当前 prompt，_append_user 在 invoke 后）
-            history_msgs = self._build_history_messages()
-
-            result = analyze_agent.invoke(
+            result = run_agent(
+                analyze_agent,
                 {"messages": history_msgs + [HumanMessage(content=user_content)]},
                 config={"recursion_limit": 100},
+                on_event=on_event,
             )
             messages = result.get("messages", [])
-            reply = "分析未能完成，请重试。"
+            reply = ""
             for msg in reversed(messages):
                 if hasattr(msg, "content") and msg.content:
                     reply = str(msg.content)
                     break
+            if reply and cache is not None:
+                cache.store(cache_key, reply)
+            reply = reply or "分析未能完成，请重试。"
             self._append_user(prompt)
             self._append_assistant(reply)
             self.save()
@@ -248,10 +357,11 @@ class AIService:
         except Exception as e:
             # agent 调用失败时才走 fallback；若在 append/save 阶段失败则直接返回
             if not self.history or self.history[-1].get("role") != "assistant":
-                return self._analyze_fallback(prompt, music_files)
+                return self._analyze_fallback(prompt, music_files, on_event=on_event)
             return f"分析失败: {e}"
 
-    def _analyze_fallback(self, prompt: str, music_files: list[Path]) -> str:
+    def _analyze_fallback(self, prompt: str, music_files: list[Path],
+                          on_event: EventCallback | None = None) -> str:
         """分析降级方案：使用 skill 模板 + 纯 LLM。"""
         audio_summary = ""
         for mf in music_files:
@@ -272,8 +382,7 @@ class AIService:
                 f"用户需求: {prompt}{audio_block}\n\n"
                 f"## 分析流程（必须严格遵循）\n\n{skill_text}"
             ))
-            resp = llm.invoke([msg])
-            reply = str(resp.content) if hasattr(resp, "content") else str(resp)
+            reply = self._llm_reply(llm, [msg], on_event)
             self._append_user(prompt)
             self._append_assistant(reply)
             self.save()
@@ -294,7 +403,8 @@ class AIService:
         except Exception:
             return []
 
-    def _build_shader(self, prompt: str, adjust: bool, analysis_context: str = "") -> str:
+    def _build_shader(self, prompt: str, adjust: bool, analysis_context: str = "",
+                      on_event: EventCallback | None = None) -> str:
         """Build 阶段：走 LangGraph Agent 生成 GLSL，可选传入分析上下文。"""
         req = GenerateRequest(
             prompt=prompt,
@@ -305,15 +415,11 @@ class AIService:
             seed=None,
         )
 
-        # 构建对话历史文本
+        # 构建对话历史文本（与对话共用 token 预算与滚动摘要，代码只保留描述）
         history_context = ""
         if self.history:
-            lines = []
-            for h in self.history[-10:]:
-                role = "用户" if h.get("role") == "user" else "助手"
-                content = h.get("content", "")[:200]
-                lines.append(f"{role}: {content}")
-            history_context = "\n".join(lines)
+            from ai_pipeline.context import get_context_manager
+            history_context = get_context_manager().history_text(self.session_id, self.history)
 
         root = Path(__file__).resolve().parent.parent
         result = pipeline_generate(
@@ -324,6 +430,7 @@ class AIService:
             audio_array=self._load_audio_array(),
             analysis_context=analysis_context,
             history_context=history_context,
+            on_event=on_event,
         )
 
         code = result.glsl_code
@@ -333,45 +440,65 @@ class AIService:
         self.save()
         return code
 
-    def _plan_chat(self, prompt: str) -> str:
+    def _plan_chat(self, prompt: str, on_event: EventCallback | None = None) -> str:
         """Plan 模式：检测音频引用 → 分析；否则纯对话。"""
         # 检测音频引用 → 在 Plan 模式也走分析
         music_files = self._find_music_files(prompt)
         if music_files:
-            return self.analyze(prompt)
+            return self.analyze(prompt, on_event=on_event)
 
-        self._append_user(prompt)
         try:
             from ai_pipeline.llm.adapter import build_llm
             from langchain_core.messages import HumanMessage
+            from ai_pipeline.response_cache import stream_cached, text_digest
             llm = build_llm(self.provider)
-            # 注入对话历史作为上下文，排除刚追加的当前 prompt
+            # 注入对话历史作为上下文；当前 prompt 在拿到回复后才记入历史（取消的任务不留痕迹）
             history_msgs = self._build_history_messages()
-            if history_msgs and history_msgs[-1].content == prompt:
-                history_msgs = history_msgs[:-1]
-            msg = HumanMessage(content=(
-                "你是 MusicShader AI 助手，Plan 模式。简短回复（2-4 句），不生成代码。\n\n"
-                f"用户: {prompt}"
-            ))
-            resp = llm.invoke(history_msgs + [msg])
-            reply = str(resp.content) if hasattr(resp, "content") else str(resp)
-            # 检测 LLM 是否误输出 shader 代码（某些模型忽略"不生成代码"指令）
-            if "#version" in reply and ("void main" in reply or "mainImage" in reply):
-                reply = "检测到你希望生成 Shader，请按 **Shift+Tab** 切换到 **Build 模式** 生成代码。"
+            msg = HumanMessage(content=f"{PLAN_INSTRUCTION}\n\n用户: {prompt}")
+            # 对话回复依赖上下文：注入的历史也计入缓存键
+            cache, cache_key = self._response_cache_key(
+                "plan", prompt, llm, skill=text_digest(PLAN_INSTRUCTION), context=self._history_digest(history_msgs))
+            reply = cache.lookup(cache_key) if cache is not None else None
+            if reply is not None:
+                stream_cached(reply, on_event)
+            else:
+                reply = self._llm_reply(llm, history_msgs + [msg], on_event)
+                # 检测 LLM 是否误输出 shader 代码（某些模型忽略"不生成代码"指令）
+                if "#version" in reply and ("void main" in reply or "mainImage" in reply):
+                    reply = "检测到你希望生成 Shader，请按 **Shift+Tab** 切换到 **Build 模式** 生成代码。"
+                elif reply and cache is not None:
+                    cache.store(cache_key, reply)
+            self._append_user(prompt)
             self._append_assistant(reply)
             self.save()
             return reply
         except Exception:
             reply = f"收到: '{prompt}'\n\n需要生成 Shader？按 Shift+Tab 切换到 Build 模式。"
+            self._append_user(prompt)
             self._append_assistant(reply)
             self.save()
             return reply
 
     def stream_generate(self, prompt: str, adjust: bool = False, temperature: float = 0.7, top_p: float = 0.9) -> Iterator[str]:
-        full = self.generate(prompt, adjust=adjust, temperature=temperature, top_p=top_p)
-        chunk_size = max(64, len(full) // 10)
-        for i in range(0, len(full), chunk_size):
-            yield full[i : i + chunk_size]
+        """逐 token 产出 Plan 模式回复文本。"""
+        for event in self.stream_events("chat", prompt, adjust=adjust, temperature=temperature, top_p=top_p):
+            if event.kind == "token":
+                yield event.text
+
+    def stream_events(self, stage: str, prompt: str, **kwargs) -> Iterator[AgentEvent]:
+        """以迭代器形式产出类型化事件。stage: chat | analyze | build。
+
+        最后一个 done 事件的 data["result"] 为该阶段的最终文本（build 为 GLSL）。
+        """
+        from ai_pipeline.agent import iter_events
+
+        if stage == "analyze":
+            return iter_events(lambda on_event: self.analyze(prompt, on_event=on_event))
+        if stage == "build":
+            return iter_events(lambda on_event: self._build_shader(
+                prompt, adjust=kwargs.get("adjust", False),
+                analysis_context=kwargs.get("analysis_context", ""), on_event=on_event))
+        return iter_events(lambda on_event: self.generate(prompt, on_event=on_event, **kwargs))
 
 
 __all__ = ["AIService"]
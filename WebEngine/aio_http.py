@@ -0,0 +1,540 @@
+"""基于 asyncio 的最小 HTTP/1.1 实现：Request / Response / EventStream + 连接处理。
+
+路由与业务逻辑仍由 APIHandler 完成；阻塞的处理函数在线程池中执行，
+SSE 由工作线程写入 EventStream 队列、事件循环负责发送，慢客户端只占用协程而不占用线程。
+请求体支持 Content-Length 与 chunked；stream_body 判定为流式的请求（如文件上传）不预先读入，
+处理协程通过 Request.body_reader 边收边处理。
+处理函数返回 WebSocket 时连接升级为 WebSocket（RFC 6455），由其 handler 协程接管。
+"""
+from __future__ import annotations
+
+import asyncio
+import base64
+import hashlib
+import json
+import struct
+import threading
+import time
+from dataclasses import dataclass, field
+from http import HTTPStatus
+from typing import Any, Awaitable, Callable
+from urllib.parse import parse_qs, unquote, urlsplit
+
+MAX_HEADER_BYTES = 64 * 1024
+MAX_BODY_BYTES = 64 * 1024 * 1024
+KEEP_ALIVE_TIMEOUT = 30.0
+# 流式请求体单次读取的最大字节数，以及两次收到数据之间的最长等待
+BODY_CHUNK_BYTES = 256 * 1024
+BODY_READ_TIMEOUT = 60.0
+WS_MAX_MESSAGE_BYTES = 1024 * 1024
+_WS_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+# WebSocket 不受 CORS 限制：浏览器页面只允许来自本服务自身或本机的 Origin
+_LOCAL_HOSTS = {"localhost", "127.0.0.1", "::1"}
+SSE_PING_INTERVAL = 15.0
+
+_CLOSE = object()
+
+
+@dataclass
+class Request:
+    method: str
+    target: str
+    version: str
+    headers: dict[str, str]
+    body: bytes = b""
+    received_at: float = field(default_factory=time.perf_counter)
+    # 流式请求：body 为空，由处理协程从 body_reader 读取
+    body_reader: "BodyReader | None" = None
+
+    @property
+    def path(self) -> str:
+        return unquote(self.target.split("?", 1)[0])
+
+    @property
+    def query(self) -> dict[str, str]:
+        if "?" not in self.target:
+            return {}
+        return {k: v[0] for k, v in parse_qs(self.target.split("?", 1)[1]).items()}
+
+    @property
+    def keep_alive(self) -> bool:
+        conn = self.headers.get("connection", "").lower()
+        if self.version == "HTTP/1.0":
+            return conn == "keep-alive"
+        return conn != "close"
+
+    def json(self) -> dict:
+        if not self.body:
+            return {}
+        try:
+            data = json.loads(self.body.decode("utf-8"))
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            return {}
+        return data if isinstance(data, dict) else {}
+
+
+@dataclass
+class Response:
+    status: int = 200
+    headers: list[tuple[str, str]] = field(default_factory=list)
+    body: bytes = b""
+
+    @classmethod
+    def json(cls, data: Any, status: int = 200) -> "Response":
+        body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+        return cls(status, [
+            ("Content-Type", "application/json; charset=utf-8"),
+            ("Access-Control-Allow-Origin", "*"),
+        ], body)
+
+    @classmethod
+    def error(cls, status: int, message: str = "") -> "Response":
+        phrase = HTTPStatus(status).phrase
+        body = (message or phrase).encode("utf-8")
+        return cls(status, [("Content-Type", "text/plain; charset=utf-8")], body)
+
+
+class EventStream:
+    """线程安全的 SSE 事件队列：工作线程 send()，事件循环负责写出。
+
+    send() 不会阻塞工作线程；客户端断开后 disconnected 被置位，send() 返回 False，
+    生产者可据此提前结束，也可用 on_disconnect() 注册回调（仅在客户端提前断开时调用）。
+    首个携带 chunk 的事件到达时记录 TTFT（距请求到达的毫秒数）。
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, label: str = "", started: float | None = None,
+                 headers: list[tuple[str, str]] | None = None):
+        self._loop = loop
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self.label = label
+        self.started = started if started is not None else time.perf_counter()
+        self.headers = headers or []
+        self.disconnected = threading.Event()
+        self.ttft_ms: float | None = None
+        self._callbacks: list[Callable[[], Any]] = []
+        self._callbacks_lock = threading.Lock()
+
+    def send(self, data: Any) -> bool:
+        if self.disconnected.is_set():
+            return False
+        if self.ttft_ms is None and isinstance(data, dict) and data.get("chunk"):
+            self.ttft_ms = (time.perf_counter() - self.started) * 1000.0
+            print(f"[sse] {self.label} ttft={self.ttft_ms:.0f}ms")
+            self._put({"ttft_ms": round(self.ttft_ms, 1)})
+        self._put(data)
+        return True
+
+    def close(self) -> None:
+        self._put(_CLOSE)
+
+    def on_disconnect(self, callback: Callable[[], Any]) -> None:
+        """Call callback (from the event loop thread) if the client goes away before close()."""
+        with self._callbacks_lock:
+            if not self.disconnected.is_set():
+                self._callbacks.append(callback)
+                return
+        callback()
+
+    def _mark_disconnected(self) -> None:
+        with self._callbacks_lock:
+            if self.disconnected.is_set():
+                return
+            self.disconnected.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                print(f"[sse] disconnect callback failed: {e}")
+
+    def _put(self, item: Any) -> None:
+        try:
+            self._loop.call_soon_threadsafe(self._queue.put_nowait, item)
+        except RuntimeError:
+            # 事件循环已关闭（服务停止）
+            self._mark_disconnected()
+
+    async def next_event(self, timeout: float) -> Any:
+        """Return the next event, None on timeout, or _CLOSE when the producer is done."""
+        try:
+            return await asyncio.wait_for(self._queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+class BodyReader:
+    """逐块读取请求体（Content-Length 或 Transfer-Encoding: chunked），读到的数据不做缓存。
+
+    客户端带 Expect: 100-continue 时，首次读取前才回 100 Continue；处理协程若在读取前
+    就拒绝请求（如声明的大小超限），客户端不会发送请求体。
+    """
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter | None,
+                 length: int | None, expect_continue: bool = False):
+        self._reader = reader
+        self._writer = writer
+        self.length = length                # chunked 时为 None
+        self.received = 0
+        self.done = length == 0
+        self._chunk_left = 0
+        self._expect_continue = expect_continue
+
+    async def _read(self, coro):
+        try:
+            return await asyncio.wait_for(coro, BODY_READ_TIMEOUT)
+        except asyncio.TimeoutError:
+            raise ConnectionError("request body timed out")
+
+    async def read(self, max_bytes: int = BODY_CHUNK_BYTES) -> bytes:
+        """Return the next piece of the body, or b"" once it has been fully read."""
+        if self.done:
+            return b""
+        if self._expect_continue:
+            self._expect_continue = False
+            if self._writer is not None:
+                self._writer.write(b"HTTP/1.1 100 Continue\r\n\r\n")
+                await self._writer.drain()
+        if self.length is not None:
+            data = await self._read(self._reader.read(min(max_bytes, self.length - self.received)))
+            if not data:
+                raise asyncio.IncompleteReadError(b"", self.length - self.received)
+            self.received += len(data)
+            self.done = self.received >= self.length
+            return data
+        if self._chunk_left == 0:
+            line = await self._read(self._reader.readuntil(b"\r\n"))
+            try:
+                size = int(line.split(b";", 1)[0].strip(), 16)
+            except ValueError:
+                raise ValueError("bad chunk size")
+            if size == 0:
+                # 忽略 trailer，读到空行为止
+                while (await self._read(self._reader.readuntil(b"\r\n"))) != b"\r\n":
+                    pass
+                self.done = True
+                return b""
+            self._chunk_left = size
+        data = await self._read(self._reader.read(min(max_bytes, self._chunk_left)))
+        if not data:
+            raise asyncio.IncompleteReadError(b"", self._chunk_left)
+        self._chunk_left -= len(data)
+        self.received += len(data)
+        if self._chunk_left == 0:
+            await self._read(self._reader.readexactly(2))
+        return data
+
+    async def read_all(self, limit: int = MAX_BODY_BYTES) -> bytes:
+        parts = []
+        while True:
+            data = await self.read()
+            if not data:
+                return b"".join(parts)
+            if self.received > limit:
+                raise ValueError("body too large")
+            parts.append(data)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> bytes:
+        data = await self.read()
+        if not data:
+            raise StopAsyncIteration
+        return data
+
+
+class WebSocket:
+    """服务端 WebSocket：处理函数返回 WebSocket(request, handler)，握手后在事件循环中运行 handler(ws)。
+
+    receive() 返回 str / bytes，对端关闭或连接断开时返回 None；ping 自动回 pong，
+    分片消息自动拼接。send() 整帧一次写入，多个协程并发发送也不会交错。
+    """
+
+    def __init__(self, request: Request, handler: Callable[["WebSocket"], Awaitable[None]]):
+        self.request = request
+        self.handler = handler
+        self.closed = False
+        self._reader: asyncio.StreamReader | None = None
+        self._writer: asyncio.StreamWriter | None = None
+
+    @staticmethod
+    def handshake_error(request: Request) -> str | None:
+        """Why request is not a valid WebSocket upgrade, or None if it is."""
+        if request.method != "GET":
+            return "websocket upgrade requires GET"
+        if request.headers.get("upgrade", "").lower() != "websocket" \
+                or "upgrade" not in request.headers.get("connection", "").lower():
+            return "expected websocket upgrade"
+        if request.headers.get("sec-websocket-version") != "13" or not request.headers.get("sec-websocket-key"):
+            return "unsupported websocket version"
+        if not WebSocket.origin_allowed(request):
+            return "cross-origin websocket not allowed"
+        return None
+
+    @staticmethod
+    def origin_allowed(request: Request) -> bool:
+        """No Origin (non-browser client), the server's own host, or a localhost page."""
+        origin = request.headers.get("origin")
+        if origin is None:
+            return True
+        try:
+            parts = urlsplit(origin)
+            hostname = parts.hostname
+        except ValueError:
+            return False
+        if parts.scheme not in ("http", "https") or not hostname:
+            return False
+        return parts.netloc.lower() == request.headers.get("host", "").lower() or hostname in _LOCAL_HOSTS
+
+    @staticmethod
+    def accept_key(key: str) -> str:
+        return base64.b64encode(hashlib.sha1((key + _WS_GUID).encode("ascii")).digest()).decode("ascii")
+
+    @property
+    def buffered(self) -> int:
+        """Bytes written but not yet sent to the client (for dropping frames to slow clients)."""
+        if self._writer is None or self._writer.transport is None:
+            return 0
+        return self._writer.transport.get_write_buffer_size()
+
+    async def _frame(self) -> tuple[bool, int, bytes]:
+        b0, b1 = await self._reader.readexactly(2)
+        length = b1 & 0x7F
+        if length == 126:
+            length = struct.unpack(">H", await self._reader.readexactly(2))[0]
+        elif length == 127:
+            length = struct.unpack(">Q", await self._reader.readexactly(8))[0]
+        if length > WS_MAX_MESSAGE_BYTES:
+            raise ValueError("websocket message too large")
+        mask = await self._reader.readexactly(4) if b1 & 0x80 else b""
+        payload = await self._reader.readexactly(length) if length else b""
+        if mask and payload:
+            key = (mask * (length // 4 + 1))[:length]
+            payload = (int.from_bytes(payload, "little") ^ int.from_bytes(key, "little")).to_bytes(length, "little")
+        return bool(b0 & 0x80), b0 & 0x0F, payload
+
+    async def receive(self) -> str | bytes | None:
+        message, opcode = bytearray(), None
+        while not self.closed:
+            try:
+                fin, op, payload = await self._frame()
+            except (asyncio.IncompleteReadError, ConnectionError, OSError):
+                self.closed = True
+                return None
+            except ValueError:
+                await self.close(1009)
+                return None
+            if op == 0x8:
+                await self.close(1000)
+                return None
+            if op == 0x9:
+                self._write(0xA, payload)
+                continue
+            if op == 0xA:
+                continue
+            if op in (0x1, 0x2):
+                message, opcode = bytearray(payload), op
+            else:
+                message += payload
+            if len(message) > WS_MAX_MESSAGE_BYTES:
+                await self.close(1009)
+                return None
+            if fin and opcode is not None:
+                return message.decode("utf-8", "replace") if opcode == 0x1 else bytes(message)
+        return None
+
+    def _write(self, opcode: int, payload: bytes) -> None:
+        n = len(payload)
+        if n < 126:
+            head = struct.pack(">BB", 0x80 | opcode, n)
+        elif n < 65536:
+            head = struct.pack(">BBH", 0x80 | opcode, 126, n)
+        else:
+            head = struct.pack(">BBQ", 0x80 | opcode, 127, n)
+        self._writer.write(head + payload)
+
+    async def send(self, data: str | bytes) -> bool:
+        """Send one text (str) or binary (bytes) message; False once the connection is gone."""
+        if self.closed:
+            return False
+        try:
+            self._write(0x1 if isinstance(data, str) else 0x2, data.encode("utf-8") if isinstance(data, str) else data)
+            await self._writer.drain()
+            return True
+        except (ConnectionError, OSError):
+            self.closed = True
+            return False
+
+    async def close(self, code: int = 1000) -> None:
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            self._write(0x8, struct.pack(">H", code))
+            await self._writer.drain()
+        except (ConnectionError, OSError):
+            pass
+
+
+Dispatcher = Callable[[Request], Awaitable["Response | EventStream | WebSocket"]]
+
+
+async def _read_request(reader: asyncio.StreamReader, writer: asyncio.StreamWriter | None = None,
+                        stream_body: Callable[[Request], bool] | None = None) -> Request | None:
+    try:
+        head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), KEEP_ALIVE_TIMEOUT)
+    except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+        return None
+    except asyncio.LimitOverrunError:
+        raise ValueError("header too large")
+    if len(head) > MAX_HEADER_BYTES:
+        raise ValueError("header too large")
+
+    lines = head.decode("iso-8859-1").split("\r\n")
+    try:
+        method, target, version = lines[0].split(" ", 2)
+    except ValueError:
+        raise ValueError("bad request line")
+    headers: dict[str, str] = {}
+    for line in lines[1:]:
+        if not line:
+            continue
+        name, _, value = line.partition(":")
+        headers[name.strip().lower()] = value.strip()
+
+    chunked = "chunked" in headers.get("transfer-encoding", "").lower()
+    try:
+        length = None if chunked else int(headers.get("content-length", "0") or 0)
+    except ValueError:
+        raise ValueError("bad content-length")
+    expect = headers.get("expect", "").lower() == "100-continue"
+    request = Request(method.upper(), target, version, headers)
+    body = BodyReader(reader, writer, length, expect)
+    if stream_body is not None and stream_body(request):
+        request.body_reader = body
+        return request
+    if length is not None and length > MAX_BODY_BYTES:
+        raise ValueError("body too large")
+    request.body = await body.read_all(MAX_BODY_BYTES)
+    return request
+
+
+def _head_bytes(status: int, headers: list[tuple[str, str]]) -> bytes:
+    lines = [f"HTTP/1.1 {status} {HTTPStatus(status).phrase}"]
+    lines.extend(f"{k}: {v}" for k, v in headers)
+    return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+
+
+async def _write_response(writer: asyncio.StreamWriter, request: Request, resp: Response, keep_alive: bool) -> None:
+    headers = [h for h in resp.headers if h[0].lower() not in ("content-length", "connection")]
+    body = b"" if request.method == "HEAD" else resp.body
+    headers.append(("Content-Length", str(len(resp.body))))
+    headers.append(("Connection", "keep-alive" if keep_alive else "close"))
+    writer.write(_head_bytes(resp.status, headers) + body)
+    await writer.drain()
+
+
+async def _write_stream(reader: asyncio.StreamReader, writer: asyncio.StreamWriter, stream: EventStream) -> None:
+    headers = [
+        ("Content-Type", "text/event-stream; charset=utf-8"),
+        ("Cache-Control", "no-cache"),
+        ("Access-Control-Allow-Origin", "*"),
+        ("X-Accel-Buffering", "no"),
+        ("Connection", "close"),
+    ] + stream.headers
+    writer.write(_head_bytes(200, headers))
+    await writer.drain()
+
+    async def _watch_disconnect():
+        # 请求体已读完，客户端再有任何可读结果（EOF）都意味着断开
+        try:
+            await reader.read(1)
+        except Exception:
+            pass
+        stream._mark_disconnected()
+
+    watcher = asyncio.ensure_future(_watch_disconnect())
+    closed = False
+    try:
+        while not stream.disconnected.is_set():
+            item = await stream.next_event(SSE_PING_INTERVAL)
+            if item is _CLOSE:
+                closed = True
+                return
+            if item is None:
+                writer.write(b": ping\n\n")
+            elif isinstance(item, str):
+                writer.write(f"data: {item}\n\n".encode("utf-8"))
+            else:
+                writer.write(f"data: {json.dumps(item, ensure_ascii=False)}\n\n".encode("utf-8"))
+            await writer.drain()
+    except (ConnectionError, OSError):
+        pass
+    finally:
+        watcher.cancel()
+        if closed:
+            stream.disconnected.set()
+        else:
+            stream._mark_disconnected()
+
+
+async def _run_websocket(reader: asyncio.StreamReader, writer: asyncio.StreamWriter, ws: WebSocket) -> None:
+    writer.write(_head_bytes(101, [
+        ("Upgrade", "websocket"),
+        ("Connection", "Upgrade"),
+        ("Sec-WebSocket-Accept", WebSocket.accept_key(ws.request.headers["sec-websocket-key"])),
+    ]))
+    await writer.drain()
+    ws._reader, ws._writer = reader, writer
+    try:
+        await ws.handler(ws)
+    except Exception as e:
+        print(f"[ws] {ws.request.path} handler failed: {e!r}")
+        await ws.close(1011)
+    else:
+        await ws.close(1000)
+
+
+async def handle_connection(reader: asyncio.StreamReader, writer: asyncio.StreamWriter, dispatch: Dispatcher,
+                            stream_body: Callable[[Request], bool] | None = None) -> None:
+    """Serve requests on one connection (keep-alive) until it closes or switches to SSE / WebSocket.
+
+    stream_body(request) → True 表示该请求的请求体交给处理函数流式读取。
+    """
+    try:
+        sock = writer.get_extra_info("socket")
+        if sock is not None:
+            import socket
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        while True:
+            try:
+                request = await _read_request(reader, writer, stream_body)
+            except ValueError as e:
+                await _write_response(writer, Request("GET", "/", "HTTP/1.1", {}), Response.error(400, str(e)), False)
+                return
+            if request is None:
+                return
+            try:
+                result = await dispatch(request)
+            except Exception as e:  # pragma: no cover - handler bug
+                import traceback
+                traceback.print_exc()
+                result = Response.error(500, str(e))
+            if isinstance(result, EventStream):
+                await _write_stream(reader, writer, result)
+                return
+            if isinstance(result, WebSocket):
+                await _run_websocket(reader, writer, result)
+                return
+            # 流式请求体未读完（如提前拒绝上传）时，连接上剩余的数据无法再解析为请求
+            keep_alive = request.keep_alive and (request.body_reader is None or request.body_reader.done)
+            await _write_response(writer, request, result, keep_alive)
+            if not keep_alive:
+                return
+    except (ConnectionError, OSError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        try:
+            writer.close()
+        except Exception:
+            pass
@@ -1,32 +1,121 @@
 """统一 API handler：chat / shaders / launch / speech / settings。"""
 from __future__ import annotations
 
+import asyncio
 import json
 import os
 import sys
 import threading
 import time
-from http.server import BaseHTTPRequestHandler
 from pathlib import Path
 
 ROOT = Path(__file__).resolve().parent.parent
 if str(ROOT) not in sys.path:
     sys.path.insert(0, str(ROOT))
 
+from WebEngine.aio_http import EventStream, Request, Response
+from WebEngine.jobs import Job, JobCancelled, QueueFull, get_scheduler
+from WebEngine.music_library import AUDIO_SUFFIXES, UPLOAD_DIR_NAME, UploadError, get_music_library
+from WebEngine.paths import SHADERS_DIR
 from WebEngine.settings import Settings
-from WebEngine.ai_service import AIService
-from ai_pipeline.tools.session_tools import list_conversations, delete_session, new_session, load_messages, pin_conversation, rename_session
+from WebEngine.shader_index import get_shader_index
+from WebEngine.static_cache import StaticCache
+from WebEngine.viewer_socket import handle_viewer_socket
+from WebEngine.session_registry import SessionRegistry
+from ai_pipeline.tools.session_tools import (list_conversations, delete_session, new_session, get_message,
+                                             load_messages, message_page, pin_conversation, rename_session)
 
 
-class APIHandler(BaseHTTPRequestHandler):
-    """处理所有 API 路由和静态文件。"""
+# 会话消息分页：默认 / 最大每页条数；超过 LAZY_MESSAGE_CHARS 的 shader 代码消息只下发摘要，展开时按 idx 获取
+MESSAGE_PAGE_SIZE = 30
+MESSAGE_PAGE_MAX = 200
+LAZY_MESSAGE_CHARS = 2000
+
+
+def _is_shader_text(text: str) -> bool:
+    return "#version" in text or "void main" in text
+
+
+def _message_view(idx: int, message: dict) -> dict:
+    content = message.get("content") or ""
+    view = {"idx": idx, "role": message.get("role", ""), "content": content}
+    if len(content) > LAZY_MESSAGE_CHARS and _is_shader_text(content):
+        view["content"] = ""
+        view["lazy"] = {"chars": len(content), "lines": content.count("\n") + 1, "preview": content[:160]}
+    return view
+
+
+def _message_page_response(session_id: str, before: int | None, limit) -> dict:
+    try:
+        limit = min(MESSAGE_PAGE_MAX, max(1, int(limit or MESSAGE_PAGE_SIZE)))
+    except (TypeError, ValueError):
+        limit = MESSAGE_PAGE_SIZE
+    start, messages, total = message_page(session_id, before, limit)
+    return {
+        "session_id": session_id,
+        "messages": [_message_view(start + i, m) for i, m in enumerate(messages)],
+        "total": total,
+        # 下一页（更早）的游标；None 表示已到最早一条
+        "cursor": start if start > 0 else None,
+    }
+
+
+def _latest_shader(session_id: str) -> dict | None:
+    messages = load_messages(session_id)
+    for i in range(len(messages) - 1, -1, -1):
+        m = messages[i]
+        if m.get("role") == "assistant" and _is_shader_text(m.get("content") or ""):
+            return {"idx": i, "content": m["content"]}
+    return None
+
+
+class APIHandler:
+    """处理所有 API 路由和静态文件。
+
+    每个请求一个实例，handle() 在线程池中执行；处理函数通过 _send_json / _send_file /
+    _sse_open 给出响应，事件循环拿到响应后立即开始发送（SSE 生产者可继续运行）。
+    """
 
     _settings: Settings | None = None
-    _ai_service: AIService | None = None
+    # 按 session_id 缓存 AIService；不同会话并行，同一会话在会话锁上排队
+    _sessions = SessionRegistry(capacity=int(os.environ.get("MS_SESSION_CACHE", "32")))
+    # html 目录的静态资源：内存缓存 + 预压缩 + ETag
+    _static = StaticCache(Path(__file__).resolve().parent / "html")
     _speech_service = None  # 延迟初始化
     _speech_lock = threading.Lock()
     _lock = threading.Lock()
 
+    def __init__(self, request: Request, loop: asyncio.AbstractEventLoop):
+        self.request = request
+        self.command = request.method
+        self.path = request.target
+        self.headers = request.headers
+        self._loop = loop
+        self.response_ready: asyncio.Future = loop.create_future()
+        self._stream: EventStream | None = None
+
+    def handle(self) -> None:
+        if self.command in ("GET", "HEAD"):
+            self.do_GET()
+        elif self.command == "POST":
+            self.do_POST()
+        elif self.command == "OPTIONS":
+            self.do_OPTIONS()
+        else:
+            self.send_error(405)
+        if self._stream is not None and not self.response_ready.done():
+            # 兜底：SSE 处理函数异常退出时也要结束流
+            self._stream.close()
+
+    def _respond(self, resp: "Response | EventStream") -> None:
+        def _set():
+            if not self.response_ready.done():
+                self.response_ready.set_result(resp)
+        self._loop.call_soon_threadsafe(_set)
+
+    def send_error(self, status: int, message: str = ""):
+        self._respond(Response.error(status, message))
+
     @staticmethod
     def _get_speech():
         if APIHandler._speech_service is None:
@@ -43,47 +132,71 @@ class APIHandler(BaseHTTPRequestHandler):
         return self.__class__._settings
 
     @property
-    def ai(self) -> AIService:
-        if self.__class__._ai_service is None:
-            self.__class__._ai_service = AIService()
-        return self.__class__._ai_service
+    def sessions(self) -> SessionRegistry:
+        return self.__class__._sessions
 
     def _html_dir(self) -> Path:
         return Path(__file__).resolve().parent / "html"
 
     def _send_json(self, data, status=200):
-        body = json.dumps(data, ensure_ascii=False).encode("utf-8")
-        self.send_response(status)
-        self.send_header("Content-Type", "application/json; charset=utf-8")
-        self.send_header("Content-Length", str(len(body)))
-        self.send_header("Access-Control-Allow-Origin", "*")
-        self.end_headers()
-        self.wfile.write(body)
-
-    def _send_file(self, path, content_type):
-        fp = (self._html_dir() / path).resolve()
-        html_root = self._html_dir().resolve()
-        if html_root not in fp.parents and fp != html_root:
+        self._respond(Response.json(data, status))
+
+    def _send_file(self, path, content_type=None):
+        fp = self._static.resolve(path)
+        if fp is None:
             self.send_error(403)
             return
-        if fp.is_file():
-            content = fp.read_bytes()
-            self.send_response(200)
-            self.send_header("Content-Type", content_type)
-            self.send_header("Content-Length", str(len(content)))
-            self.end_headers()
-            self.wfile.write(content)
-        else:
-            self.send_error(404)
+        self._respond(self._static.response(fp, self.headers, content_type))
 
     def _read_body(self) -> dict:
-        length = int(self.headers.get("Content-Length", 0))
-        if length == 0:
-            return {}
+        return self.request.json()
+
+    # ---- SSE ----
+    def _sse_open(self) -> EventStream:
+        """开始 SSE 响应；返回的 stream 可在当前工作线程中持续 send()。"""
+        self._stream = EventStream(self._loop, label=self.request.path, started=self.request.received_at)
+        self._respond(self._stream)
+        return self._stream
+
+    def _sse_relay(self, stream: EventStream, produce, error_prefix: str, fallback: str) -> None:
+        """在当前线程运行 produce 并把事件写入 stream，结束后关闭流。"""
+        self._relay_events(stream.send, produce, error_prefix, fallback)
+        stream.close()
+
+    def _relay_events(self, send, produce, error_prefix: str, fallback: str) -> None:
+        """运行 produce(on_event)，Agent 事件到达即 send；结束后补发完整结果并发送 [DONE]。
+
+        token → {"chunk", "type"}；其余类型化事件（tool_call_started / tool_result /
+        compile_result / final_code）→ {"event", "name", "text", "data"}。
+        若最终文本与已流出的 token 不一致（如 build 阶段提取出的 GLSL），发送 final 事件让前端替换。
+        任务被取消时 JobCancelled 原样抛出，交由调度器结束任务。
+        """
+        parts: list[str] = []
+
+        def on_event(event) -> None:
+            if event.kind == "token":
+                parts.append(event.text)
+                send({"chunk": event.text, "type": "chat"})
+            elif event.kind == "final_code":
+                # 代码随 final 事件下发，这里只转发诊断信息
+                send({"event": "final_code", "data": event.data})
+            else:
+                send(event.to_dict())
+
         try:
-            return json.loads(self.rfile.read(length).decode("utf-8"))
-        except json.JSONDecodeError:
-            return {}
+            text = produce(on_event)
+        except JobCancelled:
+            raise
+        except Exception as e:
+            text = self._debug_error_message(error_prefix, e, fallback)
+        is_shader = "#version" in text or "void main" in text
+        rtype = "shader" if is_shader else "chat"
+        streamed = "".join(parts)
+        if not streamed:
+            send({"chunk": text, "type": rtype})
+        elif streamed != text:
+            send({"final": text, "type": rtype})
+        send("[DONE]")
 
     def _debug_error_message(self, prefix: str, exc: Exception, fallback: str) -> str:
         """Return detailed errors only when MS_DEBUG_ERRORS=1 is set."""
@@ -93,7 +206,91 @@ class APIHandler(BaseHTTPRequestHandler):
             return f"{prefix}：{type(exc).__name__}: {exc}"
         return fallback
 
-    # ---- Static files ----
+    # ---- Jobs ----
+    def _submit_job(self, kind: str, body: dict) -> Job | None:
+        """把 analyze / build 提交到有界调度器；队列已满时直接回 429 并返回 None。"""
+        prompt = body.get("prompt", "").strip()
+        if kind not in ("analyze", "build"):
+            self._send_json({"success": False, "error": f"未知任务类型: {kind}"}, 400)
+            return None
+        if not prompt:
+            self._send_json({"success": False, "error": "空 prompt"}, 400)
+            return None
+        session_id = self._resolve_session(body.get("session_id", ""))
+        analysis_context = body.get("analysis_context", "")
+        sessions = self.sessions
+
+        def run(job: Job):
+            def on_event(event, forward):
+                job.check()
+                forward(event)
+
+            # 调度器已让同一会话的任务串行（submit 传入 session_id），会话锁只防与非任务请求并发；
+            # analyze / build 内部已 auto-save
+            with sessions.session(session_id) as ai:
+                job.check()
+                if kind == "analyze":
+                    self._relay_events(
+                        job.emit,
+                        lambda fwd: ai.analyze(prompt, on_event=lambda e: on_event(e, fwd)),
+                        "分析失败", "分析失败，请重试。",
+                    )
+                else:
+                    self._relay_events(
+                        job.emit,
+                        lambda fwd: ai._build_shader(prompt, adjust=False, analysis_context=analysis_context,
+                                                     on_event=lambda e: on_event(e, fwd)),
+                        "生成失败", "生成失败，请重试。",
+                    )
+
+        try:
+            return get_scheduler().submit(kind, run, session_id=session_id)
+        except QueueFull as e:
+            self._send_json({"success": False, "error": f"服务繁忙，请稍后重试（{e}）"}, 429)
+            return None
+
+    def _stream_job(self, job: Job, cancel_on_disconnect: bool = True) -> None:
+        """以 SSE 转发任务事件（先回放已有事件）；任务结束时关闭流。
+
+        cancel_on_disconnect=True 时，最后一个订阅者断开即取消任务。
+        """
+        stream = self._sse_open()
+        stream.send({"session_id": job.session_id, "job_id": job.id})
+
+        def _gone():
+            if job.unsubscribe(stream.send) == 0 and cancel_on_disconnect:
+                get_scheduler().cancel(job.id)
+
+        stream.on_disconnect(_gone)
+        # 不在当前线程等待任务：事件由任务线程直接写入 stream
+        job.subscribe(stream.send, stream.close)
+
+    def _handle_job_submit(self, body: dict):
+        """POST /api/jobs {kind, prompt, session_id, analysis_context} → {job_id, position}"""
+        job = self._submit_job(body.get("kind", "build"), body)
+        if job is not None:
+            self._send_json({"success": True, "job_id": job.id, "session_id": job.session_id,
+                             "position": get_scheduler().position(job)}, 202)
+
+    def _handle_job_stream(self, params: dict):
+        job = get_scheduler().get(params.get("id", ""))
+        if job is None:
+            self._send_json({"success": False, "error": "任务不存在"}, 404)
+            return
+        self._stream_job(job, cancel_on_disconnect=params.get("cancel_on_disconnect", "1") != "0")
+
+    def _handle_job_status(self, params: dict):
+        scheduler = get_scheduler()
+        job = scheduler.get(params.get("id", ""))
+        if job is None:
+            self._send_json({"success": False, "error": "任务不存在"}, 404)
+            return
+        self._send_json({"success": True, **job.to_dict(), "position": scheduler.position(job)})
+
+    def _handle_job_cancel(self, body: dict):
+        ok = get_scheduler().cancel(body.get("job_id", ""))
+        self._send_json({"success": ok})
+
     def do_GET(self):
         path = self.path.split("?")[0]
         params = {}
@@ -108,28 +305,39 @@ class APIHandler(BaseHTTPRequestHandler):
         elif path == "/settings.html":
             self._send_file("settings.html", "text/html; charset=utf-8")
         elif path.startswith("/static/"):
-            content_types = {
-                ".css": "text/css; charset=utf-8",
-                ".js": "application/javascript; charset=utf-8",
-                ".png": "image/png",
-                ".jpg": "image/jpeg",
-                ".jpeg": "image/jpeg",
-                ".svg": "image/svg+xml",
-            }
-            static_path = path.lstrip("/")
-            self._send_file(static_path, content_types.get(Path(static_path).suffix, "application/octet-stream"))
+            self._send_file(path.lstrip("/"))
         elif path == "/api/settings":
             self._send_json(self.settings.to_dict())
         elif path == "/api/shaders":
-            self._handle_list_shaders()
+            self._handle_list_shaders(params)
         elif path == "/api/shader":
             self._handle_get_shader(params.get("path", ""))
+        elif path == "/api/shader/thumbnail":
+            self._handle_shader_thumbnail(params)
+        elif path == "/api/search":
+            self._handle_search(params)
         elif path == "/api/music":
             self._handle_list_music(params.get("path", ""))
         elif path == "/api/speech/status":
             self._handle_speech_status()
         elif path == "/api/conversations":
             self._handle_list_conversations()
+        elif path == "/api/conversations/messages":
+            self._handle_conversation_messages(params)
+        elif path == "/api/conversations/message":
+            self._handle_conversation_message(params)
+        elif path == "/api/jobs/stream":
+            self._handle_job_stream(params)
+        elif path == "/api/jobs/status":
+            self._handle_job_status(params)
+        elif path == "/api/jobs/metrics":
+            self._send_json(get_scheduler().metrics())
+        elif path == "/api/llm/metrics":
+            from ai_pipeline.llm.pool import get_llm_pool
+            from ai_pipeline.response_cache import get_response_cache
+            cache = get_response_cache()
+            self._send_json({"pool": get_llm_pool().metrics(),
+                             "responses": cache.metrics() if cache is not None else None})
         else:
             self.send_error(404)
 
@@ -145,6 +353,10 @@ class APIHandler(BaseHTTPRequestHandler):
             self._handle_chat_build(body)
         elif path == "/api/chat/stream":
             self._handle_chat_stream(body)
+        elif path == "/api/jobs":
+            self._handle_job_submit(body)
+        elif path == "/api/jobs/cancel":
+            self._handle_job_cancel(body)
         elif path == "/api/settings":
             self._handle_save_settings(body)
         elif path == "/api/shader":
@@ -155,6 +367,8 @@ class APIHandler(BaseHTTPRequestHandler):
             self._handle_delete_shader(body)
         elif path == "/api/launch":
             self._handle_launch(body)
+        elif path in ("/api/viewer/uniform", "/api/viewer/screenshot", "/api/viewer/stop"):
+            self._handle_viewer_command(path.rsplit("/", 1)[1], body)
         elif path == "/api/conversations/new":
             self._handle_new_conversation()
         elif path == "/api/conversations/delete":
@@ -173,11 +387,11 @@ class APIHandler(BaseHTTPRequestHandler):
             self.send_error(404)
 
     def do_OPTIONS(self):
-        self.send_response(204)
-        self.send_header("Access-Control-Allow-Origin", "*")
-        self.send_header("Access-Control-Allow-Methods", "GET, POST, OPTIONS")
-        self.send_header("Access-Control-Allow-Headers", "Content-Type")
-        self.end_headers()
+        self._respond(Response(204, [
+            ("Access-Control-Allow-Origin", "*"),
+            ("Access-Control-Allow-Methods", "GET, POST, OPTIONS"),
+            ("Access-Control-Allow-Headers", "Content-Type"),
+        ]))
 
     # ---- Chat ----
     def _handle_chat(self, body: dict):
@@ -189,170 +403,37 @@ class APIHandler(BaseHTTPRequestHandler):
             self._send_json({"success": False, "error": "空 prompt"}, 400)
             return
 
-        if session_id and session_id != self.ai.session_id:
-            self.ai.switch_to(session_id)
-        elif not self.ai.session_id and mode != "build":
-            from ai_pipeline.tools.session_tools import new_session
-            new_id = new_session()
-            self.ai.switch_to(new_id)
-
         if mode == "build":
             self._send_json({"success": False, "error": "Build 模式已升级为两阶段。请先 POST /api/chat/analyze 进行分析，确认后再 POST /api/chat/build 生成代码。"})
             return
 
+        session_id = self._resolve_session(session_id)
         try:
-            code = self.ai.generate(prompt, adjust=adjust, mode=mode)
+            with self.sessions.session(session_id) as ai:
+                code = ai.generate(prompt, adjust=adjust, mode=mode)
             is_shader = "#version" in code or "void main" in code
-            self._send_json({"success": True, "code": code, "type": "shader" if is_shader else "chat"})
+            self._send_json({"success": True, "code": code, "type": "shader" if is_shader else "chat", "session_id": session_id})
         except Exception as e:
             self._send_json({"success": False, "error": str(e)}, 500)
 
-    def _sse_stream(self, text: str, rtype: str):
-        """SSE 流式发送文本（模拟逐字输出效果）。"""
-        import time as _time
-        self.send_response(200)
-        self.send_header("Content-Type", "text/event-stream; charset=utf-8")
-        self.send_header("Cache-Control", "no-cache")
-        self.send_header("Access-Control-Allow-Origin", "*")
-        self.send_header("X-Accel-Buffering", "no")
-        self.end_headers()
-        # 禁用 Nagle 算法，确保小块数据立即发送
-        if hasattr(self.connection, "socket"):
-            self.connection.socket.setsockopt(6, 1, 1)  # TCP_NODELAY
-        # 发送 session_id 元数据事件（仅当有 session_id 时）
-        sid = self.ai.session_id
-        if sid:
-            try:
-                self.wfile.write(f"data: {json.dumps({'session_id': sid})}\n\n".encode("utf-8"))
-                self.wfile.flush()
-            except (BrokenPipeError, ConnectionResetError, OSError):
-                pass
-        try:
-            chunk_size = max(2, len(text) // 60) if len(text) > 60 else 1
-            for i in range(0, len(text), chunk_size):
-                chunk = text[i:i + chunk_size]
-                data = json.dumps({"chunk": chunk, "type": rtype}, ensure_ascii=False)
-                self.wfile.write(f"data: {data}\n\n".encode("utf-8"))
-                self.wfile.flush()
-                _time.sleep(0.04)
-            self.wfile.write("data: [DONE]\n\n".encode("utf-8"))
-            self.wfile.flush()
-        except (BrokenPipeError, ConnectionResetError, OSError):
-            pass
+    @staticmethod
+    def _resolve_session(session_id: str, allow_new: bool = True) -> str:
+        """请求未带 session_id 时新建会话（allow_new=False 时返回空串，使用临时服务）。"""
+        if session_id or not allow_new:
+            return session_id
+        return new_session()
 
     def _handle_chat_analyze(self, body: dict):
-        """Analyze 端点：需求分析（先发心跳，再阻塞调用，最后流式输出）。"""
-        prompt = body.get("prompt", "").strip()
-        session_id = body.get("session_id", "")
-        if not prompt:
-            self._send_json({"success": False, "error": "空 prompt"}, 400)
-            return
-
-        # 切换/初始化会话
-        if session_id and session_id != self.ai.session_id:
-            self.ai.switch_to(session_id)
-        elif not self.ai.session_id:
-            from ai_pipeline.tools.session_tools import new_session
-            new_id = new_session()
-            self.ai.switch_to(new_id)
-
-        import time as _time
-        self.send_response(200)
-        self.send_header("Content-Type", "text/event-stream; charset=utf-8")
-        self.send_header("Cache-Control", "no-cache")
-        self.send_header("Access-Control-Allow-Origin", "*")
-        self.send_header("X-Accel-Buffering", "no")
-        self.end_headers()
-        if hasattr(self.connection, "socket"):
-            try: self.connection.socket.setsockopt(6, 1, 1)
-            except Exception: pass
-
-        # 发送 session_id 元数据事件 + 心跳
-        sid_event = json.dumps({"session_id": self.ai.session_id})
-        self.wfile.write(f"data: {sid_event}\n\n".encode("utf-8"))
-        self.wfile.write(b"data: {\"chunk\":\".\",\"type\":\"chat\"}\n\n")
-        self.wfile.flush()
-
-        # 阻塞调用 Agent（analyze 内部已 auto-save）
-        analysis = ""
-        try:
-            analysis = self.ai.analyze(prompt)
-        except Exception as e:
-            analysis = self._debug_error_message("分析失败", e, "分析失败，请重试。")
-
-        # 流式输出分析结果
-        chunk_size = max(2, len(analysis) // 50) if len(analysis) > 50 else 1
-        for i in range(0, len(analysis), chunk_size):
-            chunk = analysis[i:i + chunk_size]
-            data = json.dumps({"chunk": chunk, "type": "chat"}, ensure_ascii=False)
-            try:
-                self.wfile.write(f"data: {data}\n\n".encode("utf-8"))
-                self.wfile.flush()
-                _time.sleep(0.05)
-            except (BrokenPipeError, ConnectionResetError, OSError):
-                return
-        try:
-            self.wfile.write(b"data: [DONE]\n\n")
-            self.wfile.flush()
-        except (BrokenPipeError, ConnectionResetError, OSError):
-            pass
+        """Analyze 端点：需求分析作为任务排队执行，排队位置、LLM token 与工具调用事件通过 SSE 转发。"""
+        job = self._submit_job("analyze", body)
+        if job is not None:
+            self._stream_job(job)
 
     def _handle_chat_build(self, body: dict):
-        """Build 端点：生成 GLSL（先发心跳，再阻塞调用，最后流式输出）。"""
-        prompt = body.get("prompt", "").strip()
-        analysis_context = body.get("analysis_context", "")
-        session_id = body.get("session_id", "")
-        if not prompt:
-            self._send_json({"success": False, "error": "空 prompt"}, 400)
-            return
-
-        if session_id and session_id != self.ai.session_id:
-            self.ai.switch_to(session_id)
-        elif not self.ai.session_id:
-            from ai_pipeline.tools.session_tools import new_session
-            new_id = new_session()
-            self.ai.switch_to(new_id)
-
-        import time as _time
-        self.send_response(200)
-        self.send_header("Content-Type", "text/event-stream; charset=utf-8")
-        self.send_header("Cache-Control", "no-cache")
-        self.send_header("Access-Control-Allow-Origin", "*")
-        self.send_header("X-Accel-Buffering", "no")
-        self.end_headers()
-        if hasattr(self.connection, "socket"):
-            try: self.connection.socket.setsockopt(6, 1, 1)
-            except Exception: pass
-
-        # 发送 session_id 元数据事件 + 心跳
-        sid_event = json.dumps({"session_id": self.ai.session_id})
-        self.wfile.write(f"data: {sid_event}\n\n".encode("utf-8"))
-        self.wfile.write(b"data: {\"chunk\":\".\",\"type\":\"chat\"}\n\n")
-        self.wfile.flush()
-
-        code = ""
-        try:
-            code = self.ai._build_shader(prompt, adjust=False, analysis_context=analysis_context)
-        except Exception as e:
-            code = self._debug_error_message("生成失败", e, "生成失败，请重试。")
-
-        is_shader = "#version" in code or "void main" in code
-        rtype = "shader" if is_shader else "chat"
-        chunk_size = max(1, len(code) // 50) if len(code) > 50 else 1
-        for i in range(0, len(code), chunk_size):
-            chunk = code[i:i + chunk_size]
-            data = json.dumps({"chunk": chunk, "type": rtype}, ensure_ascii=False)
-            try:
-                self.wfile.write(f"data: {data}\n\n".encode("utf-8"))
-                self.wfile.flush()
-                _time.sleep(0.05)
-            except (BrokenPipeError, ConnectionResetError, OSError):
-                return
-        try:
-            self.wfile.write(b"data: [DONE]\n\n")
-            self.wfile.flush()
-        except (BrokenPipeError, ConnectionResetError, OSError):
-            pass
+        """Build 端点：生成 GLSL 作为任务排队执行，完成后以 final 事件给出提取后的代码。"""
+        job = self._submit_job("build", body)
+        if job is not None:
+            self._stream_job(job)
 
     def _handle_chat_stream(self, body: dict):
         """SSE 流式对话端点。"""
@@ -364,46 +445,17 @@ class APIHandler(BaseHTTPRequestHandler):
             self._send_json({"success": False, "error": "空 prompt"}, 400)
             return
 
-        if session_id and session_id != self.ai.session_id:
-            self.ai.switch_to(session_id)
-        elif not self.ai.session_id and mode != "build":
-            from ai_pipeline.tools.session_tools import new_session
-            new_id = new_session()
-            self.ai.switch_to(new_id)
-
-        import time as _time
-        self.send_response(200)
-        self.send_header("Content-Type", "text/event-stream; charset=utf-8")
-        self.send_header("Cache-Control", "no-cache")
-        self.send_header("Access-Control-Allow-Origin", "*")
-        self.end_headers()
-
+        session_id = self._resolve_session(session_id, allow_new=mode != "build")
+        stream = self._sse_open()
         # 发送 session_id 元数据事件
-        sid_event = json.dumps({"session_id": self.ai.session_id})
-        try:
-            self.wfile.write(f"data: {sid_event}\n\n".encode("utf-8"))
-            self.wfile.flush()
-        except (BrokenPipeError, ConnectionResetError, OSError):
-            pass
-
-        try:
-            full = self.ai.generate(prompt, adjust=adjust, mode=mode)
-            is_shader = "#version" in full or "void main" in full
-            rtype = "shader" if is_shader else "chat"
-            # 按字符块流式发送
-            chunk_size = max(1, len(full) // 30) if len(full) > 30 else len(full)
-            for i in range(0, len(full), chunk_size):
-                chunk = full[i:i + chunk_size]
-                data = json.dumps({"chunk": chunk, "type": rtype}, ensure_ascii=False)
-                self.wfile.write(f"data: {data}\n\n".encode("utf-8"))
-                self.wfile.flush()
-                _time.sleep(0.02)
-            self.wfile.write("data: [DONE]\n\n".encode("utf-8"))
-            self.wfile.flush()
-        except Exception as e:
-            data = json.dumps({"error": str(e)}, ensure_ascii=False)
-            self.wfile.write(f"data: {data}\n\n".encode("utf-8"))
-            self.wfile.flush()
+        if session_id:
+            stream.send({"session_id": session_id})
+        with self.sessions.session(session_id) as ai:
+            self._sse_relay(
+                stream,
+                lambda on_event: ai.generate(prompt, adjust=adjust, mode=mode, on_event=on_event),
+                "对话失败", "对话失败，请重试。",
+            )
 
     # ---- Conversations ----
     def _handle_list_conversations(self):
@@ -411,9 +463,8 @@ class APIHandler(BaseHTTPRequestHandler):
         self._send_json(list_conversations())
 
     def _handle_new_conversation(self):
-        """POST /api/conversations/new → 创建新会话并切换到它。"""
+        """POST /api/conversations/new → 创建新会话。"""
         session_id = new_session()
-        self.ai.switch_to(session_id)
         self._send_json({
             "session_id": session_id,
             "title": "新对话",
@@ -427,33 +478,55 @@ class APIHandler(BaseHTTPRequestHandler):
             self._send_json({"ok": False, "error": "缺少 session_id"}, 400)
             return
 
-        is_current = session_id == self.ai.session_id
-        delete_session(session_id)
+        # 等待该会话上进行中的请求结束后再删除，并丢弃缓存（不回写）
+        with self.sessions.session(session_id):
+            delete_session(session_id)
+            self.sessions.discard(session_id)
 
-        # 如果当前会话被删除，切换到第一个可用会话或创建新会话
-        if is_current:
-            convs = list_conversations()
-            if convs:
-                next_id = convs[0]["session_id"]
-                self.ai.switch_to(next_id)
-            else:
-                new_id = new_session()
-                self.ai.switch_to(new_id)
+        # 会话全部删除后保留一个空会话
+        if not list_conversations():
+            new_session()
 
         self._send_json({"ok": True})
 
     def _handle_switch_conversation(self, body: dict):
-        """POST /api/conversations/switch → 切换到指定会话。"""
+        """POST /api/conversations/switch {session_id, limit} → 最新一页消息 + 编辑器要显示的最新 shader。
+
+        不经过 AIService：直接读会话缓存，更早的消息由前端按 cursor 分页拉取。
+        """
         session_id = body.get("session_id", "")
         if not session_id:
             self._send_json({"error": "缺少 session_id"}, 400)
             return
+        page = _message_page_response(session_id, None, body.get("limit"))
+        page["shader"] = _latest_shader(session_id)
+        self._send_json(page)
 
-        messages = self.ai.switch_to(session_id)
-        self._send_json({
-            "session_id": session_id,
-            "messages": messages,
-        })
+    def _handle_conversation_messages(self, params: dict):
+        """GET /api/conversations/messages?session_id=&before=&limit= → 更早的一页消息。"""
+        session_id = params.get("session_id", "")
+        if not session_id:
+            self._send_json({"error": "缺少 session_id"}, 400)
+            return
+        try:
+            before = int(params["before"]) if params.get("before") else None
+        except ValueError:
+            self._send_json({"error": "before 必须是整数"}, 400)
+            return
+        self._send_json(_message_page_response(session_id, before, params.get("limit")))
+
+    def _handle_conversation_message(self, params: dict):
+        """GET /api/conversations/message?session_id=&idx= → 单条完整消息（展开懒加载的代码）。"""
+        try:
+            idx = int(params.get("idx", ""))
+        except ValueError:
+            self._send_json({"error": "idx 必须是整数"}, 400)
+            return
+        message = get_message(params.get("session_id", ""), idx)
+        if message is None:
+            self._send_json({"error": "消息不存在"}, 404)
+            return
+        self._send_json({"idx": idx, "role": message.get("role", ""), "content": message.get("content") or ""})
 
     def _handle_pin_conversation(self, body: dict):
         """POST /api/conversations/pin → 置顶/取消置顶会话。"""
@@ -479,22 +552,61 @@ class APIHandler(BaseHTTPRequestHandler):
         self._send_json({"ok": ok})
 
     # ---- Shaders ----
-    def _handle_list_shaders(self):
-        shaders_dir = Path(__file__).resolve().parent.parent / "shaders"
-        files = []
-        if shaders_dir.is_dir():
-            for fp in sorted(shaders_dir.rglob("*.glsl"), key=lambda p: p.stat().st_mtime, reverse=True):
-                try:
-                    st = fp.stat()
-                    files.append({
-                        "name": fp.name,
-                        "path": str(fp.relative_to(shaders_dir.parent)).replace("\\", "/"),
-                        "size": st.st_size,
-                        "modified": time.strftime("%Y-%m-%d %H:%M", time.localtime(st.st_mtime)),
-                    })
-                except OSError:
-                    continue
-        self._send_json(files)
+    def _handle_list_shaders(self, params: dict):
+        """GET /api/shaders?offset=&limit=&sort=mtime|name|size&order=desc|asc&q=&dir= → 一页索引结果"""
+        try:
+            page = get_shader_index().query(
+                offset=int(params.get("offset", 0) or 0),
+                limit=int(params.get("limit", 50) or 50),
+                sort=params.get("sort", "mtime"),
+                order=params.get("order", "desc"),
+                q=params.get("q", "").strip(),
+                directory=params.get("dir", "").strip(),
+            )
+        except ValueError:
+            self._send_json({"error": "offset/limit 必须是整数"}, 400)
+            return
+        self._attach_thumbnails(page["items"])
+        self._send_json(page)
+
+    @staticmethod
+    def _attach_thumbnails(items: list[dict]) -> None:
+        """给列表项加上 thumbnail_url（带内容哈希，可长期缓存），并为缺失的项排队渲染。"""
+        from urllib.parse import quote
+        from WebEngine.thumbnails import get_thumbnail_service, thumbnails_enabled
+        if not thumbnails_enabled():
+            return
+        get_thumbnail_service().schedule(items)
+        for item in items:
+            item["thumbnail_url"] = f"/api/shader/thumbnail?path={quote(item['path'])}&v={item['hash'][:12]}"
+
+    def _handle_shader_thumbnail(self, params: dict):
+        """GET /api/shader/thumbnail?path= → PNG（帧纵向拼接）；未生成时 202 并排队渲染"""
+        from WebEngine.thumbnails import get_thumbnail_service, thumbnails_enabled
+        item = get_shader_index().get(params.get("path", ""))
+        if item is None or not thumbnails_enabled():
+            self.send_error(404)
+            return
+        service = get_thumbnail_service()
+        state = service.request(item["path"], item["hash"])
+        if state == "ready":
+            self._respond(service.response(item["hash"], self.headers))
+        elif state == "pending":
+            self._send_json({"status": "pending"}, 202)
+        else:
+            self._send_json({"status": state}, 404)
+
+    def _handle_search(self, params: dict):
+        """GET /api/search?q=&type=shader|conversation&limit= → 全文 + 结构化检索（语法见 search_index）"""
+        from WebEngine.search_index import search
+        try:
+            limit = int(params.get("limit", 20) or 20)
+        except ValueError:
+            limit = 20
+        result = search(params.get("q", ""), kind=params.get("type", ""), limit=limit)
+        if result.get("shaders"):
+            self._attach_thumbnails(result["shaders"])
+        self._send_json(result)
 
     def _handle_get_shader(self, relative_path: str):
         if not relative_path:
@@ -523,6 +635,7 @@ class APIHandler(BaseHTTPRequestHandler):
         safe_name = "".join(c for c in name if c.isalnum() or c in "_-") or "shader"
         fp = out_dir / f"{safe_name}.glsl"
         fp.write_text(code, encoding="utf-8")
+        get_shader_index().touch(fp)
         self._send_json({"ok": True, "path": str(fp.relative_to(root)).replace("\\", "/")})
 
     def _handle_rename_shader(self, body: dict):
@@ -543,6 +656,9 @@ class APIHandler(BaseHTTPRequestHandler):
             self._send_json({"ok": False, "error": "目标文件已存在"}, 409)
             return
         fp.rename(new_fp)
+        index = get_shader_index()
+        index.remove(path)
+        index.touch(new_fp)
         self._send_json({"ok": True})
 
     def _handle_delete_shader(self, body: dict):
@@ -557,15 +673,34 @@ class APIHandler(BaseHTTPRequestHandler):
             self._send_json({"ok": False, "error": f"文件不存在: {path}"}, 404)
             return
         fp.unlink()
+        get_shader_index().remove(path)
         self._send_json({"ok": True})
 
     # ---- Launch ----
     def _handle_launch(self, body: dict):
+        if body.get("paths"):
+            self._handle_launch_multi(body.get("paths"))
+            return
         code = body.get("code", "")
         source_path = body.get("path", "")
         if not code.strip():
             self._send_json({"ok": False, "error": "空代码"}, 400)
             return
+        if os.environ.get("SHADER_VIEWER_DAEMON", "1") != "0":
+            # 优先复用常驻渲染进程：只需编译，不重新打开音频/摄像头/窗口
+            try:
+                from WebEngine.launch import launch_in_daemon
+                reply = launch_in_daemon(code, source_path if source_path else None)
+                if source_path:
+                    get_shader_index().set_compile_status(source_path, bool(reply.get("ok")),
+                                                         reply.get("error", ""), source=code)
+                if reply.get("ok"):
+                    self._send_json({"ok": True, "daemon": True, "compile_ms": reply.get("compile_ms")})
+                else:
+                    self._send_json({"ok": False, "error": reply.get("error", "编译失败")}, 400)
+                return
+            except ConnectionError as e:
+                print(f"[launch] viewer daemon unavailable, falling back to process: {e}")
         try:
             from WebEngine.launch import launch_borderless_process
             proc = launch_borderless_process(code, source_path if source_path else None)
@@ -573,6 +708,43 @@ class APIHandler(BaseHTTPRequestHandler):
         except Exception as e:
             self._send_json({"ok": False, "error": str(e)}, 500)
 
+    def _handle_launch_multi(self, paths):
+        """POST /api/launch {"paths": [...]} → 一个进程打开多个窗口（共享音频/手势/纹理，只占用一次摄像头）"""
+        if not isinstance(paths, list) or not all(isinstance(p, str) for p in paths):
+            self._send_json({"ok": False, "error": "paths 必须是路径列表"}, 400)
+            return
+        shaders_root = SHADERS_DIR.resolve()
+        resolved = []
+        for rel in paths:
+            fp = (ROOT / rel).resolve()
+            if not fp.is_relative_to(shaders_root) or not fp.is_file():
+                self._send_json({"ok": False, "error": f"文件不存在: {rel}"}, 404)
+                return
+            resolved.append(str(fp))
+        try:
+            from WebEngine.launch import launch_multi_window_process
+            proc = launch_multi_window_process(resolved)
+            self._send_json({"ok": True, "pid": proc.pid, "windows": len(resolved)})
+        except Exception as e:
+            self._send_json({"ok": False, "error": str(e)}, 500)
+
+    def _handle_viewer_command(self, cmd: str, body: dict):
+        """POST /api/viewer/{uniform,screenshot,stop} → 转发到常驻渲染进程"""
+        try:
+            from shadertoy.daemon_client import DaemonClient
+            client = DaemonClient()
+            if cmd == "uniform":
+                reply = client.set_uniform(body.get("name", ""), body.get("value"))
+            elif cmd == "screenshot":
+                # 不接受客户端路径：截图总是写到渲染进程的截图目录
+                reply = client.screenshot()
+            else:
+                reply = client.stop()
+            client.close()
+            self._send_json(reply, 200 if reply.get("ok") else 400)
+        except ConnectionError as e:
+            self._send_json({"ok": False, "error": str(e)}, 503)
+
     # ---- Music Library ----
     def _music_dir(self):
         root = Path(__file__).resolve().parent.parent
@@ -589,10 +761,13 @@ class APIHandler(BaseHTTPRequestHandler):
             if not fp.is_file():
                 self._send_json({"error": f"文件不存在: {sub_path}"}, 404)
                 return
-            # 二进制音频格式不解析，直接返回 metadata
+            # 二进制音频格式：返回后台提取的特征，包络作为预览采样（未分析过的文件此时排队）
             ext = fp.suffix.lower()
-            if ext in (".wav", ".mp3", ".flac", ".ogg", ".aac", ".m4a", ".wma", ".aiff", ".opus"):
-                self._send_json({"name": fp.name, "samples": [], "total_length": 0, "format": ext, "note": "二进制音频格式，不支持前端预览"})
+            if ext in AUDIO_SUFFIXES:
+                features = get_music_library().features(sub_path)
+                envelope = features.pop("envelope", [])
+                self._send_json({"name": fp.name, "samples": envelope, "total_length": len(envelope),
+                                 "format": ext, "features": features})
                 return
             try:
                 import numpy as np
@@ -621,7 +796,9 @@ class APIHandler(BaseHTTPRequestHandler):
             files = []
             if music_dir.is_dir():
                 for fp in sorted(music_dir.rglob("*"), key=lambda p: p.stat().st_mtime, reverse=True):
-                    if fp.is_file() and fp.suffix.lower() in (".json", ".csv", ".wav", ".mp3", ".txt"):
+                    if UPLOAD_DIR_NAME in fp.parts:
+                        continue
+                    if fp.is_file() and fp.suffix.lower() in (".json", ".csv", ".txt") + AUDIO_SUFFIXES:
                         try:
                             st = fp.stat()
                             rel = str(fp.relative_to(music_dir)).replace("\\", "/")
@@ -648,21 +825,9 @@ class APIHandler(BaseHTTPRequestHandler):
                 speech_base_url=body.get("speech_base_url", ""),
                 speech_model=body.get("speech_model", ""),
             )
-        # 同步更新 AI service
-        if self.__class__._ai_service:
-            self.__class__._ai_service.provider = "openai" if self.settings.has_api_key else "mock"
-        # speech service caches API settings; rebuild it after settings changes.
-        if self.__class__._speech_service:
-            try:
-                self.__class__._speech_service.close()
-            except Exception:
-                pass
-            self.__class__._speech_service = None
+        # AIService（provider）与 SpeechService（转录配置）订阅了 Settings，只在相关字段变化时更新
         self._send_json({"ok": True})
 
-    def log_message(self, format, *args):
-        pass  # 静默
-
     # ---- Speech ----
     def _handle_speech_start(self):
         try:
@@ -695,3 +860,26 @@ class APIHandler(BaseHTTPRequestHandler):
             self._send_json({"recording": speech.is_recording, "api_available": speech.api_available})
         except Exception as e:
             self._send_json({"recording": False, "api_available": False, "error": str(e)})
+
+
+# ---- 在事件循环中运行的路由：流式请求体 / WebSocket，不占用 API 线程 ----
+async def handle_music_upload(request: Request) -> Response:
+    """POST /api/music/upload?name=<文件名>&folder=<子目录>，请求体为原始音频数据。"""
+    params = request.query
+    try:
+        result = await get_music_library().receive(request.body_reader, params.get("name", ""),
+                                                   params.get("folder", ""))
+    except UploadError as e:
+        return Response.json({"ok": False, "error": str(e)}, e.status)
+    except (ConnectionError, asyncio.IncompleteReadError):
+        return Response.json({"ok": False, "error": "上传中断"}, 400)
+    except (ValueError, asyncio.LimitOverrunError):
+        # 分块编码格式错误（块大小不是十六进制、块头行超长）
+        return Response.json({"ok": False, "error": "请求体格式错误"}, 400)
+    return Response.json({"ok": True, **result}, 200 if result["duplicate"] else 201)
+
+
+ASYNC_ROUTES = {
+    ("POST", "/api/music/upload"): handle_music_upload,
+    ("GET", "/api/viewer/ws"): handle_viewer_socket,
+}
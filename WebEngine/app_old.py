@@ -19,7 +19,7 @@ sys.path.insert(0, str(Path(__file__).parent.parent))
 
 from shadertoy.audio import AudioSource
 from WebEngine.visualizer import VisualizerWidget
-from shadertoy.__main__ import ShaderToyApp
+from shadertoy.app import ShaderToyApp
 
 # Get the directory of the current script
 CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -130,7 +130,7 @@ class Backend(QObject):
 def run_shader_viewer(shader_path, width, height):
     """
     在一个独立的进程中运行基于GLFW的无边框ShaderViewer。
-    直接调用 shadertoy.__main__ 中的 ShaderToyApp。
+    直接调用 shadertoy.app 中的 ShaderToyApp。
     """
     try:
         # 创建 ShaderToyApp 实例，并请求无边框窗口
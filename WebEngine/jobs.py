@@ -0,0 +1,422 @@
+"""生成任务调度：有界工作线程池 + 有界等待队列（背压）、排队位置推送、取消、超时与指标。
+
+任务函数签名为 fn(job)，通过 job.emit(dict) 产出事件；长时间运行的任务应通过
+job.check() / job.on_event 让取消与超时尽快生效（抛出 JobCancelled）。
+同一 session_id 的任务串行：工作线程跳过会话已有任务在运行的排队任务，取下一个可运行的，
+同会话的任务留在队列里，不占用工作线程，也不计入超时。
+"""
+from __future__ import annotations
+
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from typing import Any, Callable
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+TIMEOUT = "timeout"
+FINISHED = (DONE, FAILED, CANCELLED, TIMEOUT)
+
+# 已结束任务保留多久（秒），便于断线重连后回放事件
+FINISHED_TTL = 600.0
+
+
+class QueueFull(Exception):
+    """等待队列已满，调用方应返回 429。"""
+
+
+class JobCancelled(BaseException):
+    """任务被取消或超时；由 job.check() 在任务线程中抛出。
+
+    继承 BaseException：任务内部的 except Exception 降级分支（备用 LLM 调用、固定回复）
+    不会吞掉取消，取消的任务也不会写入历史。
+    """
+
+
+class Job:
+    def __init__(self, kind: str, fn: Callable[["Job"], Any], session_id: str = "", timeout: float | None = None):
+        self.id = uuid.uuid4().hex[:12]
+        self.kind = kind
+        self.session_id = session_id
+        self.timeout = timeout
+        self.status = QUEUED
+        self.error = ""
+        self.result: Any = None
+        self.created = time.time()
+        self.started: float | None = None
+        self.finished: float | None = None
+        self._fn = fn
+        self._cancel = threading.Event()
+        self._done = threading.Event()
+        self._lock = threading.Lock()
+        self._events: list[dict] = []
+        self._subscribers: list[tuple[Callable[[Any], Any], Callable[[], Any] | None]] = []
+        self._position_event: dict | None = None   # 最新排队位置，不进入回放历史
+
+    # ---- 事件 ----
+    def emit(self, event: Any, record: bool = True) -> None:
+        with self._lock:
+            if record:
+                self._events.append(event)
+            subscribers = list(self._subscribers)
+        for send, _ in subscribers:
+            send(event)
+
+    def on_event(self, event) -> None:
+        """AgentEvent 回调：取消后在下一个事件处中断 Agent。"""
+        self.check()
+
+    def check(self) -> None:
+        if self._cancel.is_set():
+            raise JobCancelled(self.status)
+
+    def subscribe(self, send: Callable[[Any], Any], close: Callable[[], Any] | None = None) -> None:
+        """回放已有事件并订阅后续事件；任务结束时调用 close。"""
+        with self._lock:
+            backlog = list(self._events)
+            if self.status == QUEUED and self._position_event is not None:
+                backlog.append(self._position_event)
+            finished = self._done.is_set()
+            if not finished:
+                self._subscribers.append((send, close))
+        for event in backlog:
+            send(event)
+        if finished and close is not None:
+            close()
+
+    def unsubscribe(self, send: Callable[[Any], Any]) -> int:
+        """取消订阅，返回剩余订阅者数量。"""
+        with self._lock:
+            self._subscribers = [s for s in self._subscribers if s[0] != send]
+            return len(self._subscribers)
+
+    # ---- 状态 ----
+    @property
+    def cancelled(self) -> bool:
+        return self._cancel.is_set()
+
+    def cancel(self, reason: str = CANCELLED) -> bool:
+        if self._done.is_set():
+            return False
+        with self._lock:
+            if self.status in FINISHED:
+                return False
+            self.status = reason
+        self._cancel.set()
+        return True
+
+    def wait(self, timeout: float | None = None) -> bool:
+        return self._done.wait(timeout)
+
+    def _finish(self, status: str, error: str = "") -> None:
+        with self._lock:
+            if self.status not in (CANCELLED, TIMEOUT):
+                self.status = status
+            self.error = self.error or error
+            self.finished = time.time()
+        self.emit_final()
+        with self._lock:
+            self._done.set()
+            subscribers, self._subscribers = self._subscribers, []
+        for _, close in subscribers:
+            if close is not None:
+                close()
+
+    def emit_final(self) -> None:
+        event = {"event": "job_" + self.status, "job_id": self.id}
+        if self.status == CANCELLED and not self.error:
+            self.error = "任务已取消"
+        if self.error:
+            # 带 error 字段，前端按失败结束
+            event["error"] = self.error
+        self.emit(event)
+
+    def to_dict(self) -> dict:
+        return {
+            "job_id": self.id,
+            "kind": self.kind,
+            "session_id": self.session_id,
+            "status": self.status,
+            "error": self.error,
+            "created": self.created,
+            "wait_ms": round(((self.started or time.time()) - self.created) * 1000.0, 1),
+            "run_ms": round(((self.finished or time.time()) - self.started) * 1000.0, 1) if self.started else None,
+        }
+
+
+class JobScheduler:
+    """Bounded worker pool with a bounded FIFO queue.
+
+    max_workers: jobs running at once; max_queue: jobs waiting (QueueFull beyond);
+    timeout: default per-job run-time limit in seconds.
+    """
+
+    def __init__(self, max_workers: int = 2, max_queue: int = 16, timeout: float = 300.0):
+        self.max_workers = max(1, max_workers)
+        self.max_queue = max(0, max_queue)
+        self.timeout = timeout
+        self._pending: deque[Job] = deque()
+        self._running: set[Job] = set()
+        self._jobs: dict[str, Job] = {}
+        self._cond = threading.Condition()
+        self._wait_ms: deque[float] = deque(maxlen=200)
+        self._run_ms: deque[float] = deque(maxlen=200)
+        self._counts = {s: 0 for s in FINISHED}
+        self._rejected = 0
+        self._stopped = False
+        self._threads = [
+            threading.Thread(target=self._worker, name=f"job-worker-{i}", daemon=True)
+            for i in range(self.max_workers)
+        ]
+        for t in self._threads:
+            t.start()
+        threading.Thread(target=self._watchdog, name="job-watchdog", daemon=True).start()
+
+    # ---- 提交与查询 ----
+    def submit(self, kind: str, fn: Callable[[Job], Any], session_id: str = "",
+               timeout: float | None = None) -> Job:
+        job = Job(kind, fn, session_id, timeout if timeout is not None else self.timeout)
+        with self._cond:
+            # 运行中的任务也计入容量，避免工作线程尚未取走任务时的竞态
+            if len(self._pending) + len(self._running) >= self.max_workers + self.max_queue:
+                self._rejected += 1
+                raise QueueFull(f"queue full ({len(self._pending)} waiting)")
+            self._pending.append(job)
+            self._jobs[job.id] = job
+            self._gc_locked()
+            self._cond.notify()
+        self._publish_positions()
+        return job
+
+    def get(self, job_id: str) -> Job | None:
+        with self._cond:
+            return self._jobs.get(job_id)
+
+    def position(self, job: Job) -> int:
+        """1-based position in the waiting queue, 0 when running/finished."""
+        with self._cond:
+            try:
+                return self._pending.index(job) + 1
+            except ValueError:
+                return 0
+
+    def cancel(self, job_id: str) -> bool:
+        job = self.get(job_id)
+        if job is None:
+            return False
+        return self._cancel_job(job, CANCELLED)
+
+    def _cancel_job(self, job: Job, reason: str) -> bool:
+        if not job.cancel(reason):
+            return False
+        with self._cond:
+            queued = job in self._pending
+            if queued:
+                self._pending.remove(job)
+        if queued:
+            # 尚未运行的任务直接结束
+            job._finish(reason)
+            self._record(job)
+            self._publish_positions()
+        return True
+
+    # ---- 指标 ----
+    def metrics(self) -> dict:
+        def _stats(values: deque[float]) -> dict:
+            if not values:
+                return {"avg": 0.0, "p95": 0.0, "max": 0.0}
+            ordered = sorted(values)
+            return {
+                "avg": round(sum(ordered) / len(ordered), 1),
+                "p95": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 1),
+                "max": round(ordered[-1], 1),
+            }
+
+        with self._cond:
+            return {
+                "workers": self.max_workers,
+                "running": len(self._running),
+                "queue_depth": len(self._pending),
+                "queue_limit": self.max_queue,
+                "rejected": self._rejected,
+                "finished": dict(self._counts),
+                "wait_ms": _stats(self._wait_ms),
+                "run_ms": _stats(self._run_ms),
+            }
+
+    def shutdown(self) -> None:
+        with self._cond:
+            self._stopped = True
+            pending = list(self._pending)
+            running = list(self._running)
+            self._cond.notify_all()
+        for job in pending + running:
+            self._cancel_job(job, CANCELLED)
+
+    # ---- 内部 ----
+    def _publish_positions(self) -> None:
+        with self._cond:
+            waiting = list(self._pending)
+        for i, job in enumerate(waiting, start=1):
+            job._position_event = {"event": "queued", "job_id": job.id, "position": i}
+            job.emit(job._position_event, record=False)
+
+    def _next_locked(self) -> Job | None:
+        """First pending job whose session has nothing running (调用方持有 _cond)。"""
+        busy = {j.session_id for j in self._running if j.session_id}
+        for job in self._pending:
+            if not job.session_id or job.session_id not in busy:
+                self._pending.remove(job)
+                return job
+        return None
+
+    def _worker(self) -> None:
+        while True:
+            with self._cond:
+                job = None
+                while not self._stopped and (job := self._next_locked()) is None:
+                    self._cond.wait()
+                if self._stopped:
+                    if job is not None:
+                        self._pending.appendleft(job)
+                    return
+                self._running.add(job)
+                job.status = RUNNING
+                job.started = time.time()
+            self._publish_positions()
+            job.emit({"event": "job_started", "job_id": job.id})
+            status, error = DONE, ""
+            try:
+                job.result = job._fn(job)
+            except JobCancelled:
+                status = CANCELLED
+            except Exception as e:
+                status, error = FAILED, str(e)
+            with self._cond:
+                self._running.discard(job)
+                # 同会话的排队任务可能在等这个任务结束
+                self._cond.notify_all()
+            job._finish(status, error)
+            self._record(job)
+
+    def _record(self, job: Job) -> None:
+        with self._cond:
+            self._counts[job.status] = self._counts.get(job.status, 0) + 1
+            start = job.started or job.finished or job.created
+            self._wait_ms.append((start - job.created) * 1000.0)
+            if job.started and job.finished:
+                self._run_ms.append((job.finished - job.started) * 1000.0)
+
+    def _watchdog(self) -> None:
+        while not self._stopped:
+            time.sleep(1.0)
+            now = time.time()
+            with self._cond:
+                running = list(self._running)
+            for job in running:
+                if job.timeout and job.started and now - job.started > job.timeout:
+                    job.error = f"任务超时（{job.timeout:.0f}s）"
+                    self._cancel_job(job, TIMEOUT)
+
+    def _gc_locked(self) -> None:
+        now = time.time()
+        for job_id, job in list(self._jobs.items()):
+            if job.finished and now - job.finished > FINISHED_TTL:
+                del self._jobs[job_id]
+
+
+_scheduler: JobScheduler | None = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler() -> JobScheduler:
+    """进程级调度器；并发数/队列长度/超时可由 MS_JOB_WORKERS / MS_JOB_QUEUE / MS_JOB_TIMEOUT 配置。"""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = JobScheduler(
+                max_workers=int(os.environ.get("MS_JOB_WORKERS", "2")),
+                max_queue=int(os.environ.get("MS_JOB_QUEUE", "16")),
+                timeout=float(os.environ.get("MS_JOB_TIMEOUT", "300")),
+            )
+        return _scheduler
+
+
+def shutdown_scheduler() -> None:
+    """取消所有排队/运行中的任务；下次 get_scheduler() 会新建调度器。"""
+    global _scheduler
+    with _scheduler_lock:
+        scheduler, _scheduler = _scheduler, None
+    if scheduler is not None:
+        scheduler.shutdown()
+
+
+# ---- 自检：python -m WebEngine.jobs ----
+if __name__ == "__main__":
+    sched = JobScheduler(max_workers=2, max_queue=3, timeout=0.5)
+
+    def _work(job: Job, seconds: float = 0.2):
+        end = time.time() + seconds
+        while time.time() < end:
+            job.check()
+            time.sleep(0.01)
+        return "ok"
+
+    jobs = [sched.submit("demo", _work) for _ in range(5)]
+    try:
+        sched.submit("demo", _work)
+        raise SystemExit("expected QueueFull")
+    except QueueFull:
+        pass
+    positions = [sched.position(j) for j in jobs]
+    sched.cancel(jobs[-1].id)
+    slow = jobs[2]
+    slow._fn = lambda job: _work(job, 5.0)
+    for j in jobs:
+        j.wait(5)
+    print("positions", positions)
+    print("status", [j.status for j in jobs])
+    print("metrics", sched.metrics())
+    assert jobs[-1].status == CANCELLED and slow.status == TIMEOUT
+
+    # 同一会话的任务串行且不占用工作线程：其他会话的任务先运行
+    sched = JobScheduler(max_workers=2, max_queue=8, timeout=5.0)
+    order: list[str] = []
+
+    def _tagged(tag: str, seconds: float):
+        def fn(job: Job):
+            order.append(f"{tag}+")
+            _work(job, seconds)
+            order.append(f"{tag}-")
+        return fn
+
+    batch = [sched.submit("demo", _tagged("a1", 0.3), session_id="a"),
+             sched.submit("demo", _tagged("a2", 0.1), session_id="a"),
+             sched.submit("demo", _tagged("b1", 0.1), session_id="b")]
+    for j in batch:
+        j.wait(5)
+    print("same-session order", order)
+    assert order.index("b1+") < order.index("a1-") and order.index("a2+") > order.index("a1-")
+    sched.shutdown()
+
+    # 取消的 Plan / Analyze 任务不走降级分支，历史保持不变
+    from WebEngine.ai_service import AIService
+    service = AIService()
+    service.provider = "mock"
+    service.history = [{"role": "user", "content": "你好"}, {"role": "assistant", "content": "你好！"}]
+    before = [dict(m) for m in service.history]
+    for stage in (service._plan_chat, service.analyze):
+        job = Job("demo", lambda job: None)
+        job.cancel()
+        try:
+            stage("来一个霓虹圆环", on_event=job.on_event)
+            raise SystemExit(f"{stage.__name__}: expected JobCancelled")
+        except JobCancelled:
+            pass
+    print("history after cancelled plan/analyze unchanged:", service.history == before)
+    assert service.history == before and not service._dirty
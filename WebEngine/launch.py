@@ -2,13 +2,11 @@
 from __future__ import annotations
 import multiprocessing
 import traceback
-import time
 import os
 from pathlib import Path
 from typing import Optional
 
-from shadertoy.__main__ import ShaderToyApp
-from .paths import SHADERS_DIR
+from ai_pipeline.shader_store import get_preview_store
 
 DEFAULT_BORDERLESS_MONITOR = int(os.environ.get("SHADER_BORDERLESS_MONITOR", "0"))
 
@@ -23,6 +21,9 @@ def _ensure_version(code: str) -> str:
 def run_shader_viewer(shader_path: str, width: int = 1280, height: int = 360, monitor_index: int | None = None):
     """Target executed inside child process to render given shader."""
     try:
+        # 在子进程内再导入，避免 WebEngine 启动时加载 OpenGL/glfw
+        from shadertoy.app import ShaderToyApp
+
         app = ShaderToyApp(
             shader_path,
             width,
@@ -38,22 +39,43 @@ def run_shader_viewer(shader_path: str, width: int = 1280, height: int = 360, mo
         traceback.print_exc()
 
 
+def run_multi_shader_viewer(shader_paths: list[str], width: int = 1280, height: int = 360,
+                            monitor_index: int | None = None):
+    """Target executed inside child process to render several shaders in one process.
+
+    所有窗口共享同一份音频/摄像头采集与 GL 纹理，避免多个进程争抢摄像头。
+    """
+    try:
+        from shadertoy.multiwindow import MultiWindowApp
+
+        app = MultiWindowApp(
+            shader_paths,
+            width,
+            height,
+            borderless=True,
+            monitor_index=monitor_index,
+            gesture_mode="native",
+        )
+        app.run()
+    except Exception as e:  # pragma: no cover - runtime logging
+        print(f"[MultiViewer] Failed: {e}")
+        traceback.print_exc()
+
+
 def launch_borderless_process(shader_code: str, source_path: Optional[str]) -> multiprocessing.Process:
     """Launch a borderless viewer process for current shader.
 
-    If source_path is provided and exists, we reuse it; else we write to shaders/_preview.
+    If source_path is provided and exists, we reuse it; else the code goes to the
+    content-addressed preview store (shaders/_preview/applied_<hash>.glsl), so
+    launching identical code again reuses the same file.
     Returns the multiprocessing.Process instance (already started).
     """
     if source_path and os.path.exists(source_path):
         shader_path = source_path
     else:
-        preview_dir = SHADERS_DIR / "_preview"
-        preview_dir.mkdir(exist_ok=True, parents=True)
-        ts = time.strftime("applied_%Y%m%d_%H%M%S")
-        shader_path = str(preview_dir / f"{ts}.glsl")
         code = _ensure_version(shader_code)
-        with open(shader_path, 'w', encoding='utf-8') as f:
-            f.write(code if code.endswith('\n') else code + '\n')
+        # 引用名 "launch" 指向最近一次启动的预览；之前的预览失去引用，由 gc 回收
+        shader_path = str(get_preview_store().bind("launch", code if code.endswith('\n') else code + '\n'))
 
     # Determine monitor index
     monitor_index: int | None
@@ -71,4 +93,29 @@ def launch_borderless_process(shader_code: str, source_path: Optional[str]) -> m
     p.start()
     return p
 
-__all__ = ["launch_borderless_process", "DEFAULT_BORDERLESS_MONITOR"]
+def launch_in_daemon(shader_code: str, source_path: Optional[str]) -> dict:
+    """Show the shader in the long-lived viewer daemon, starting it on first use.
+
+    The daemon compiles in the background and swaps programs without reopening
+    audio/camera/window, so time-to-visual is roughly the compile time.
+    Returns the daemon reply ({"ok", "path", "compile_ms", ...}); raises
+    ConnectionError when the daemon cannot be reached.
+    """
+    from shadertoy.daemon_client import ensure_daemon
+
+    client = ensure_daemon()
+    if source_path and os.path.exists(source_path):
+        return client.load(path=source_path)
+    return client.load(code=shader_code)
+
+
+def launch_multi_window_process(shader_paths: list[str], monitor_index: int | None = None) -> multiprocessing.Process:
+    """Launch one viewer process rendering every shader in shader_paths in its own window."""
+    if monitor_index is None:
+        monitor_index = DEFAULT_BORDERLESS_MONITOR
+    p = multiprocessing.Process(target=run_multi_shader_viewer, args=(list(shader_paths), 1920, 480, monitor_index))
+    p.daemon = False
+    p.start()
+    return p
+
+__all__ = ["launch_borderless_process", "launch_in_daemon", "launch_multi_window_process", "DEFAULT_BORDERLESS_MONITOR"]
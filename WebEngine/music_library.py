@@ -0,0 +1,440 @@
+"""音乐库：流式上传（边收边写盘、同时计算 SHA-256 去重）+ 后台解码与特征提取。
+
+上传先写入 MusicLib/.uploads/<随机名>.part，写盘与哈希在线程中进行，事件循环只负责收数据，
+不占用 API 线程；收完后若库中已有相同内容（大小相同的文件才计算哈希）则丢弃临时文件并返回已有路径。
+特征（时长、RMS/峰值、频谱质心、低中高频能量占比、波形包络）按内容哈希缓存在
+.cache/music_index.sqlite3，解码由单独的线程池完成：WAV 直接读取，其他格式经 ffmpeg 转为单声道 PCM 流。
+"""
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import os
+import re
+import shutil
+import sqlite3
+import subprocess
+import threading
+import time
+import uuid
+import wave
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+from WebEngine.aio_http import BodyReader
+from WebEngine.paths import CACHE_DIR, PROJECT_ROOT
+
+MUSIC_DIR = PROJECT_ROOT / "MusicLib"
+MUSIC_DB = CACHE_DIR / "music_index.sqlite3"
+UPLOAD_DIR_NAME = ".uploads"
+AUDIO_SUFFIXES = (".wav", ".mp3", ".flac", ".ogg", ".aac", ".m4a", ".wma", ".aiff", ".opus")
+UPLOAD_MAX_BYTES = int(os.environ.get("MS_UPLOAD_MAX_MB", "512")) * 1024 * 1024
+# 攒够该大小再交给线程写盘 + 哈希，减少线程切换
+WRITE_BLOCK_BYTES = 1024 * 1024
+
+# 特征提取：解码采样率、分析帧长、包络点数
+FEATURE_RATE = 22050
+FEATURE_FRAME = 2048
+ENVELOPE_POINTS = 500
+BANDS = (("low", 0.0, 250.0), ("mid", 250.0, 4000.0), ("high", 4000.0, FEATURE_RATE / 2))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS tracks (
+    path TEXT PRIMARY KEY,          -- 相对 MusicLib，使用 /
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    sha256 TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS tracks_sha ON tracks(sha256);
+CREATE TABLE IF NOT EXISTS features (
+    sha256 TEXT PRIMARY KEY,
+    status TEXT NOT NULL,           -- pending / ready / failed
+    error TEXT NOT NULL DEFAULT '',
+    data TEXT NOT NULL DEFAULT '{}',
+    updated_at REAL NOT NULL
+);
+"""
+
+_UNSAFE_NAME_RE = re.compile(r'[\\/:*?"<>|\x00-\x1f]')
+
+
+class UploadError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+def safe_filename(name: str) -> str:
+    name = _UNSAFE_NAME_RE.sub("_", Path(name.replace("\\", "/")).name).strip(" .")
+    return name[:200]
+
+
+def _hash_file(fp: Path) -> str:
+    digest = hashlib.sha256()
+    with open(fp, "rb") as f:
+        while block := f.read(WRITE_BLOCK_BYTES):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _write_block(f, digest, data: bytes) -> None:
+    # hashlib 与文件写入在处理大块数据时都会释放 GIL
+    digest.update(data)
+    f.write(data)
+
+
+# ---- 解码 ----
+def _pcm_blocks_wav(fp: Path, frames: int):
+    with wave.open(str(fp), "rb") as wf:
+        channels, width, rate = wf.getnchannels(), wf.getsampwidth(), wf.getframerate()
+        if width not in (1, 2, 3, 4):
+            raise ValueError(f"不支持的位深度: {width * 8}bit")
+        step = max(1, round(rate / FEATURE_RATE))
+        while raw := wf.readframes(frames * step):
+            if width == 1:
+                data = (np.frombuffer(raw, dtype=np.uint8).astype(np.float32) - 128.0) / 128.0
+            elif width == 3:
+                b = np.frombuffer(raw, dtype=np.uint8).reshape(-1, 3).astype(np.int32)
+                data = ((b[:, 0] | (b[:, 1] << 8) | (b[:, 2] << 16)) << 8 >> 8).astype(np.float32) / 8388608.0
+            else:
+                dtype = np.int16 if width == 2 else np.int32
+                data = np.frombuffer(raw, dtype=dtype).astype(np.float32) / float(2 ** (width * 8 - 1))
+            data = data[: len(data) - len(data) % channels].reshape(-1, channels).mean(axis=1)
+            # 粗略降采样到接近 FEATURE_RATE，只用于统计特征
+            yield data[::step], rate / step
+
+
+def _pcm_blocks_ffmpeg(fp: Path, frames: int):
+    ffmpeg = shutil.which("ffmpeg")
+    if ffmpeg is None:
+        raise RuntimeError("需要 ffmpeg 才能解码非 WAV 音频。请运行: conda install -c conda-forge ffmpeg")
+    proc = subprocess.Popen(
+        [ffmpeg, "-v", "error", "-i", str(fp), "-ac", "1", "-ar", str(FEATURE_RATE), "-f", "f32le", "pipe:1"],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+    )
+    try:
+        block = frames * 4
+        while raw := proc.stdout.read(block):
+            yield np.frombuffer(raw[: len(raw) - len(raw) % 4], dtype=np.float32), float(FEATURE_RATE)
+        if proc.wait() != 0:
+            raise RuntimeError(proc.stderr.read().decode("utf-8", "ignore").strip()[-300:] or "ffmpeg 解码失败")
+    finally:
+        if proc.poll() is None:
+            proc.kill()
+        proc.stdout.close()
+        proc.stderr.close()
+
+
+def extract_features(fp: Path) -> dict:
+    """Decode fp as a stream of frames and summarise it; memory stays O(frame + envelope)."""
+    blocks = _pcm_blocks_wav(fp, FEATURE_FRAME) if fp.suffix.lower() == ".wav" else _pcm_blocks_ffmpeg(fp, FEATURE_FRAME)
+    samples, sum_sq, peak = 0, 0.0, 0.0
+    band_energy = np.zeros(len(BANDS))
+    centroid_num = centroid_den = 0.0
+    frame_rms: list[float] = []
+    rate = float(FEATURE_RATE)
+    window = np.hanning(FEATURE_FRAME).astype(np.float32)
+    for data, rate in blocks:
+        if not len(data):
+            continue
+        samples += len(data)
+        sq = float(np.dot(data, data))
+        sum_sq += sq
+        peak = max(peak, float(np.abs(data).max()))
+        frame_rms.append((sq / len(data)) ** 0.5)
+        frame = data if len(data) == FEATURE_FRAME else np.pad(data, (0, FEATURE_FRAME - len(data)))
+        power = np.abs(np.fft.rfft(frame * window)) ** 2
+        freqs = np.fft.rfftfreq(FEATURE_FRAME, 1.0 / rate)
+        for i, (_, lo, hi) in enumerate(BANDS):
+            band_energy[i] += power[(freqs >= lo) & (freqs < hi)].sum()
+        centroid_num += float((freqs * power).sum())
+        centroid_den += float(power.sum())
+    if samples == 0:
+        raise ValueError("音频为空或无法解码")
+
+    # 包络：每段取最大帧 RMS，归一化到 0..1
+    rms_arr = np.asarray(frame_rms, dtype=np.float32)
+    n = min(ENVELOPE_POINTS, len(rms_arr))
+    envelope = np.array([seg.max() for seg in np.array_split(rms_arr, n)], dtype=np.float32)
+    if envelope.max() > 0:
+        envelope /= envelope.max()
+    total = band_energy.sum() or 1.0
+    return {
+        "duration": round(samples / rate, 3),
+        "rms": round((sum_sq / samples) ** 0.5, 6),
+        "peak": round(peak, 6),
+        "centroid_hz": round(centroid_num / centroid_den, 1) if centroid_den else 0.0,
+        "bands": {name: round(float(e / total), 4) for (name, _, _), e in zip(BANDS, band_energy)},
+        "envelope": [round(float(x), 4) for x in envelope],
+    }
+
+
+class MusicLibrary:
+    def __init__(self, music_dir: Path = MUSIC_DIR, db_path: Path = MUSIC_DB, workers: int = 1):
+        self.music_dir = Path(music_dir)
+        self.music_dir.mkdir(parents=True, exist_ok=True)
+        self.upload_dir = self.music_dir / UPLOAD_DIR_NAME
+        db_path = Path(db_path)
+        db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(str(db_path), check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        # 提交（去重 + 改名）串行，避免同时上传的相同内容都被保留
+        self._commit_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="music-features")
+        with self._lock, self._db:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.executescript(_SCHEMA)
+            # 上次退出时未完成的任务重新排队
+            self._db.execute("DELETE FROM features WHERE status = 'pending'")
+
+    def rel(self, fp: Path) -> str:
+        return str(fp.relative_to(self.music_dir)).replace("\\", "/")
+
+    def resolve(self, relative: str) -> Path | None:
+        fp = (self.music_dir / relative.replace("\\", "/").lstrip("/")).resolve()
+        root = self.music_dir.resolve()
+        if fp != root and root not in fp.parents:
+            return None
+        return fp
+
+    # ---- 内容哈希 ----
+    def content_hash(self, fp: Path) -> str:
+        """SHA-256 of fp, cached by (size, mtime)."""
+        st = fp.stat()
+        rel = self.rel(fp)
+        with self._lock:
+            row = self._db.execute("SELECT size, mtime_ns, sha256 FROM tracks WHERE path = ?", (rel,)).fetchone()
+        if row is not None and (row["size"], row["mtime_ns"]) == (st.st_size, st.st_mtime_ns):
+            return row["sha256"]
+        digest = _hash_file(fp)
+        self._record(rel, st.st_size, st.st_mtime_ns, digest)
+        return digest
+
+    def _record(self, rel: str, size: int, mtime_ns: int, digest: str) -> None:
+        with self._lock, self._db:
+            self._db.execute("INSERT OR REPLACE INTO tracks (path, size, mtime_ns, sha256) VALUES (?, ?, ?, ?)",
+                             (rel, size, mtime_ns, digest))
+
+    def find_duplicate(self, digest: str, size: int) -> str | None:
+        """Return the library path holding the same content.
+
+        先按 sha256 查 tracks 索引（校验文件仍在且未改动）；没有命中时才遍历目录，
+        且只为索引里没有记录（或记录已过期）的同大小文件计算哈希（如手动拷进 MusicLib 的文件）。
+        """
+        with self._lock:
+            rows = self._db.execute("SELECT path, size, mtime_ns FROM tracks WHERE sha256 = ?", (digest,)).fetchall()
+            known = {r["path"]: (r["size"], r["mtime_ns"])
+                     for r in self._db.execute("SELECT path, size, mtime_ns FROM tracks WHERE size = ?", (size,))}
+        for row in rows:
+            try:
+                st = (self.music_dir / row["path"]).stat()
+            except OSError:
+                continue
+            if (st.st_size, st.st_mtime_ns) == (row["size"], row["mtime_ns"]):
+                return row["path"]
+        for fp in self.music_dir.rglob("*"):
+            if UPLOAD_DIR_NAME in fp.parts or fp.suffix.lower() not in AUDIO_SUFFIXES:
+                continue
+            try:
+                if not fp.is_file():
+                    continue
+                st = fp.stat()
+                if st.st_size != size or known.get(self.rel(fp)) == (st.st_size, st.st_mtime_ns):
+                    continue
+                if self.content_hash(fp) == digest:
+                    return self.rel(fp)
+            except OSError:
+                continue
+        return None
+
+    # ---- 上传 ----
+    async def receive(self, body: BodyReader, name: str, folder: str = "",
+                      max_bytes: int = UPLOAD_MAX_BYTES) -> dict:
+        """Stream an upload to disk; returns {path, size, sha256, duplicate, features}.
+
+        Raises UploadError for bad names, oversized bodies or empty uploads.
+        """
+        name = safe_filename(name)
+        if not name or Path(name).suffix.lower() not in AUDIO_SUFFIXES:
+            raise UploadError(415, f"不支持的文件类型，仅支持: {' '.join(AUDIO_SUFFIXES)}")
+        target_dir = self.resolve(folder) if folder else self.music_dir
+        if target_dir is None or UPLOAD_DIR_NAME in target_dir.parts:
+            raise UploadError(403, "非法目录")
+        if body.length is not None and body.length > max_bytes:
+            raise UploadError(413, f"文件过大（上限 {max_bytes // (1024 * 1024)} MB）")
+
+        self.upload_dir.mkdir(parents=True, exist_ok=True)
+        part = self.upload_dir / f"{uuid.uuid4().hex}.part"
+        digest = hashlib.sha256()
+        loop = asyncio.get_running_loop()
+        f = open(part, "wb")
+        pending = None
+        try:
+            buf = bytearray()
+            async for chunk in body:
+                if body.received > max_bytes:
+                    raise UploadError(413, f"文件过大（上限 {max_bytes // (1024 * 1024)} MB）")
+                buf += chunk
+                if len(buf) >= WRITE_BLOCK_BYTES:
+                    # 上一块写完再交下一块：同时最多一块在写，接收不停顿
+                    if pending is not None:
+                        await pending
+                    pending = loop.run_in_executor(None, _write_block, f, digest, bytes(buf))
+                    buf.clear()
+            if pending is not None:
+                await pending
+            if buf:
+                await loop.run_in_executor(None, _write_block, f, digest, bytes(buf))
+            await loop.run_in_executor(None, f.close)
+        except BaseException:
+            if pending is not None and not pending.done():
+                await asyncio.gather(pending, return_exceptions=True)
+            f.close()
+            part.unlink(missing_ok=True)
+            raise
+        if body.received == 0:
+            part.unlink(missing_ok=True)
+            raise UploadError(400, "空文件")
+        return await loop.run_in_executor(None, self._commit, part, target_dir, name, digest.hexdigest(),
+                                          body.received)
+
+    def _commit(self, part: Path, target_dir: Path, name: str, digest: str, size: int) -> dict:
+        with self._commit_lock:
+            duplicate = self.find_duplicate(digest, size)
+            if duplicate is not None:
+                part.unlink(missing_ok=True)
+                rel = duplicate
+            else:
+                target_dir.mkdir(parents=True, exist_ok=True)
+                dest = target_dir / name
+                n = 1
+                while dest.exists():
+                    dest = target_dir / f"{Path(name).stem} ({n}){Path(name).suffix}"
+                    n += 1
+                os.replace(part, dest)
+                st = dest.stat()
+                rel = self.rel(dest)
+                self._record(rel, st.st_size, st.st_mtime_ns, digest)
+        return {"path": rel, "name": Path(rel).name, "size": size, "sha256": digest,
+                "duplicate": duplicate is not None, "features": self.schedule_features(rel, digest)}
+
+    # ---- 特征 ----
+    def schedule_features(self, rel: str, digest: str) -> str:
+        """Queue feature extraction for rel unless it is cached; returns the current status."""
+        with self._lock, self._db:
+            row = self._db.execute("SELECT status FROM features WHERE sha256 = ?", (digest,)).fetchone()
+            if row is not None:
+                return row["status"]
+            self._db.execute("INSERT INTO features (sha256, status, updated_at) VALUES (?, 'pending', ?)",
+                             (digest, time.time()))
+        try:
+            self._executor.submit(self._extract, rel, digest)
+        except RuntimeError:
+            # 已关闭
+            with self._lock, self._db:
+                self._db.execute("DELETE FROM features WHERE sha256 = ?", (digest,))
+            return "missing"
+        return "pending"
+
+    def _extract(self, rel: str, digest: str) -> None:
+        t0 = time.perf_counter()
+        try:
+            data, status, error = extract_features(self.music_dir / rel), "ready", ""
+            print(f"[music] features {rel}: {data['duration']:.1f}s audio in {time.perf_counter() - t0:.2f}s")
+        except Exception as e:
+            data, status, error = {}, "failed", str(e)[:300]
+            print(f"[music] features {rel} failed: {error}")
+        with self._lock, self._db:
+            self._db.execute("UPDATE features SET status = ?, error = ?, data = ?, updated_at = ? WHERE sha256 = ?",
+                             (status, error, json.dumps(data), time.time(), digest))
+
+    def features(self, rel: str, schedule: bool = True) -> dict:
+        """{"status": ready/pending/failed/missing, ...features}；schedule=True 时对未分析的文件排队。"""
+        fp = self.resolve(rel)
+        if fp is None or not fp.is_file():
+            return {"status": "missing"}
+        digest = self.content_hash(fp)
+        with self._lock:
+            row = self._db.execute("SELECT status, error, data FROM features WHERE sha256 = ?", (digest,)).fetchone()
+        if row is None:
+            return {"status": self.schedule_features(rel, digest) if schedule else "missing"}
+        result = {"status": row["status"], **json.loads(row["data"] or "{}")}
+        if row["error"]:
+            result["error"] = row["error"]
+        return result
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+_library: MusicLibrary | None = None
+_library_lock = threading.Lock()
+
+
+def get_music_library() -> MusicLibrary:
+    global _library
+    with _library_lock:
+        if _library is None:
+            _library = MusicLibrary()
+        return _library
+
+
+def shutdown_music_library() -> None:
+    global _library
+    with _library_lock:
+        library, _library = _library, None
+    if library is not None:
+        library.shutdown()
+
+
+# ---- 自检：python -m WebEngine.music_library ----
+if __name__ == "__main__":
+    import tempfile
+
+    class _FakeBody:
+        """模拟 BodyReader：分块产出数据"""
+
+        def __init__(self, data: bytes, chunk: int = 64 * 1024):
+            self.length, self.received, self._data, self._chunk = len(data), 0, data, chunk
+
+        def __aiter__(self):
+            return self
+
+        async def __anext__(self):
+            if self.received >= self.length:
+                raise StopAsyncIteration
+            piece = self._data[self.received:self.received + self._chunk]
+            self.received += len(piece)
+            return piece
+
+    with tempfile.TemporaryDirectory() as tmp:
+        root = Path(tmp)
+        t = np.arange(44100 * 30) / 44100.0
+        pcm = (0.5 * np.sin(2 * np.pi * 110 * t) * (0.5 + 0.5 * np.sin(t))).astype(np.float32)
+        wav_path = root / "tone.wav"
+        with wave.open(str(wav_path), "wb") as wf:
+            wf.setnchannels(2); wf.setsampwidth(2); wf.setframerate(44100)
+            wf.writeframes((np.repeat(pcm[:, None], 2, axis=1) * 32767).astype(np.int16).tobytes())
+        data = wav_path.read_bytes()
+        lib = MusicLibrary(root / "lib", root / "idx.sqlite3")
+        t0 = time.perf_counter()
+        first = asyncio.run(lib.receive(_FakeBody(data), "tone.wav"))
+        print(f"upload {len(data) / 1e6:.1f}MB in {time.perf_counter() - t0:.3f}s → {first}")
+        second = asyncio.run(lib.receive(_FakeBody(data), "copy.wav"))
+        print("duplicate:", second["duplicate"], second["path"])
+        # 手动拷进目录、索引里没有记录的文件也能被识别为重复
+        (root / "lib" / "manual").mkdir()
+        (root / "lib" / "manual" / "other.wav").write_bytes(data[:-2] + b"\x01\x02")
+        third = asyncio.run(lib.receive(_FakeBody(data[:-2] + b"\x01\x02"), "again.wav"))
+        assert second["duplicate"] and third["duplicate"] and third["path"] == "manual/other.wav", third
+        lib._executor.shutdown(wait=True)
+        feats = lib.features("tone.wav")
+        print({k: v for k, v in feats.items() if k != "envelope"}, "envelope points:", len(feats.get("envelope", [])))
+        try:
+            asyncio.run(lib.receive(_FakeBody(data), "big.wav", max_bytes=1024))
+        except UploadError as e:
+            print("limit:", e.status, e, "leftover parts:", list(lib.upload_dir.iterdir()))
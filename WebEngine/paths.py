@@ -10,4 +10,7 @@ if str(PROJECT_ROOT) not in sys.path:
 SHADERS_DIR = PROJECT_ROOT / "shaders"
 SHADERS_DIR.mkdir(exist_ok=True, parents=True)
 
-__all__ = ["PROJECT_ROOT", "SHADERS_DIR"]
+# 可重建的本地缓存（索引、缩略图等），不纳入版本控制
+CACHE_DIR = PROJECT_ROOT / ".cache"
+
+__all__ = ["PROJECT_ROOT", "SHADERS_DIR", "CACHE_DIR"]
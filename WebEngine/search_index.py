@@ -0,0 +1,251 @@
+"""全文 + 结构化检索：Shader（源码 / 头部元信息，见 shader_index）与会话消息（ai_pipeline/session_store）。
+
+查询语法：普通词全部命中（AND），带引号的短语作为一个词；过滤条件：
+  style:<style_profile>  uniform:<iChannel0>  in:<目录>  since:<7d|12h|2w|2026-05-01>
+  type:shader|conversation
+例如 `neon ring since:7d` 即“上周的霓虹圆环着色器”。
+
+会话索引按会话内容哈希增量更新：AIService.save() 保存后直接调用 index_conversation()，
+查询前再对比会话存储索引的版本，只重新读取 updated_at 变化的会话，捕获其他途径的修改与删除。
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import shlex
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+from ai_pipeline.session_store import SessionStore, get_session_store
+from WebEngine.paths import CACHE_DIR
+from WebEngine.shader_index import fts_terms_clause, fts_tokenizer, get_shader_index
+
+CONVERSATION_DB = CACHE_DIR / "conversation_index.sqlite3"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS conversations (
+    session_id TEXT PRIMARY KEY,
+    hash TEXT NOT NULL,
+    title TEXT NOT NULL DEFAULT '',
+    updated_at TEXT NOT NULL DEFAULT ''
+);
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY,
+    session_id TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    role TEXT NOT NULL,
+    content TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS messages_session ON messages(session_id);
+-- 外部内容表：FTS 只存倒排索引，按 rowid 随 messages 增删
+CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+    content, content='messages', content_rowid='id', tokenize='{tokenizer}'
+);
+CREATE TRIGGER IF NOT EXISTS messages_ai AFTER INSERT ON messages BEGIN
+    INSERT INTO messages_fts (rowid, content) VALUES (new.id, new.content);
+END;
+CREATE TRIGGER IF NOT EXISTS messages_ad AFTER DELETE ON messages BEGIN
+    INSERT INTO messages_fts (messages_fts, rowid, content) VALUES ('delete', old.id, old.content);
+END;
+"""
+
+_FILTERS = ("style", "uniform", "in", "since", "type")
+
+
+def parse_query(query: str) -> tuple[list[str], dict[str, str]]:
+    """Split a query into free-text terms and key:value filters."""
+    try:
+        tokens = shlex.split(query)
+    except ValueError:
+        tokens = query.split()
+    terms, filters = [], {}
+    for token in tokens:
+        key, sep, value = token.partition(":")
+        if sep and key.lower() in _FILTERS and value:
+            filters[key.lower()] = value
+        elif token.strip():
+            terms.append(token.strip())
+    return terms, filters
+
+
+def parse_since(value: str) -> float | None:
+    """'7d' / '12h' / '2w' / '30m' → 对应时间点的时间戳；也接受 YYYY-MM-DD。"""
+    units = {"m": 60, "h": 3600, "d": 86400, "w": 7 * 86400}
+    value = value.strip().lower()
+    if value[-1:] in units and value[:-1].isdigit():
+        return time.time() - int(value[:-1]) * units[value[-1]]
+    try:
+        return datetime.strptime(value, "%Y-%m-%d").timestamp()
+    except ValueError:
+        return None
+
+
+def _messages_hash(messages: list) -> str:
+    return hashlib.sha1(json.dumps(messages, ensure_ascii=False, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+class ConversationIndex:
+    def __init__(self, db_path: Path = CONVERSATION_DB, store: SessionStore | None = None):
+        self.store = store or get_session_store()
+        db_path = Path(db_path)
+        db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(str(db_path), check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        self._synced_version = None
+        self.tokenizer = fts_tokenizer(self._db)
+        with self._lock, self._db:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.executescript(_SCHEMA.format(tokenizer=self.tokenizer))
+
+    def _reindex_locked(self, session_id: str, messages: list, digest: str, title: str, updated_at: str) -> None:
+        self._db.execute("DELETE FROM messages WHERE session_id = ?", (session_id,))
+        self._db.executemany(
+            "INSERT INTO messages (session_id, idx, role, content) VALUES (?, ?, ?, ?)",
+            [(session_id, i, m.get("role", ""), m.get("content") or "")
+             for i, m in enumerate(messages) if isinstance(m, dict) and isinstance(m.get("content"), str)],
+        )
+        self._db.execute(
+            "INSERT OR REPLACE INTO conversations (session_id, hash, title, updated_at) VALUES (?, ?, ?, ?)",
+            (session_id, digest, title, updated_at),
+        )
+
+    def index_conversation(self, session_id: str, messages: list, title: str = "", updated_at: str = "") -> bool:
+        """Re-index one session if its messages changed; returns True when it did."""
+        if not session_id or session_id.startswith("_"):
+            return False
+        digest = _messages_hash(messages)
+        with self._lock, self._db:
+            row = self._db.execute("SELECT hash, title, updated_at FROM conversations WHERE session_id = ?",
+                                   (session_id,)).fetchone()
+            if row is not None and row["hash"] == digest:
+                return False
+            if row is not None:
+                title = title or row["title"]
+                updated_at = updated_at or row["updated_at"]
+            self._reindex_locked(session_id, messages, digest, title,
+                                 updated_at or time.strftime("%Y-%m-%d %H:%M:%S"))
+        return True
+
+    def sync(self) -> None:
+        """会话存储的索引版本变化时做差异更新：updated_at 变化的会话才读取消息并比较哈希。"""
+        version = self.store.version()
+        if version is not None and version == self._synced_version:
+            return
+        sessions = self.store.list_sessions()
+        with self._lock:
+            known = {r["session_id"]: (r["hash"], r["title"], r["updated_at"])
+                     for r in self._db.execute("SELECT session_id, hash, title, updated_at FROM conversations")}
+        changed = []
+        for sid, meta in sessions.items():
+            if sid.startswith("_"):
+                continue
+            title, updated_at = meta.get("title") or sid, meta.get("updated_at", "")
+            row = known.get(sid)
+            if row is not None and row[2] == updated_at:
+                if row[1] != title:
+                    changed.append((sid, None, row[0], title, updated_at))
+                continue
+            # 读消息不持有数据库锁
+            messages = self.store.load(sid)
+            changed.append((sid, messages, _messages_hash(messages), title, updated_at))
+        with self._lock, self._db:
+            for sid, messages, digest, title, updated_at in changed:
+                if messages is None or known.get(sid, ("",))[0] == digest:
+                    # 只有标题/时间变化
+                    self._db.execute("UPDATE conversations SET title = ?, updated_at = ? WHERE session_id = ?",
+                                     (title, updated_at, sid))
+                else:
+                    self._reindex_locked(sid, messages, digest, title, updated_at)
+            for sid in known:
+                if sid not in sessions:
+                    self._db.execute("DELETE FROM messages WHERE session_id = ?", (sid,))
+                    self._db.execute("DELETE FROM conversations WHERE session_id = ?", (sid,))
+        self._synced_version = version
+
+    def search(self, terms: list[str], since: float | None = None, limit: int = 50) -> list[dict]:
+        """每个会话取最相关的一条消息。"""
+        self.sync()
+        if not terms:
+            return []
+        clause, args = fts_terms_clause("messages_fts", ["m.content"], terms, self.tokenizer)
+        where = [clause]
+        if since is not None:
+            where.append("c.updated_at >= ?")
+            args.append(time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(since)))
+        sql = (
+            "SELECT m.session_id AS session_id, m.idx AS idx, m.role AS role, "
+            "snippet(messages_fts, 0, '[', ']', '…', 12) AS snippet, c.title AS title, c.updated_at AS updated_at "
+            "FROM messages_fts JOIN messages m ON m.id = messages_fts.rowid "
+            "JOIN conversations c ON c.session_id = m.session_id "
+            f"WHERE {' AND '.join(where)} ORDER BY bm25(messages_fts), c.updated_at DESC LIMIT ?"
+        )
+        with self._lock:
+            rows = self._db.execute(sql, args + [max(1, min(int(limit), 200)) * 4]).fetchall()
+        results, seen = [], set()
+        for row in rows:
+            if row["session_id"] in seen:
+                continue
+            seen.add(row["session_id"])
+            results.append({k: row[k] for k in ("session_id", "title", "updated_at", "idx", "role", "snippet")})
+            if len(results) >= limit:
+                break
+        return results
+
+
+_conversations: ConversationIndex | None = None
+_conversations_lock = threading.Lock()
+
+
+def get_conversation_index() -> ConversationIndex:
+    global _conversations
+    with _conversations_lock:
+        if _conversations is None:
+            _conversations = ConversationIndex()
+        return _conversations
+
+
+def search(query: str, kind: str = "", limit: int = 20) -> dict:
+    """Run a search across shaders and conversations; kind narrows it to one of them."""
+    t0 = time.perf_counter()
+    terms, filters = parse_query(query)
+    kind = filters.get("type", kind)
+    since = parse_since(filters["since"]) if "since" in filters else None
+    result: dict = {"query": query, "terms": terms, "filters": filters}
+    if kind in ("", "shader", "shaders"):
+        result["shaders"] = get_shader_index().search(
+            terms, style=filters.get("style", ""), uniform=filters.get("uniform", ""),
+            directory=filters.get("in", ""), since=since, limit=limit)
+    if kind in ("", "conversation", "conversations"):
+        result["conversations"] = get_conversation_index().search(terms, since=since, limit=limit)
+    result["took_ms"] = round((time.perf_counter() - t0) * 1000.0, 2)
+    return result
+
+
+# ---- 自检：python -m WebEngine.search_index ----
+if __name__ == "__main__":
+    import tempfile
+
+    with tempfile.TemporaryDirectory() as tmp:
+        root = Path(tmp)
+        store = SessionStore(root / "sessions", None, None)
+        for i in range(2000):
+            store.save(f"s{i}", [
+                {"role": "user", "content": f"做一个霓虹光环效果 #{i}" if i % 50 == 0 else f"普通请求 {i}"},
+                {"role": "assistant", "content": "好的，这是 neon ring shader" if i % 50 == 0 else "好的"}])
+        index = ConversationIndex(root / "idx.sqlite3", store)
+        t = time.perf_counter(); index.sync(); first = time.perf_counter() - t
+        for q in ("neon ring", "霓虹光环", "光环"):
+            t = time.perf_counter(); hits = index.search(parse_query(q)[0], limit=10)
+            print(f"{q!r}: {len(hits)} hits in {(time.perf_counter() - t) * 1000:.2f}ms  first={hits[0]['snippet'] if hits else None}")
+        time.sleep(1.1)   # updated_at 精确到秒
+        store.save("s0", store.load("s0") + [{"role": "user", "content": "把颜色改成紫色"}])
+        store.delete("s50")
+        t = time.perf_counter(); index.sync(); incr = time.perf_counter() - t
+        print(f"initial sync {first:.2f}s, incremental sync {incr:.3f}s, "
+              f"'紫色' → {[h['session_id'] for h in index.search(['紫色'])]}, "
+              f"'霓虹光环' → {len(index.search(['霓虹光环'], limit=100))} sessions")
+        print(parse_query('neon "soft glow" style:neon uniform:iChannel0 since:7d'))
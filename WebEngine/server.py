@@ -1,18 +1,37 @@
-"""统一 HTTP 服务：启动/停止，端口自动递增。"""
+"""统一 HTTP 服务：启动/停止，端口自动递增。
+
+基于 asyncio（见 aio_http.py）：连接与 SSE 发送由单个事件循环处理，
+阻塞的业务处理在有界线程池中执行；ASYNC_ROUTES（音乐上传、渲染进程 WebSocket）直接在事件循环中运行，
+请求体由处理协程流式读取。
+"""
 from __future__ import annotations
 
+import asyncio
+import os
 import socket
 import threading
-from http.server import ThreadingHTTPServer
+from concurrent.futures import ThreadPoolExecutor
 from typing import Optional
 
-from WebEngine.api import APIHandler
+from WebEngine.aio_http import EventStream, Request, Response, WebSocket, handle_connection
+from WebEngine.api import ASYNC_ROUTES, APIHandler
+from WebEngine.jobs import shutdown_scheduler
+from WebEngine.music_library import shutdown_music_library
+from WebEngine.thumbnails import shutdown_thumbnail_service
+from ai_pipeline.context import shutdown_context_manager
+from ai_pipeline.llm.pool import shutdown_llm_pool
+from ai_pipeline.response_cache import shutdown_response_cache
+from ai_pipeline.session_cache import shutdown_session_cache
 
 DEFAULT_PORT = 18090
 MAX_PORT = 18099
+WORKER_THREADS = int(os.environ.get("MS_HTTP_WORKERS", "16"))
 
-_server: Optional[ThreadingHTTPServer] = None
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_server: Optional[asyncio.base_events.Server] = None
 _server_thread: Optional[threading.Thread] = None
+_executor: Optional[ThreadPoolExecutor] = None
+_port: Optional[int] = None
 _lock = threading.Lock()
 
 
@@ -28,30 +47,96 @@ def _find_port(start: int = DEFAULT_PORT) -> int:
     raise RuntimeError(f"No port available in {DEFAULT_PORT}-{MAX_PORT}")
 
 
+def _stream_body(request: Request) -> bool:
+    return (request.method, request.path) in ASYNC_ROUTES
+
+
+async def _dispatch(request: Request) -> Response | EventStream | WebSocket:
+    """在线程池中运行 APIHandler；处理函数给出响应（普通响应或 SSE 流）后立即返回。"""
+    route = ASYNC_ROUTES.get((request.method, request.path))
+    if route is not None:
+        return await route(request)
+    loop = asyncio.get_running_loop()
+    handler = APIHandler(request, loop)
+    job = loop.run_in_executor(_executor, handler.handle)
+    done, _ = await asyncio.wait({job, handler.response_ready}, return_when=asyncio.FIRST_COMPLETED)
+    if handler.response_ready.done():
+        if job not in done:
+            # SSE：生产者仍在运行，记录其异常即可
+            job.add_done_callback(_log_job_error)
+        return handler.response_ready.result()
+    exc = job.exception()
+    if exc is not None:
+        return Response.error(500, str(exc))
+    return Response.error(500, "no response")
+
+
+def _log_job_error(fut) -> None:
+    if not fut.cancelled() and fut.exception() is not None:
+        print(f"[server] handler error: {fut.exception()!r}")
+
+
+def _serve(port: int, ready: threading.Event) -> None:
+    global _loop, _server
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    _loop = loop
+
+    async def _client(reader, writer):
+        await handle_connection(reader, writer, _dispatch, _stream_body)
+
+    _server = loop.run_until_complete(asyncio.start_server(_client, "127.0.0.1", port))
+    ready.set()
+    try:
+        loop.run_forever()
+    finally:
+        _server.close()
+        loop.run_until_complete(_server.wait_closed())
+        loop.close()
+
+
 def start_server(port: int = DEFAULT_PORT) -> int:
-    global _server, _server_thread
+    global _server_thread, _executor, _port
     with _lock:
-        if _server is not None:
-            return _server.server_address[1]
+        if _server_thread is not None and _port is not None:
+            return _port
 
-    actual = _find_port(port)
-    _server = ThreadingHTTPServer(("127.0.0.1", actual), APIHandler)
-    _server_thread = threading.Thread(target=_server.serve_forever, daemon=True)
-    _server_thread.start()
-    return actual
+        actual = _find_port(port)
+        _executor = ThreadPoolExecutor(max_workers=WORKER_THREADS, thread_name_prefix="api")
+        ready = threading.Event()
+        _server_thread = threading.Thread(target=_serve, args=(actual, ready), daemon=True)
+        _server_thread.start()
+        ready.wait(10)
+        # 后台预热静态资源（读取 + 预压缩），首个页面请求即可直接命中缓存
+        threading.Thread(target=APIHandler._static.warm, name="static-warm", daemon=True).start()
+        _port = actual
+        return actual
 
 
 def stop_server():
-    global _server, _server_thread
+    global _server_thread, _executor, _port, _loop
     with _lock:
-        if _server is not None:
-            _server.shutdown()
-            _server.server_close()
-            _server = None
+        if _loop is not None:
+            _loop.call_soon_threadsafe(_loop.stop)
+        if _server_thread is not None:
+            _server_thread.join(timeout=5)
+        if _executor is not None:
+            _executor.shutdown(wait=False, cancel_futures=True)
+        # 取消排队/运行中的生成任务，再回写仍在缓存中的会话
+        shutdown_scheduler()
+        shutdown_thumbnail_service()
+        shutdown_music_library()
+        APIHandler._sessions.save_all()
+        # 回写缓存中尚未落盘的会话
+        shutdown_context_manager()
+        shutdown_session_cache()
+        shutdown_llm_pool()
+        shutdown_response_cache()
+        _loop = None
         _server_thread = None
+        _executor = None
+        _port = None
 
 
 def get_port() -> int | None:
-    if _server is not None:
-        return _server.server_address[1]
-    return None
+    return _port
@@ -0,0 +1,186 @@
+"""会话级 AIService 注册表：按 session_id 缓存服务实例（LRU），每个会话一把锁。
+
+不同会话的请求可并行生成；同一会话的请求在该会话锁上排队，互不覆盖 history。
+"""
+from __future__ import annotations
+
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Callable, Iterator
+
+DEFAULT_CAPACITY = 32
+
+
+class _Entry:
+    __slots__ = ("service", "lock", "users")
+
+    def __init__(self, service: Any):
+        self.service = service
+        self.lock = threading.RLock()
+        self.users = 0          # 正在使用（持有或等待锁）的请求数，>0 时不淘汰
+
+
+def _default_factory(session_id: str):
+    from WebEngine.ai_service import AIService
+
+    service = AIService(session_id=session_id)
+    if session_id:
+        service.load_history(session_id)
+    return service
+
+
+class SessionRegistry:
+    """LRU of per-session services.
+
+    factory(session_id) builds a service with .session_id, .history and .save().
+    Evicted services are saved first; entries in use are never evicted.
+    An empty session_id gets a throwaway service that is not cached.
+    """
+
+    def __init__(self, capacity: int = DEFAULT_CAPACITY, factory: Callable[[str], Any] | None = None):
+        self.capacity = max(1, capacity)
+        self._factory = factory or _default_factory
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _acquire_entry(self, session_id: str) -> _Entry:
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if entry is not None:
+                self._entries.move_to_end(session_id)
+                entry.users += 1
+                return entry
+        # 构建服务（加载历史）可能较慢，不持有全局锁
+        service = self._factory(session_id)
+        evicted: list[_Entry] = []
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if entry is None:
+                entry = _Entry(service)
+                self._entries[session_id] = entry
+            else:
+                self._entries.move_to_end(session_id)
+            entry.users += 1
+            evicted = self._evict_locked()
+        for old in evicted:
+            self._save(old)
+        return entry
+
+    def _evict_locked(self) -> list[_Entry]:
+        evicted = []
+        for sid in list(self._entries):
+            if len(self._entries) <= self.capacity:
+                break
+            entry = self._entries[sid]
+            if entry.users == 0:
+                evicted.append(self._entries.pop(sid))
+        return evicted
+
+    @staticmethod
+    def _save(entry: _Entry) -> None:
+        with entry.lock:
+            try:
+                entry.service.save()
+            except Exception as e:
+                print(f"[sessions] save on evict failed: {e}")
+
+    @contextmanager
+    def session(self, session_id: str) -> Iterator[Any]:
+        """Hold the session's lock and yield its service."""
+        if not session_id:
+            yield self._factory("")
+            return
+        entry = self._acquire_entry(session_id)
+        try:
+            with entry.lock:
+                yield entry.service
+        finally:
+            with self._lock:
+                entry.users -= 1
+                evicted = self._evict_locked()
+            for old in evicted:
+                self._save(old)
+
+    def discard(self, session_id: str) -> None:
+        """Drop a session without saving (e.g. after it was deleted)."""
+        with self._lock:
+            self._entries.pop(session_id, None)
+
+    def for_each(self, fn: Callable[[Any], None]) -> None:
+        with self._lock:
+            services = [e.service for e in self._entries.values()]
+        for service in services:
+            fn(service)
+
+    def save_all(self) -> None:
+        with self._lock:
+            entries = list(self._entries.values())
+        for entry in entries:
+            self._save(entry)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+
+# ---- 负载测试：python -m WebEngine.session_registry [sessions] [turns] ----
+if __name__ == "__main__":
+    import random
+    import sys
+    import time
+    from concurrent.futures import ThreadPoolExecutor
+
+    n_sessions = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    turns = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    latency = 0.05
+
+    class _EchoService:
+        """模拟一次耗时生成：读 history → 等待 → 追加一问一答。"""
+
+        def __init__(self, session_id: str):
+            self.session_id = session_id
+            self.history: list[dict] = []
+            self.saved: list[dict] = []
+
+        def generate(self, prompt: str) -> str:
+            before = len(self.history)
+            time.sleep(latency * random.uniform(0.5, 1.5))
+            # 若有并发写入同一会话，这里的长度会被别的请求改掉
+            assert len(self.history) == before, "concurrent mutation within one session"
+            reply = f"{self.session_id}:{prompt}"
+            self.history += [{"role": "user", "content": prompt}, {"role": "assistant", "content": reply}]
+            return reply
+
+        def save(self) -> None:
+            self.saved = list(self.history)
+
+    registry = SessionRegistry(capacity=n_sessions, factory=_EchoService)
+
+    def _turn(args):
+        sid, i = args
+        with registry.session(sid) as svc:
+            return svc.generate(f"p{i}")
+
+    jobs = [(f"s{s}", i) for i in range(turns) for s in range(n_sessions)]
+    # 每个会话再额外并发两次同一会话请求，验证排队
+    jobs += [(f"s{s}", turns + k) for s in range(n_sessions) for k in range(2)]
+    random.shuffle(jobs)
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=n_sessions * 2) as pool:
+        replies = list(pool.map(_turn, jobs))
+    elapsed = time.perf_counter() - t0
+
+    ok = True
+    for s in range(n_sessions):
+        sid = f"s{s}"
+        with registry.session(sid) as svc:
+            mine = [m["content"] for m in svc.history if m["role"] == "assistant"]
+        if len(mine) != turns + 2 or any(not c.startswith(sid + ":") for c in mine):
+            ok = False
+            print(f"[FAIL] {sid}: {mine}")
+    serial = len(jobs) * latency
+    print(f"sessions={n_sessions} requests={len(jobs)} elapsed={elapsed:.2f}s serial≈{serial:.2f}s "
+          f"speedup≈{serial / elapsed:.1f}x isolation={'ok' if ok else 'FAILED'}")
+    sys.exit(0 if ok else 1)
@@ -3,8 +3,11 @@ from __future__ import annotations
 
 import json
 import os
+import threading
 from pathlib import Path
-from typing import Optional
+from typing import Callable, Iterable, Optional
+
+from ai_pipeline.storage import FileLock, atomic_write_json
 
 
 class Settings:
@@ -13,6 +16,9 @@ class Settings:
     设置页写入 settings.json 后应立即成为应用有效配置，避免被父进程里
     残留的 OPENAI_* 环境变量覆盖。若确实需要环境变量优先，可设置
     MS_PREFER_ENV=1。
+    写入在 settings.json.lock 文件锁内“读取 → 合并 → 原子替换”，多个进程同时保存不会丢字段。
+    读取使用解析后的快照，每次访问只 stat 一次文件，(mtime, size, inode) 变化时才重新解析。
+    有效值发生变化（本进程 update() 或其他进程改写文件）时通知 subscribe() 注册的回调。
     """
 
     _instance: Optional["Settings"] = None
@@ -27,6 +33,15 @@ class Settings:
         "speech_base_url": "https://api.openai.com/v1",
         "speech_model": "whisper-1",
     }
+    # 对应的环境变量
+    ENV_VARS = {
+        "api_key": "OPENAI_API_KEY",
+        "base_url": "OPENAI_BASE_URL",
+        "model": "OPENAI_MODEL",
+        "speech_api_key": "OPENAI_SPEECH_API_KEY",
+        "speech_base_url": "OPENAI_SPEECH_BASE_URL",
+        "speech_model": "OPENAI_SPEECH_MODEL",
+    }
 
     def __new__(cls, config_dir: Path | None = None):
         if cls._instance is None:
@@ -43,11 +58,17 @@ class Settings:
             # 默认项目根目录
             config_dir = Path(__file__).resolve().parent.parent
         self._config_path = config_dir / "settings.json"
+        self._file_lock = FileLock(config_dir / "settings.json.lock")
+        self._lock = threading.Lock()
+        self._snapshot: dict = {}
+        self._stamp: tuple | None = None
+        self._effective: dict | None = None
+        self._subscribers: list[tuple[Callable[[dict], None], frozenset | None]] = []
 
     # --- 属性访问 ---
     @property
     def api_key(self) -> str:
-        return self._get("api_key", "OPENAI_API_KEY")
+        return self._get("api_key")
 
     @api_key.setter
     def api_key(self, value: str):
@@ -55,7 +76,7 @@ class Settings:
 
     @property
     def base_url(self) -> str:
-        return self._get("base_url", "OPENAI_BASE_URL")
+        return self._get("base_url")
 
     @base_url.setter
     def base_url(self, value: str):
@@ -63,7 +84,7 @@ class Settings:
 
     @property
     def model(self) -> str:
-        return self._get("model", "OPENAI_MODEL")
+        return self._get("model")
 
     @model.setter
     def model(self, value: str):
@@ -71,7 +92,7 @@ class Settings:
 
     @property
     def speech_api_key(self) -> str:
-        return self._get("speech_api_key", "OPENAI_SPEECH_API_KEY")
+        return self._get("speech_api_key")
 
     @speech_api_key.setter
     def speech_api_key(self, value: str):
@@ -79,7 +100,7 @@ class Settings:
 
     @property
     def speech_base_url(self) -> str:
-        return self._get("speech_base_url", "OPENAI_SPEECH_BASE_URL")
+        return self._get("speech_base_url")
 
     @speech_base_url.setter
     def speech_base_url(self, value: str):
@@ -87,7 +108,7 @@ class Settings:
 
     @property
     def speech_model(self) -> str:
-        return self._get("speech_model", "OPENAI_SPEECH_MODEL")
+        return self._get("speech_model")
 
     @speech_model.setter
     def speech_model(self, value: str):
@@ -102,10 +123,13 @@ class Settings:
         return bool(self.speech_api_key)
 
     # --- 读取逻辑 ---
-    def _get(self, config_key: str, env_var: str) -> str:
+    def _get(self, config_key: str) -> str:
+        return self._resolve(config_key, self._read_file())
+
+    def _resolve(self, config_key: str, data: dict) -> str:
         """默认配置文件优先；MS_PREFER_ENV=1 时环境变量优先。"""
-        env_val = os.getenv(env_var, "").strip()
-        file_val = self._read_file().get(config_key, "")
+        env_val = os.getenv(self.ENV_VARS.get(config_key, ""), "").strip()
+        file_val = data.get(config_key, "")
 
         if os.getenv("MS_PREFER_ENV", "").strip() == "1":
             if env_val:
@@ -120,36 +144,85 @@ class Settings:
 
         return self.DEFAULTS.get(config_key, "")
 
+    def _resolve_all(self, data: dict) -> dict:
+        return {key: self._resolve(key, data) for key in self.DEFAULTS}
+
     def _set(self, config_key: str, value: str):
         """写入 JSON 文件（不覆盖环境变量）。"""
-        data = self._read_file()
-        data[config_key] = value
-        self._write_file(data)
+        self._write_fields({config_key: value})
 
-    def _read_file(self) -> dict:
-        if not self._config_path.is_file():
-            return {}
+    def _write_fields(self, fields: dict):
+        """把多个字段合并进配置文件，只加锁、写入一次。"""
+        with self._file_lock:
+            data = dict(self._read_file())
+            data.update(fields)
+            self._write_file(data)
+            self._store_snapshot(data, self._file_stamp())
+
+    def _file_stamp(self) -> tuple | None:
         try:
-            return json.loads(self._config_path.read_text(encoding="utf-8-sig"))
-        except (json.JSONDecodeError, OSError):
-            return {}
+            st = self._config_path.stat()
+        except OSError:
+            return None
+        return st.st_mtime_ns, st.st_size, st.st_ino
+
+    def _read_file(self) -> dict:
+        """Parsed settings.json (shared snapshot; do not mutate), re-read only when the file changed."""
+        stamp = self._file_stamp()
+        if stamp is not None and stamp == self._stamp:
+            return self._snapshot
+        data = {}
+        if stamp is not None:
+            try:
+                data = json.loads(self._config_path.read_text(encoding="utf-8-sig"))
+            except (json.JSONDecodeError, OSError):
+                data = {}
+            if not isinstance(data, dict):
+                data = {}
+        self._store_snapshot(data, stamp)
+        return data
+
+    def _store_snapshot(self, data: dict, stamp: tuple | None):
+        with self._lock:
+            self._snapshot, self._stamp = data, stamp
+            effective = self._resolve_all(data)
+            previous, self._effective = self._effective, effective
+            subscribers = list(self._subscribers)
+        if previous is None:
+            return
+        changed = {k: v for k, v in effective.items() if previous.get(k) != v}
+        if not changed:
+            return
+        for callback, keys in subscribers:
+            if keys is None or keys & changed.keys():
+                try:
+                    callback(changed)
+                except Exception as e:
+                    print(f"[settings] subscriber {getattr(callback, '__qualname__', callback)} failed: {e}")
 
     def _write_file(self, data: dict):
-        self._config_path.write_text(
-            json.dumps(data, ensure_ascii=False, indent=2),
-            encoding="utf-8",
-        )
+        atomic_write_json(self._config_path, data, indent=2)
+
+    # --- 变更通知 ---
+    def subscribe(self, callback: Callable[[dict], None], keys: Iterable[str] | None = None) -> Callable[[], None]:
+        """Call callback({key: new_value}) when any of keys (default: any setting) changes; returns an unsubscribe function."""
+        item = (callback, frozenset(keys) if keys is not None else None)
+        with self._lock:
+            self._subscribers.append(item)
+        if self._effective is None:
+            # 先建立基准快照，之后的变化才会通知
+            self._read_file()
+
+        def unsubscribe() -> None:
+            with self._lock:
+                if item in self._subscribers:
+                    self._subscribers.remove(item)
+
+        return unsubscribe
 
     # --- 便捷方法 ---
     def to_dict(self) -> dict:
-        return {
-            "api_key": self.api_key,
-            "base_url": self.base_url,
-            "model": self.model,
-            "speech_api_key": self.speech_api_key,
-            "speech_base_url": self.speech_base_url,
-            "speech_model": self.speech_model,
-        }
+        return self._resolve_all(self._read_file())
 
     def update(
         self,
@@ -160,19 +233,18 @@ class Settings:
         speech_base_url: str = "",
         speech_model: str = "",
     ):
-        """批量更新并持久化。"""
-        if api_key:
-            self.api_key = api_key
-        if base_url:
-            self.base_url = base_url
-        if model:
-            self.model = model
-        if speech_api_key:
-            self.speech_api_key = speech_api_key
-        if speech_base_url:
-            self.speech_base_url = speech_base_url
-        if speech_model:
-            self.speech_model = speech_model
+        """批量更新并持久化（一次写入）。"""
+        fields = {
+            "api_key": api_key,
+            "base_url": base_url,
+            "model": model,
+            "speech_api_key": speech_api_key,
+            "speech_base_url": speech_base_url,
+            "speech_model": speech_model,
+        }
+        fields = {k: v for k, v in fields.items() if v}
+        if fields:
+            self._write_fields(fields)
 
     def get_deepseek_presets(self) -> dict:
         """DeepSeek 预设值。"""
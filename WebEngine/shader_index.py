@@ -0,0 +1,363 @@
+"""Shader 库索引：SQLite 目录表，按 mtime/大小差异增量重扫，列表查询只取一页。
+
+每个 .glsl 记录大小、mtime、内容哈希、用到的 uniform、style_profile 头注释、编译状态与缩略图路径，
+并同步写入 FTS5 全文索引（文件名 / 头部元信息 / 源码），供 search() 使用。
+重扫只对 mtime/大小变化的文件读内容；扫描在后台线程进行，请求不等待（首次除外）。
+API 的保存/重命名/删除会直接调用 touch()/remove()，无需等待下一次重扫。
+"""
+from __future__ import annotations
+
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+from WebEngine.paths import CACHE_DIR, PROJECT_ROOT, SHADERS_DIR
+
+INDEX_DB = CACHE_DIR / "shader_index.sqlite3"
+# 两次重扫之间的最短间隔（秒）
+RESCAN_INTERVAL = float(os.environ.get("MS_SHADER_RESCAN_INTERVAL", "5"))
+
+SORT_COLUMNS = {"mtime": "mtime", "name": "name COLLATE NOCASE", "size": "size"}
+
+# ShaderToy 内置 uniform（iTime / iChannel0 …）与显式声明的 uniform
+_BUILTIN_RE = re.compile(r"\b(i[A-Z][A-Za-z0-9_]*)\b")
+_DECL_RE = re.compile(r"\buniform\s+\w+\s+(\w+)")
+# GenerationHookEngine.inject_header 写入的 "// key: value" 头注释
+_HEADER_RE = re.compile(r"^//\s*(style_profile|generated_with)\s*:\s*(.+?)\s*$", re.MULTILINE)
+
+# 表结构变化时递增；版本不一致则重建（索引可从文件完整恢复）
+SCHEMA_VERSION = 3
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS shaders (
+    path TEXT PRIMARY KEY,          -- 相对 PROJECT_ROOT，使用 /
+    name TEXT NOT NULL,
+    dir TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    hash TEXT NOT NULL,
+    uniforms TEXT NOT NULL DEFAULT '',
+    style_profile TEXT NOT NULL DEFAULT '',
+    compile_status TEXT NOT NULL DEFAULT 'unknown',   -- unknown / ok / error
+    compile_error TEXT NOT NULL DEFAULT '',
+    thumbnail TEXT NOT NULL DEFAULT ''
+);
+CREATE INDEX IF NOT EXISTS shaders_mtime ON shaders(mtime);
+CREATE INDEX IF NOT EXISTS shaders_name ON shaders(name COLLATE NOCASE);
+-- rowid 与 shaders.rowid 一致，按 rowid 删除/替换（不扫描全表）
+CREATE VIRTUAL TABLE IF NOT EXISTS shaders_fts USING fts5(name, meta, source, tokenize='{tokenizer}');
+"""
+
+
+def fts_tokenizer(db: sqlite3.Connection) -> str:
+    """trigram 支持中文子串匹配（SQLite >= 3.34）；不可用时退回 unicode61。"""
+    try:
+        db.execute("CREATE VIRTUAL TABLE temp._probe USING fts5(x, tokenize='trigram')")
+        db.execute("DROP TABLE temp._probe")
+        return "trigram"
+    except sqlite3.OperationalError:
+        return "unicode61"
+
+
+def fts_terms_clause(table: str, columns: list[str], terms: list[str], tokenizer: str) -> tuple[str, list]:
+    """Build a WHERE fragment matching every term (AND).
+
+    trigram 只能索引 >= 3 个字符的词，更短的词（如两个汉字）退回对 FTS 表的 LIKE 扫描。
+    """
+    indexed = [t for t in terms if tokenizer != "trigram" or len(t) >= 3]
+    short = [t for t in terms if t not in indexed]
+    where, args = [], []
+    if indexed:
+        where.append(f"{table} MATCH ?")
+        args.append(" ".join('"' + t.replace('"', '""') + '"' for t in indexed))
+    for term in short:
+        like = "%" + term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+        where.append("(" + " OR ".join(f"{c} LIKE ? ESCAPE '\\'" for c in columns) + ")")
+        args += [like] * len(columns)
+    return " AND ".join(where), args
+
+
+def parse_header(source: str) -> dict[str, str]:
+    return {k: v for k, v in _HEADER_RE.findall(source[:2000])}
+
+
+def extract_uniforms(source: str) -> list[str]:
+    names = set(_BUILTIN_RE.findall(source)) | set(_DECL_RE.findall(source))
+    return sorted(names)
+
+
+class ShaderIndex:
+    def __init__(self, shaders_dir: Path = SHADERS_DIR, db_path: Path = INDEX_DB, root: Path = PROJECT_ROOT):
+        self.shaders_dir = Path(shaders_dir)
+        self.root = Path(root)
+        db_path = Path(db_path)
+        db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(str(db_path), check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        self._scan_lock = threading.Lock()
+        self._last_scan = 0.0
+        self._scanning = False
+        self.tokenizer = fts_tokenizer(self._db)
+        with self._lock, self._db:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            if self._db.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+                self._db.execute("DROP TABLE IF EXISTS shaders")
+                self._db.execute("DROP TABLE IF EXISTS shaders_fts")
+                self._db.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+            self._db.executescript(_SCHEMA.format(tokenizer=self.tokenizer))
+
+    # ---- 扫描 ----
+    def _rel(self, fp: Path) -> str:
+        return str(fp.relative_to(self.root)).replace("\\", "/")
+
+    def _walk(self, directory: str):
+        """os.scandir 递归遍历，DirEntry.stat() 在多数平台上不额外发系统调用。"""
+        try:
+            with os.scandir(directory) as it:
+                for entry in it:
+                    if entry.is_dir(follow_symlinks=False):
+                        yield from self._walk(entry.path)
+                    elif entry.name.endswith(".glsl"):
+                        yield entry
+        except OSError:
+            return
+
+    def rescan(self) -> dict:
+        """mtime/大小差异重扫；返回新增/更新/删除计数。"""
+        with self._scan_lock:
+            with self._lock:
+                known = {r["path"]: (r["mtime"], r["size"])
+                         for r in self._db.execute("SELECT path, mtime, size FROM shaders")}
+            seen: set[str] = set()
+            changed: list[tuple] = []
+            for entry in self._walk(str(self.shaders_dir)):
+                try:
+                    st = entry.stat()
+                except OSError:
+                    continue
+                rel = self._rel(Path(entry.path))
+                seen.add(rel)
+                if known.get(rel) == (st.st_mtime, st.st_size):
+                    continue
+                row = self._row(Path(entry.path), rel, st)
+                if row is not None:
+                    changed.append(row)
+            removed = [p for p in known if p not in seen]
+            with self._lock, self._db:
+                self._upsert(changed)
+                for path in removed:
+                    self._delete_locked(path)
+            self._last_scan = time.time()
+            added = sum(1 for row, _ in changed if row[0] not in known)
+            return {"added": added, "updated": len(changed) - added, "removed": len(removed)}
+
+    def _row(self, fp: Path, rel: str, st) -> tuple[tuple, tuple] | None:
+        """(shaders 行, shaders_fts 行)"""
+        try:
+            data = fp.read_bytes()
+        except OSError:
+            return None
+        source = data.decode("utf-8", errors="ignore")
+        uniforms = ",".join(extract_uniforms(source))
+        header = parse_header(source)
+        style = header.get("style_profile", "")
+        meta = " ".join([style, header.get("generated_with", ""), uniforms.replace(",", " ")]).strip()
+        row = (rel, fp.name, self._rel(fp.parent), st.st_size, st.st_mtime,
+               hashlib.sha1(data).hexdigest(), uniforms, style)
+        return row, (fp.stem, meta, source)
+
+    def _upsert(self, rows: list[tuple[tuple, tuple]]) -> None:
+        # 内容哈希变化时编译状态与缩略图失效
+        self._db.executemany(
+            """INSERT INTO shaders (path, name, dir, size, mtime, hash, uniforms, style_profile)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+               ON CONFLICT(path) DO UPDATE SET
+                   name=excluded.name, dir=excluded.dir, size=excluded.size, mtime=excluded.mtime,
+                   uniforms=excluded.uniforms, style_profile=excluded.style_profile,
+                   compile_status=CASE WHEN hash = excluded.hash THEN compile_status ELSE 'unknown' END,
+                   compile_error=CASE WHEN hash = excluded.hash THEN compile_error ELSE '' END,
+                   thumbnail=CASE WHEN hash = excluded.hash THEN thumbnail ELSE '' END,
+                   hash=excluded.hash""",
+            [row for row, _ in rows],
+        )
+        for row, fts in rows:
+            rowid = self._db.execute("SELECT rowid FROM shaders WHERE path = ?", (row[0],)).fetchone()[0]
+            self._db.execute("DELETE FROM shaders_fts WHERE rowid = ?", (rowid,))
+            self._db.execute("INSERT INTO shaders_fts (rowid, name, meta, source) VALUES (?, ?, ?, ?)",
+                             (rowid, *fts))
+
+    def _delete_locked(self, rel_path: str) -> None:
+        found = self._db.execute("SELECT rowid FROM shaders WHERE path = ?", (rel_path,)).fetchone()
+        if found is not None:
+            self._db.execute("DELETE FROM shaders_fts WHERE rowid = ?", (found[0],))
+            self._db.execute("DELETE FROM shaders WHERE rowid = ?", (found[0],))
+
+    def ensure_fresh(self) -> None:
+        """首次同步扫描；之后超过 RESCAN_INTERVAL 才在后台重扫，当前请求使用已有索引。"""
+        if self._last_scan == 0.0:
+            self.rescan()
+            return
+        if time.time() - self._last_scan < RESCAN_INTERVAL or self._scanning:
+            return
+        self._scanning = True
+
+        def _run():
+            try:
+                self.rescan()
+            finally:
+                self._scanning = False
+
+        threading.Thread(target=_run, name="shader-index-scan", daemon=True).start()
+
+    # ---- 单文件维护 ----
+    def touch(self, fp: Path) -> None:
+        """Re-index one file right after it was written."""
+        fp = Path(fp)
+        try:
+            st = fp.stat()
+        except OSError:
+            return
+        row = self._row(fp, self._rel(fp), st)
+        if row is not None:
+            with self._lock, self._db:
+                self._upsert([row])
+
+    def remove(self, rel_path: str) -> None:
+        with self._lock, self._db:
+            self._delete_locked(rel_path.replace("\\", "/"))
+
+    def set_compile_status(self, rel_path: str, ok: bool, error: str = "", source: str | None = None) -> None:
+        """记录编译结果；给出 source 时仅当其与索引中的文件内容一致才更新（编辑器里改过的代码不算）。"""
+        sql = "UPDATE shaders SET compile_status = ?, compile_error = ? WHERE path = ?"
+        args = ["ok" if ok else "error", error[:2000], rel_path.replace("\\", "/")]
+        if source is not None:
+            sql += " AND hash = ?"
+            args.append(hashlib.sha1(source.encode("utf-8")).hexdigest())
+        with self._lock, self._db:
+            self._db.execute(sql, args)
+
+    def set_thumbnail(self, rel_path: str, thumbnail: str) -> None:
+        with self._lock, self._db:
+            self._db.execute("UPDATE shaders SET thumbnail = ? WHERE path = ?",
+                             (thumbnail, rel_path.replace("\\", "/")))
+
+    # ---- 查询 ----
+    def query(self, offset: int = 0, limit: int = 50, sort: str = "mtime", order: str = "desc",
+              q: str = "", directory: str = "") -> dict:
+        """One page of shaders plus the total match count."""
+        self.ensure_fresh()
+        column = SORT_COLUMNS.get(sort, SORT_COLUMNS["mtime"])
+        direction = "ASC" if order.lower() == "asc" else "DESC"
+        where, args = [], []
+        if q:
+            where.append("name LIKE ? ESCAPE '\\'")
+            args.append("%" + q.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%")
+        if directory:
+            where.append("(dir = ? OR dir LIKE ?)")
+            args += [directory, directory.rstrip("/") + "/%"]
+        clause = ("WHERE " + " AND ".join(where)) if where else ""
+        limit = max(1, min(int(limit), 500))
+        offset = max(0, int(offset))
+        with self._lock:
+            total = self._db.execute(f"SELECT COUNT(*) FROM shaders {clause}", args).fetchone()[0]
+            rows = self._db.execute(
+                f"SELECT * FROM shaders {clause} ORDER BY {column} {direction}, path LIMIT ? OFFSET ?",
+                args + [limit, offset],
+            ).fetchall()
+        return {"total": total, "offset": offset, "limit": limit, "items": [self._item(r) for r in rows]}
+
+    def search(self, terms: list[str], style: str = "", uniform: str = "", directory: str = "",
+               since: float | None = None, limit: int = 50) -> list[dict]:
+        """全文 + 结构化过滤；有检索词时按 bm25 排序（文件名 > 头部元信息 > 源码），否则按 mtime。"""
+        self.ensure_fresh()
+        where, args = [], []
+        if terms:
+            clause, clause_args = fts_terms_clause(
+                "shaders_fts", ["shaders_fts.name", "shaders_fts.meta", "shaders_fts.source"],
+                terms, self.tokenizer)
+            where.append(clause)
+            args += clause_args
+        if style:
+            where.append("s.style_profile LIKE ?")
+            args.append(f"%{style}%")
+        if uniform:
+            where.append("(',' || s.uniforms || ',') LIKE ?")
+            args.append(f"%,{uniform},%")
+        if directory:
+            where.append("(s.dir = ? OR s.dir LIKE ?)")
+            args += [directory, directory.rstrip("/") + "/%"]
+        if since is not None:
+            where.append("s.mtime >= ?")
+            args.append(since)
+        clause = ("WHERE " + " AND ".join(where)) if where else ""
+        order = "bm25(shaders_fts, 10.0, 5.0, 1.0), s.mtime DESC" if terms else "s.mtime DESC"
+        sql = (f"SELECT s.*, snippet(shaders_fts, 2, '[', ']', '…', 8) AS snippet "
+               f"FROM shaders_fts JOIN shaders s ON s.rowid = shaders_fts.rowid {clause} ORDER BY {order} LIMIT ?")
+        with self._lock:
+            rows = self._db.execute(sql, args + [max(1, min(int(limit), 200))]).fetchall()
+        items = []
+        for row in rows:
+            item = self._item(row)
+            item["snippet"] = row["snippet"] if terms else ""
+            items.append(item)
+        return items
+
+    def get(self, rel_path: str) -> dict | None:
+        with self._lock:
+            row = self._db.execute("SELECT * FROM shaders WHERE path = ?",
+                                   (rel_path.replace("\\", "/"),)).fetchone()
+        return self._item(row) if row is not None else None
+
+    @staticmethod
+    def _item(row: sqlite3.Row) -> dict:
+        return {
+            "name": row["name"],
+            "path": row["path"],
+            "size": row["size"],
+            "modified": time.strftime("%Y-%m-%d %H:%M", time.localtime(row["mtime"])),
+            "mtime": row["mtime"],
+            "hash": row["hash"],
+            "uniforms": row["uniforms"].split(",") if row["uniforms"] else [],
+            "style_profile": row["style_profile"],
+            "compile_status": row["compile_status"],
+            "compile_error": row["compile_error"],
+            "thumbnail": row["thumbnail"],
+        }
+
+
+_index: ShaderIndex | None = None
+_index_lock = threading.Lock()
+
+
+def get_shader_index() -> ShaderIndex:
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = ShaderIndex()
+        return _index
+
+
+# ---- 基准：python -m WebEngine.shader_index [文件数] ----
+if __name__ == "__main__":
+    import sys
+    import tempfile
+
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 3000
+    with tempfile.TemporaryDirectory() as tmp:
+        root = Path(tmp)
+        lib = root / "shaders" / "_preview"
+        lib.mkdir(parents=True)
+        for i in range(n):
+            (lib / f"applied_{i:05d}.glsl").write_text(
+                f"void mainImage(out vec4 c, in vec2 p) {{ c = vec4(iTime * {i}.0, texture(iChannel0, p).r, 0, 1); }}\n")
+        index = ShaderIndex(root / "shaders", root / "index.sqlite3", root)
+        t = time.perf_counter(); stats = index.rescan(); full = time.perf_counter() - t
+        t = time.perf_counter(); index.rescan(); incr = time.perf_counter() - t
+        t = time.perf_counter(); page = index.query(limit=50, q="applied_01"); q_ms = (time.perf_counter() - t) * 1000
+        print(f"files={n} first_scan={full:.2f}s rescan={incr:.3f}s page_query={q_ms:.1f}ms "
+              f"matches={page['total']} first={page['items'][0]['name']} uniforms={page['items'][0]['uniforms']} {stats}")
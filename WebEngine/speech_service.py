@@ -21,6 +21,8 @@ CHANNELS = 1
 CHUNK_SIZE = 1024
 FORMAT = pyaudio.paInt16
 MAX_RECORD_SECONDS = 30  # 最长录音 30 秒
+# 影响转录配置的设置项（speech_* 为空且对话接口是 OpenAI 时复用对话 key）
+SPEECH_SETTINGS = ("speech_api_key", "speech_base_url", "speech_model", "api_key", "base_url")
 
 
 @dataclass
@@ -40,6 +42,16 @@ class SpeechService:
         self._is_recording = False
         self._lock = threading.Lock()
 
+        self._unsubscribe = None
+        self._load_config()
+        try:
+            from WebEngine.settings import get_settings
+            # 只在语音相关配置（或可复用的对话 key）变化时重新读取，不重建 PyAudio
+            self._unsubscribe = get_settings().subscribe(lambda _changed: self._load_config(), SPEECH_SETTINGS)
+        except Exception:
+            pass
+
+    def _load_config(self) -> None:
         # 优先从 Settings 管理器读取 API key，fallback 到环境变量
         try:
             from WebEngine.settings import get_settings
@@ -242,6 +254,9 @@ class SpeechService:
 
     def close(self):
         """释放 PyAudio 资源。"""
+        if self._unsubscribe is not None:
+            self._unsubscribe()
+            self._unsubscribe = None
         if self._stream:
             self._stream.stop_stream()
             self._stream.close()
@@ -0,0 +1,172 @@
+"""静态资源缓存：内存缓存 + 预压缩（gzip，若安装 brotli 则同时生成 br）+ ETag / Last-Modified。
+
+资源首次请求时加载（start_server 也会在后台预热 html 目录），之后每次请求只做一次 stat，
+mtime 或大小变化即重新加载。响应按 Accept-Encoding 选择编码，If-None-Match /
+If-Modified-Since 命中时返回 304。
+"""
+from __future__ import annotations
+
+import gzip
+import hashlib
+import threading
+from dataclasses import dataclass
+from email.utils import formatdate, parsedate_to_datetime
+from pathlib import Path
+
+from WebEngine.aio_http import Response
+
+try:
+    import brotli  # 可选依赖
+except ImportError:
+    brotli = None
+
+CONTENT_TYPES = {
+    ".html": "text/html; charset=utf-8",
+    ".css": "text/css; charset=utf-8",
+    ".js": "application/javascript; charset=utf-8",
+    ".json": "application/json; charset=utf-8",
+    ".png": "image/png",
+    ".jpg": "image/jpeg",
+    ".jpeg": "image/jpeg",
+    ".svg": "image/svg+xml",
+}
+
+# 小于该大小或本身已压缩的类型不做预压缩
+MIN_COMPRESS_BYTES = 1024
+_COMPRESSIBLE = ("text/", "application/javascript", "application/json", "image/svg+xml")
+
+# 页面每次都向服务器验证（ETag 命中即 304）；/static/ 下的第三方库可直接使用本地缓存
+HTML_CACHE_CONTROL = "no-cache"
+STATIC_CACHE_CONTROL = "public, max-age=86400"
+
+
+@dataclass
+class _Asset:
+    path: Path
+    content_type: str
+    mtime_ns: int
+    size: int
+    etag: str
+    last_modified: str
+    raw: bytes
+    encoded: dict[str, bytes]   # "br" / "gzip" → 预压缩内容
+
+
+def _accepted_encodings(header: str) -> list[str]:
+    """Parse Accept-Encoding into the encodings with q > 0, best first."""
+    ranked = []
+    for i, item in enumerate(header.split(",")):
+        name, _, params = item.strip().partition(";")
+        name = name.strip().lower()
+        if not name:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        if q > 0:
+            ranked.append((-q, i, name))
+    return [name for _, _, name in sorted(ranked)]
+
+
+class StaticCache:
+    def __init__(self, root: Path):
+        self.root = Path(root).resolve()
+        self._assets: dict[Path, _Asset] = {}
+        self._lock = threading.Lock()
+
+    def resolve(self, relative: str) -> Path | None:
+        """Map a request path to a file under root; None if it escapes root."""
+        fp = (self.root / relative.lstrip("/")).resolve()
+        if self.root not in fp.parents:
+            return None
+        return fp
+
+    def get(self, fp: Path, content_type: str | None = None) -> _Asset | None:
+        try:
+            st = fp.stat()
+        except OSError:
+            return None
+        asset = self._assets.get(fp)
+        if asset is not None and asset.mtime_ns == st.st_mtime_ns and asset.size == st.st_size:
+            return asset
+        # 压缩较慢，不持锁；并发加载同一文件时后写入者覆盖，结果一致
+        asset = self._load(fp, st, content_type)
+        with self._lock:
+            self._assets[fp] = asset
+        return asset
+
+    def _load(self, fp: Path, st, content_type: str | None) -> _Asset:
+        raw = fp.read_bytes()
+        ctype = content_type or CONTENT_TYPES.get(fp.suffix.lower(), "application/octet-stream")
+        encoded: dict[str, bytes] = {}
+        if len(raw) >= MIN_COMPRESS_BYTES and ctype.startswith(_COMPRESSIBLE):
+            if brotli is not None:
+                encoded["br"] = brotli.compress(raw, quality=11)
+            encoded["gzip"] = gzip.compress(raw, compresslevel=9, mtime=0)
+            # 压缩后反而更大则不用
+            encoded = {k: v for k, v in encoded.items() if len(v) < len(raw)}
+        return _Asset(
+            path=fp,
+            content_type=ctype,
+            mtime_ns=st.st_mtime_ns,
+            size=st.st_size,
+            etag='"' + hashlib.sha1(raw).hexdigest()[:20] + '"',
+            last_modified=formatdate(st.st_mtime, usegmt=True),
+            raw=raw,
+            encoded=encoded,
+        )
+
+    def warm(self) -> None:
+        """Load and precompress every file under root."""
+        for fp in self.root.rglob("*"):
+            if fp.is_file() and fp.suffix.lower() in CONTENT_TYPES:
+                self.get(fp.resolve())
+
+    def response(self, fp: Path, headers: dict[str, str], content_type: str | None = None,
+                 cache_control: str | None = None) -> Response:
+        asset = self.get(fp, content_type)
+        if asset is None:
+            return Response.error(404)
+        if cache_control is None:
+            cache_control = HTML_CACHE_CONTROL if asset.content_type.startswith("text/html") else STATIC_CACHE_CONTROL
+        encoding = next((e for e in _accepted_encodings(headers.get("accept-encoding", ""))
+                         if e in asset.encoded), None)
+        # 每种编码是不同的表示，使用不同的强 ETag
+        etag = asset.etag if encoding is None else f'{asset.etag[:-1]}-{encoding}"'
+        out = [
+            ("ETag", etag),
+            ("Last-Modified", asset.last_modified),
+            ("Cache-Control", cache_control),
+            ("Vary", "Accept-Encoding"),
+        ]
+        if self._not_modified(asset, headers):
+            return Response(304, out)
+
+        out.append(("Content-Type", asset.content_type))
+        if encoding is None:
+            return Response(200, out, asset.raw)
+        out.append(("Content-Encoding", encoding))
+        return Response(200, out, asset.encoded[encoding])
+
+    @staticmethod
+    def _not_modified(asset: _Asset, headers: dict[str, str]) -> bool:
+        inm = headers.get("if-none-match")
+        if inm is not None:
+            base = asset.etag[1:-1]
+            for tag in inm.split(","):
+                tag = tag.strip().removeprefix("W/").strip('"')
+                # 任一编码表示的 ETag 都对应同一份内容
+                if tag == "*" or tag == base or tag.split("-", 1)[0] == base:
+                    return True
+            return False
+        ims = headers.get("if-modified-since")
+        if ims:
+            try:
+                return int(parsedate_to_datetime(ims).timestamp()) >= int(asset.mtime_ns // 1_000_000_000)
+            except (TypeError, ValueError):
+                return False
+        return False
@@ -0,0 +1,239 @@
+"""Shader 缩略图服务：进程池离屏渲染（shadertoy.thumbnails），按内容哈希缓存，只在源码变化时重新生成。
+
+缩略图为 THUMB_TIMES 个 iTime 下的帧纵向拼接的 PNG（前端用 background-position 播放动画），
+存放在 .cache/thumbnails/<hash>.png；渲染失败写入 <hash>.err，避免反复重试同一份坏代码。
+每个工作进程只初始化一次隐藏 GL 上下文；同一哈希的并发请求合并为一个任务。
+工作进程渲染期间留下 <hash>.rendering 标记：进程池崩溃（驱动崩溃）或渲染超过 RENDER_TIMEOUT 秒（卡死）时，
+按标记找到出问题的 shader 写入 .err 并重建进程池；没有标记时崩溃说明工作进程初始化失败，暂停一段时间再试。
+"""
+from __future__ import annotations
+
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+
+from WebEngine.aio_http import Response
+from WebEngine.paths import CACHE_DIR, PROJECT_ROOT
+from WebEngine.shader_index import get_shader_index
+
+THUMBNAIL_DIR = CACHE_DIR / "thumbnails"
+# 缩略图 URL 带内容哈希，可长期缓存
+THUMBNAIL_CACHE_CONTROL = "public, max-age=31536000, immutable"
+# 工作进程无法初始化（如没有可用的 GL 驱动）后暂停渲染的时间（秒）
+BROKEN_POOL_BACKOFF = 60.0
+# 单个缩略图的最长渲染时间（秒），超过视为卡死
+RENDER_TIMEOUT = float(os.environ.get("MS_THUMBNAIL_TIMEOUT", "30"))
+# 多个任务同时在渲染时进程池崩溃，无法确定是哪一个：各记一次，累计到该次数才判定为坏 shader
+CRASH_STRIKES = 2
+
+
+def _render(shader_path: str, out_path: str) -> dict:
+    from shadertoy.thumbnails import render_thumbnail
+    marker = Path(out_path).with_suffix(".rendering")
+    marker.write_text(str(os.getpid()), encoding="utf-8")
+    try:
+        return render_thumbnail(shader_path, out_path)
+    finally:
+        marker.unlink(missing_ok=True)
+
+
+def _init_worker() -> None:
+    from shadertoy.thumbnails import init_worker
+    init_worker()
+
+
+class ThumbnailService:
+    def __init__(self, workers: int | None = None, cache_dir: Path = THUMBNAIL_DIR):
+        self.workers = workers or max(1, min(4, (os.cpu_count() or 2) // 2))
+        self.cache_dir = Path(cache_dir)
+        self._pool: ProcessPoolExecutor | None = None
+        self._pending: dict[str, Future] = {}
+        self._strikes: dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._paused_until = 0.0
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            # 上一个进程池留下的标记已无意义
+            for marker in self._markers():
+                marker.unlink(missing_ok=True)
+            # spawn：工作进程不继承服务端的线程与 socket，GL 上下文在各自主线程创建
+            self._pool = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker,
+                                             mp_context=multiprocessing.get_context("spawn"))
+        return self._pool
+
+    def path_for(self, content_hash: str) -> Path:
+        return self.cache_dir / f"{content_hash}.png"
+
+    def _markers(self) -> list[Path]:
+        """<hash>.rendering files of renders in progress."""
+        try:
+            return list(self.cache_dir.glob("*.rendering"))
+        except OSError:
+            return []
+
+    def status(self, content_hash: str) -> str:
+        """ready / failed / pending / missing / unavailable"""
+        self._check_deadlines()
+        if self.path_for(content_hash).is_file():
+            return "ready"
+        if (self.cache_dir / f"{content_hash}.err").is_file():
+            return "failed"
+        with self._lock:
+            if content_hash in self._pending:
+                return "pending"
+        return "unavailable" if time.time() < self._paused_until else "missing"
+
+    def request(self, rel_path: str, content_hash: str) -> str:
+        """Schedule rendering if needed and return the current status."""
+        state = self.status(content_hash)
+        if state != "missing":
+            return state
+        with self._lock:
+            if content_hash in self._pending:
+                return "pending"
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            try:
+                pool = self._get_pool()
+                future = pool.submit(_render, str(PROJECT_ROOT / rel_path), str(self.path_for(content_hash)))
+            except (BrokenProcessPool, RuntimeError) as e:
+                self._pause_locked(e)
+                return "unavailable"
+            self._pending[content_hash] = future
+        future.add_done_callback(lambda f: self._done(rel_path, content_hash, f, pool))
+        return "pending"
+
+    def _done(self, rel_path: str, content_hash: str, future: Future, pool: ProcessPoolExecutor) -> None:
+        with self._lock:
+            if self._pending.get(content_hash) is future:
+                del self._pending[content_hash]
+        try:
+            result = future.result()
+        except BrokenProcessPool as e:
+            with self._lock:
+                self._pool_broken_locked(pool, e)
+            return
+        except Exception as e:
+            print(f"[thumbnails] {rel_path}: {e}")
+            return
+        if result.get("ok"):
+            get_shader_index().set_thumbnail(rel_path, str(self.path_for(content_hash).relative_to(PROJECT_ROOT)))
+        else:
+            (self.cache_dir / f"{content_hash}.err").write_text(result.get("error", ""), encoding="utf-8")
+
+    def _fail_locked(self, content_hash: str, error: str) -> None:
+        print(f"[thumbnails] {content_hash}: {error}")
+        (self.cache_dir / f"{content_hash}.err").write_text(error, encoding="utf-8")
+        self._strikes.pop(content_hash, None)
+
+    def _pool_broken_locked(self, pool: ProcessPoolExecutor, error: Exception) -> None:
+        """A worker died: blame the shader(s) that were rendering, or pause if none was."""
+        if pool is not self._pool:
+            # 同一次崩溃的其余回调，或已因超时主动终止的进程池
+            return
+        culprits = [m.stem for m in self._markers()]
+        if not culprits:
+            # 没有任务在渲染就崩溃：工作进程初始化失败（如没有可用的 GL 驱动）
+            self._pause_locked(error)
+            return
+        for content_hash in culprits:
+            strikes = self._strikes.get(content_hash, 0) + (CRASH_STRIKES if len(culprits) == 1 else 1)
+            self._strikes[content_hash] = strikes
+            if strikes >= CRASH_STRIKES:
+                self._fail_locked(content_hash, f"renderer crashed: {error}")
+        self._reset_pool_locked()
+
+    def _check_deadlines(self) -> None:
+        """Fail renders running longer than RENDER_TIMEOUT and rebuild the pool they hang."""
+        now = time.time()
+        with self._lock:
+            if self._pool is None or not self._pending:
+                return
+            hung = []
+            for marker in self._markers():
+                try:
+                    if now - marker.stat().st_mtime > RENDER_TIMEOUT:
+                        hung.append(marker.stem)
+                except OSError:
+                    continue
+            if not hung:
+                return
+            for content_hash in hung:
+                self._fail_locked(content_hash, f"render timed out after {RENDER_TIMEOUT:.0f}s")
+            self._reset_pool_locked()
+
+    def _reset_pool_locked(self) -> None:
+        """Terminate the current pool; its pending renders are dropped and re-requested later."""
+        pool, self._pool = self._pool, None
+        self._pending.clear()
+        for marker in self._markers():
+            marker.unlink(missing_ok=True)
+        if pool is None:
+            return
+        # shutdown() 不会结束卡死的工作进程，需要直接终止
+        for proc in list((getattr(pool, "_processes", None) or {}).values()):
+            proc.terminate()
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    def _pause_locked(self, error: Exception) -> None:
+        if self._pool is not None:
+            print(f"[thumbnails] worker pool unavailable, retrying in {BROKEN_POOL_BACKOFF:.0f}s: {error}")
+            self._reset_pool_locked()
+        self._paused_until = time.time() + BROKEN_POOL_BACKOFF
+
+    def schedule(self, items: list[dict]) -> None:
+        """Queue thumbnails for index items (e.g. one listing page) that do not have one yet."""
+        for item in items:
+            if not item.get("thumbnail") and item.get("hash"):
+                if self.request(item["path"], item["hash"]) == "ready":
+                    # 相同内容的缩略图已存在（如复制/重命名后的文件）
+                    get_shader_index().set_thumbnail(
+                        item["path"], str(self.path_for(item["hash"]).relative_to(PROJECT_ROOT)))
+
+    def response(self, content_hash: str, headers: dict[str, str]) -> Response:
+        """Serve a rendered thumbnail; the content hash doubles as a strong ETag."""
+        etag = f'"{content_hash}"'
+        common = [("ETag", etag), ("Cache-Control", THUMBNAIL_CACHE_CONTROL)]
+        if etag in [t.strip() for t in headers.get("if-none-match", "").split(",")]:
+            return Response(304, common)
+        try:
+            body = self.path_for(content_hash).read_bytes()
+        except OSError:
+            return Response.error(404)
+        return Response(200, [("Content-Type", "image/png")] + common, body)
+
+    def shutdown(self) -> None:
+        with self._lock:
+            pool, self._pool = self._pool, None
+            self._pending.clear()
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+
+_service: ThumbnailService | None = None
+_service_lock = threading.Lock()
+
+
+def thumbnails_enabled() -> bool:
+    return os.environ.get("MS_THUMBNAILS", "1") != "0"
+
+
+def get_thumbnail_service() -> ThumbnailService:
+    global _service
+    with _service_lock:
+        if _service is None:
+            workers = int(os.environ.get("MS_THUMBNAIL_WORKERS", "0")) or None
+            _service = ThumbnailService(workers)
+        return _service
+
+
+def shutdown_thumbnail_service() -> None:
+    global _service
+    with _service_lock:
+        service, _service = _service, None
+    if service is not None:
+        service.shutdown()
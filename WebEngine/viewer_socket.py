@@ -0,0 +1,167 @@
+"""渲染进程实时通道：WebSocket（/api/viewer/ws）⇄ 常驻渲染进程的遥测连接。
+
+下行：渲染进程打包的定长二进制遥测帧（帧耗时、频段能量、手势位置等，布局见 shadertoy/telemetry.py）原样转发；
+客户端发送缓冲积压时丢弃旧帧，只发最新一帧。连接状态以 JSON 文本消息下发：
+    {"type": "status", "connected": bool, "error"?: str, "hz": float}
+上行：JSON 文本消息
+    {"uniform": "iSatControl", "value": 0.4, "seq": 12}   value 为 null 时取消覆盖
+    {"hz": 30}                                           调整推送频率
+uniform 覆盖不等待回复，渲染线程在下一帧开始前应用；遥测帧的 ack 字段回传最后应用的 seq。
+value 按 uniform 的形状校验后才转发（shadertoy.uniforms.coerce_uniform）；跨站页面发起的握手被拒绝。
+渲染进程未启动或退出时每隔 RECONNECT_INTERVAL 秒重连。
+"""
+from __future__ import annotations
+
+import asyncio
+import json
+import threading
+
+from WebEngine.aio_http import Request, Response, WebSocket
+from shadertoy.daemon_client import telemetry_connection
+from shadertoy.telemetry import DEFAULT_HZ, MAX_HZ
+from shadertoy.uniforms import coerce_uniform
+
+RECONNECT_INTERVAL = 2.0
+# 客户端未发送数据超过该字节数时丢弃遥测帧
+MAX_PENDING_BYTES = 64 * 1024
+
+
+class TelemetryBridge:
+    """One daemon telemetry connection, read on a thread and delivered to the event loop."""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, hz: float = DEFAULT_HZ):
+        self.hz = hz
+        self._loop = loop
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._stop = threading.Event()
+        self._conn = None
+        self._conn_lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name="viewer-telemetry", daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._put(None)
+
+    def _put(self, item) -> None:
+        try:
+            self._loop.call_soon_threadsafe(self._queue.put_nowait, item)
+        except RuntimeError:
+            # 事件循环已关闭
+            self._stop.set()
+
+    async def next(self):
+        """Next telemetry frame (bytes) or status message (dict); None once stopped."""
+        return await self._queue.get()
+
+    def send(self, msg: dict) -> bool:
+        """Forward a control message; False when the daemon is not connected."""
+        with self._conn_lock:
+            if self._conn is None:
+                return False
+            try:
+                # 本机 socket 上几十字节的写入，不会阻塞事件循环
+                self._conn.send(msg)
+                return True
+            except (OSError, EOFError):
+                return False
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                conn = telemetry_connection(self.hz)
+            except ConnectionError as e:
+                self._put({"type": "status", "connected": False, "error": str(e), "hz": self.hz})
+                self._stop.wait(RECONNECT_INTERVAL)
+                continue
+            with self._conn_lock:
+                self._conn = conn
+            self._put({"type": "status", "connected": True, "hz": self.hz})
+            try:
+                while not self._stop.is_set():
+                    if conn.poll(0.5):
+                        self._put(conn.recv_bytes())
+            except (OSError, EOFError) as e:
+                self._put({"type": "status", "connected": False, "error": f"viewer daemon closed: {e}",
+                           "hz": self.hz})
+            finally:
+                with self._conn_lock:
+                    self._conn = None
+                conn.close()
+
+
+def _control_message(text: str, bridge: TelemetryBridge) -> dict | None:
+    try:
+        msg = json.loads(text)
+    except json.JSONDecodeError:
+        return None
+    if not isinstance(msg, dict):
+        return None
+    if "hz" in msg:
+        try:
+            bridge.hz = min(MAX_HZ, max(1.0, float(msg["hz"])))
+        except (TypeError, ValueError):
+            return None
+        return {"cmd": "rate", "hz": bridge.hz}
+    name, value = msg.get("uniform"), msg.get("value")
+    if not isinstance(name, str) or not name.isidentifier():
+        return None
+    if value is not None:
+        # 按 uniform 的形状校验（内置字段的分量数、iFrame 为整数、拒绝 bool 与 NaN / Inf）
+        try:
+            value = coerce_uniform(name, value)
+        except ValueError:
+            return None
+    out = {"cmd": "set_uniform", "name": name, "value": value}
+    if isinstance(msg.get("seq"), int):
+        out["seq"] = msg["seq"]
+    return out
+
+
+async def _pump_controls(ws: WebSocket, bridge: TelemetryBridge) -> None:
+    while True:
+        text = await ws.receive()
+        if text is None:
+            bridge.stop()
+            return
+        if not isinstance(text, str):
+            continue
+        msg = _control_message(text, bridge)
+        if msg is None:
+            await ws.send(json.dumps({"type": "error", "error": "bad message"}))
+        elif not bridge.send(msg):
+            await ws.send(json.dumps({"type": "error", "error": "viewer daemon not connected"}))
+
+
+async def _viewer_session(ws: WebSocket) -> None:
+    try:
+        hz = min(MAX_HZ, max(1.0, float(ws.request.query.get("hz", DEFAULT_HZ))))
+    except ValueError:
+        hz = DEFAULT_HZ
+    bridge = TelemetryBridge(asyncio.get_running_loop(), hz)
+    bridge.start()
+    controls = asyncio.ensure_future(_pump_controls(ws, bridge))
+    try:
+        while True:
+            item = await bridge.next()
+            if item is None or ws.closed:
+                return
+            if isinstance(item, bytes):
+                if ws.buffered > MAX_PENDING_BYTES:
+                    continue
+                await ws.send(item)
+            else:
+                await ws.send(json.dumps(item))
+    finally:
+        bridge.stop()
+        controls.cancel()
+
+
+async def handle_viewer_socket(request: Request) -> Response | WebSocket:
+    """GET /api/viewer/ws?hz=20 → WebSocket（只接受本服务 / 本机页面发起的连接）"""
+    error = WebSocket.handshake_error(request)
+    if error is not None:
+        return Response.error(403 if not WebSocket.origin_allowed(request) else 426, error)
+    return WebSocket(request, _viewer_session)
@@ -1,8 +1,13 @@
 """LangGraph Shader Agent：使用工具调用实现 GLSL 生成+自检循环。"""
 from __future__ import annotations
 
+import hashlib
+import json
+import queue
+import threading
+from collections import OrderedDict
 from pathlib import Path
-from typing import Annotated, Any, TypedDict
+from typing import Annotated, Any, Callable, Iterator, TypedDict
 
 from langchain_core.messages import AIMessage, AnyMessage, HumanMessage, SystemMessage
 from langchain_core.runnables import RunnableLambda
@@ -10,6 +15,14 @@ from langgraph.graph import END, StateGraph
 from langgraph.graph.message import add_messages
 from langgraph.prebuilt import ToolNode
 
+from ai_pipeline.types import AgentEvent
+
+# tool_result 事件中结果文本的最大长度
+TOOL_RESULT_PREVIEW = 400
+# 编译后 Agent 图的缓存上限（LLM 配置 × 工具集 × 提示词组合）
+MAX_CACHED_AGENTS = 16
+SYSTEM_PROMPT_PATH = Path(__file__).resolve().parent / "system_prompt.md"
+
 
 class AgentState(TypedDict):
     messages: Annotated[list[AnyMessage], add_messages]
@@ -72,10 +85,7 @@ def build_shader_agent(
         llm_with_tools = llm
 
     if not system_prompt:
-        root = Path(__file__).resolve().parent
-        prompt_path = root / "system_prompt.md"
-        if prompt_path.exists():
-            system_prompt = prompt_path.read_text(encoding="utf-8-sig")
+        system_prompt = default_system_prompt()
 
     tool_node = ToolNode(tools)
     agent_node = _build_agent_node(llm_with_tools, system_prompt)
@@ -98,3 +108,160 @@ def build_shader_agent(
     workflow.add_edge("tools", "agent")
 
     return workflow.compile()
+
+
+_prompt_lock = threading.Lock()
+_prompt_cache: tuple[tuple | None, str] = (None, "")
+
+
+def default_system_prompt() -> str:
+    """system_prompt.md 的内容；只 stat 文件，修改（mtime / size 变化）后才重新读取。"""
+    global _prompt_cache
+    try:
+        st = SYSTEM_PROMPT_PATH.stat()
+    except OSError:
+        return ""
+    stamp = (st.st_mtime_ns, st.st_size)
+    with _prompt_lock:
+        if _prompt_cache[0] == stamp:
+            return _prompt_cache[1]
+    text = SYSTEM_PROMPT_PATH.read_text(encoding="utf-8-sig")
+    with _prompt_lock:
+        _prompt_cache = (stamp, text)
+    return text
+
+
+_agents: "OrderedDict[tuple, tuple[Any, Any]]" = OrderedDict()
+_agents_lock = threading.Lock()
+
+
+def get_shader_agent(
+    llm: Any,
+    tools: list,
+    system_prompt: str = "",
+    max_iterations: int = 15,
+):
+    """build_shader_agent() memoised by (llm, tool set, system prompt hash, max_iterations).
+
+    编译后的图不含状态，可在请求与线程间共享。llm 来自 build_llm 的客户端池，同一配置是同一实例，
+    因此按实例区分 LLM 配置；设置变更后池中换成新实例，旧图随 LRU 淘汰。
+    未指定 system_prompt 时使用 system_prompt.md，文件修改后自动换用新图。
+    """
+    system_prompt = system_prompt or default_system_prompt()
+    key = (
+        id(llm),
+        tuple(getattr(t, "name", repr(t)) for t in tools),
+        hashlib.sha256(system_prompt.encode("utf-8")).hexdigest()[:16],
+        max_iterations,
+    )
+    with _agents_lock:
+        cached = _agents.get(key)
+        # 缓存项持有 llm 的引用，id 不会被复用；仍校验一次以防万一
+        if cached is not None and cached[0] is llm:
+            _agents.move_to_end(key)
+            return cached[1]
+    agent = build_shader_agent(llm, tools, system_prompt=system_prompt, max_iterations=max_iterations)
+    with _agents_lock:
+        _agents[key] = (llm, agent)
+        _agents.move_to_end(key)
+        while len(_agents) > MAX_CACHED_AGENTS:
+            _agents.popitem(last=False)
+    return agent
+
+
+def _compile_event(content: str) -> AgentEvent | None:
+    """把 compile_check_glsl* 的 JSON 结果转成 compile_result 事件。"""
+    try:
+        result = json.loads(content)
+    except (TypeError, ValueError):
+        return None
+    if not isinstance(result, dict) or "success" not in result:
+        return None
+    return AgentEvent(
+        "compile_result",
+        data={"success": bool(result.get("success")), "errors": list(result.get("errors") or [])[:10]},
+    )
+
+
+def stream_agent_events(agent: Any, inputs: dict, config: dict | None = None) -> Iterator[AgentEvent]:
+    """以 stream_mode=["messages", "updates", "values"] 运行 Agent，产出类型化事件。
+
+    token 仅来自 agent 节点的文本输出；tool 调用/结果来自节点 updates；
+    最后一个事件为 done，data["state"] 为最终 state。
+    """
+    final: dict = {}
+    tool_names: dict[str, str] = {}
+    for mode, payload in agent.stream(inputs, config=config, stream_mode=["messages", "updates", "values"]):
+        if mode == "messages":
+            chunk, meta = payload
+            if meta.get("langgraph_node") != "agent":
+                continue
+            text = getattr(chunk, "content", "")
+            if isinstance(text, str) and text:
+                yield AgentEvent("token", text=text)
+        elif mode == "updates":
+            for node, update in (payload or {}).items():
+                for msg in (update or {}).get("messages", []):
+                    if node == "agent" and getattr(msg, "tool_calls", None):
+                        for tc in msg.tool_calls:
+                            tool_names[tc.get("id", "")] = tc.get("name", "")
+                            yield AgentEvent("tool_call_started", name=tc.get("name", ""),
+                                             data={"id": tc.get("id", ""), "args": sorted((tc.get("args") or {}).keys())})
+                    elif node == "tools":
+                        name = getattr(msg, "name", "") or tool_names.get(getattr(msg, "tool_call_id", ""), "")
+                        content = str(getattr(msg, "content", "") or "")
+                        yield AgentEvent("tool_result", name=name, text=content[:TOOL_RESULT_PREVIEW])
+                        if name.startswith("compile_check_glsl"):
+                            event = _compile_event(content)
+                            if event is not None:
+                                event.name = name
+                                yield event
+        else:
+            final = payload
+    yield AgentEvent("done", data={"state": final})
+
+
+def run_agent(
+    agent: Any,
+    inputs: dict,
+    config: dict | None = None,
+    on_event: Callable[[AgentEvent], None] | None = None,
+) -> dict:
+    """运行 Agent 并返回最终 state；提供 on_event 时逐个回调类型化事件（done 除外）。"""
+    if on_event is None:
+        return agent.invoke(inputs, config=config)
+
+    final: dict = {}
+    for event in stream_agent_events(agent, inputs, config):
+        if event.kind == "done":
+            final = event.data.get("state", {})
+        else:
+            on_event(event)
+    return final
+
+
+def iter_events(run: Callable[[Callable[[AgentEvent], None]], Any]) -> Iterator[AgentEvent]:
+    """把回调式的 run(on_event) 转成事件迭代器（run 在后台线程执行）。
+
+    run 的返回值以 done 事件的 data["result"] 给出；异常在迭代端重新抛出。
+    """
+    q: "queue.Queue[AgentEvent | BaseException | None]" = queue.Queue()
+    outcome: dict[str, Any] = {}
+
+    def _worker():
+        try:
+            outcome["result"] = run(q.put)
+        except BaseException as e:  # noqa: BLE001 - 转交给消费端
+            q.put(e)
+        finally:
+            q.put(None)
+
+    threading.Thread(target=_worker, daemon=True).start()
+    while True:
+        item = q.get()
+        if item is None:
+            break
+        if isinstance(item, BaseException):
+            raise item
+        yield item
+    yield AgentEvent("done", data={"result": outcome.get("result")})
@@ -0,0 +1,335 @@
+"""对话上下文预算：按模型分词器计 token，把会话历史压缩进固定预算后注入 Agent / LLM。
+
+- 代码（``` 围栏代码块或整条 shader 消息）替换为简短描述：语言、行数、定义的函数与 uniform；
+- 全部装不下时，预算先给摘要留出 MS_SUMMARY_TOKENS，其余从最新一条消息往前装入；
+  更早的消息由滚动摘要代替，摘要尚未覆盖到的（后台更新还没完成）逐条截断成一行补在摘要后面；
+- 每轮保存后在后台线程异步更新滚动摘要（provider 为 openai 时由 LLM 压缩，否则取每条消息的开头），
+  摘要随会话元数据缓存（summary / summary_upto），下一轮直接使用，不阻塞当前请求。
+分词器：tiktoken（langchain-openai 的依赖）按模型选择编码；不可用时按 CJK 1 字 ≈ 1 token、其余 4 字符 ≈ 1 token 估算。
+MS_CONTEXT_TOKENS 设定历史预算（默认 2000），MS_SUMMARY_TOKENS 设定摘要上限（默认 400）。
+"""
+from __future__ import annotations
+
+import logging
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+CONTEXT_TOKENS = int(os.environ.get("MS_CONTEXT_TOKENS", "2000"))
+SUMMARY_TOKENS = int(os.environ.get("MS_SUMMARY_TOKENS", "400"))
+# 每条消息的固定开销（role 与分隔符）
+MESSAGE_OVERHEAD = 4
+# 短于该长度的代码块原样保留
+CODE_INLINE_CHARS = 300
+
+_CJK_RE = re.compile(r"[\u3000-\u9fff\uac00-\ud7af\uff00-\uffef]")
+_FENCE_RE = re.compile(r"```([\w+-]*)[^\n]*\n(.*?)```", re.S)
+_FUNC_RE = re.compile(r"^\s*(?:void|float|int|bool|vec[234]|mat[234]|ivec[234])\s+(\w+)\s*\(", re.M)
+_UNIFORM_RE = re.compile(r"^\s*uniform\s+\w+\s+(\w+)", re.M)
+
+log = logging.getLogger(__name__)
+
+
+def _model_name() -> str:
+    try:
+        from WebEngine.settings import get_settings
+        return get_settings().model
+    except Exception:
+        return os.getenv("OPENAI_MODEL", "gpt-4.1-mini")
+
+
+@lru_cache(maxsize=8)
+def _encoder(model: str):
+    try:
+        import tiktoken
+    except ImportError:
+        return None
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        # 非 OpenAI 模型名（如 deepseek-chat）：用最新的通用编码近似
+        try:
+            return tiktoken.get_encoding("o200k_base")
+        except Exception:
+            return None
+    except Exception:
+        # 编码表需要联网下载且失败
+        return None
+
+
+def count_tokens(text: str, model: str = "") -> int:
+    enc = _encoder(model or _model_name())
+    if enc is not None:
+        return len(enc.encode(text, disallowed_special=()))
+    cjk = len(_CJK_RE.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def is_shader_text(text: str) -> bool:
+    return "#version" in text or "void main" in text
+
+
+def describe_code(code: str, lang: str = "glsl") -> str:
+    """[glsl 代码 42 行；函数 palette, mainImage；uniform iTime, iChannel0]"""
+    parts = [f"{lang or '代码'} 代码 {code.strip().count(chr(10)) + 1} 行"]
+    funcs = list(dict.fromkeys(_FUNC_RE.findall(code)))
+    uniforms = list(dict.fromkeys(_UNIFORM_RE.findall(code)))
+    if funcs:
+        parts.append("函数 " + ", ".join(funcs[:8]))
+    if uniforms:
+        parts.append("uniform " + ", ".join(uniforms[:8]))
+    return "[" + "；".join(parts) + "]"
+
+
+def compact_message(content: str) -> str:
+    """把消息中的大段代码替换为描述，正文保留。"""
+    if "```" in content:
+        def _sub(m: re.Match) -> str:
+            code = m.group(2)
+            return m.group(0) if len(code) <= CODE_INLINE_CHARS else describe_code(code, m.group(1) or "glsl")
+        return _FENCE_RE.sub(_sub, content)
+    if len(content) > CODE_INLINE_CHARS and is_shader_text(content):
+        return describe_code(content)
+    return content
+
+
+def _clip(text: str, tokens: int, model: str) -> str:
+    """截断到约 tokens 个 token（保留开头）。"""
+    if count_tokens(text, model) <= tokens:
+        return text
+    lo, hi = 0, len(text)
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if count_tokens(text[:mid], model) <= tokens:
+            lo = mid
+        else:
+            hi = mid - 1
+    return text[:lo] + "…"
+
+
+@lru_cache(maxsize=4096)
+def _compacted(content: str, model: str) -> tuple[str, int]:
+    """(压缩后的内容, token 数)；历史消息每轮都会重新装箱，按内容缓存。"""
+    content = compact_message(content)
+    return content, count_tokens(content, model) + MESSAGE_OVERHEAD
+
+
+def fit_history(history: list[dict], budget: int, model: str = "") -> tuple[list[dict], int, int]:
+    """Newest-first packing of compacted messages into budget tokens.
+
+    返回 (装入的消息（按时间正序）, 第一条装入消息在 history 中的下标, 使用的 token 数)。
+    最新一条消息单独超出预算时截断后装入。
+    """
+    model = model or _model_name()
+    kept: list[dict] = []
+    used = 0
+    start = len(history)
+    for i in range(len(history) - 1, -1, -1):
+        m = history[i]
+        role = m.get("role", "")
+        if role not in ("user", "assistant"):
+            continue
+        content, cost = _compacted(m.get("content") or "", model)
+        if used + cost > budget:
+            if not kept and budget > MESSAGE_OVERHEAD:
+                content = _clip(content, budget - MESSAGE_OVERHEAD, model)
+                kept.append({"role": role, "content": content})
+                used = budget
+                start = i
+            break
+        kept.append({"role": role, "content": content})
+        used += cost
+        start = i
+    kept.reverse()
+    return kept, start, used
+
+
+class ContextManager:
+    """Budgeted history for prompts plus a per-session rolling summary maintained in the background."""
+
+    def __init__(self, budget: int = CONTEXT_TOKENS, summary_tokens: int = SUMMARY_TOKENS):
+        self.budget = budget
+        self.summary_tokens = summary_tokens
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="context-summary")
+        self._pending: set[str] = set()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _summary(session_id: str) -> tuple[str, int]:
+        if not session_id:
+            return "", 0
+        from ai_pipeline.session_cache import get_session_cache
+        meta = get_session_cache().get(session_id) or {}
+        return meta.get("summary", ""), int(meta.get("summary_upto", 0))
+
+    def _window(self, history: list[dict], budget: int, model: str) -> tuple[list[dict], int, int]:
+        """fit_history() with the summary reservation; shared by history() and schedule_summary().
+
+        全部装得下时原样装入；否则给摘要留出 summary_tokens，两处用同一划分，
+        后台摘要正好覆盖到保留窗口之前。
+        """
+        kept, start, used = fit_history(history, budget, model)
+        if start > 0:
+            kept, start, used = fit_history(history, max(0, budget - self.summary_tokens - MESSAGE_OVERHEAD), model)
+        return kept, start, used
+
+    @staticmethod
+    def _brief(messages: list[dict], budget: int, model: str) -> str:
+        """Messages as one clipped line each, newest first until budget tokens are used."""
+        lines: list[str] = []
+        used = 0
+        for m in reversed(messages):
+            if m.get("role") not in ("user", "assistant"):
+                continue
+            text = " ".join(compact_message(m.get("content") or "").split())
+            line = f"{'用户' if m['role'] == 'user' else '助手'}: {_clip(text, 60, model)}"
+            cost = count_tokens(line, model) + 1
+            if used + cost > budget:
+                lines.append(f"…（更早的 {len(messages) - len(lines)} 条从略）")
+                break
+            lines.append(line)
+            used += cost
+        lines.reverse()
+        return "\n".join(lines)
+
+    def history(self, session_id: str, history: list[dict], budget: int | None = None) -> list[dict]:
+        """Messages to inject: an optional {"role": "system"} summary followed by the newest turns that fit."""
+        budget = self.budget if budget is None else budget
+        model = _model_name()
+        summary, upto = self._summary(session_id)
+        kept, start, used = self._window(history, budget, model)
+        out = kept
+        if start > 0:
+            parts = []
+            if summary and upto > 0:
+                parts.append(f"此前对话摘要（前 {upto} 条消息）：\n{summary}")
+            else:
+                upto = 0
+            if upto < start:
+                # 摘要还没覆盖到保留窗口（后台更新未完成）：中间的消息逐条截断补上，不静默丢弃
+                avail = budget - used - MESSAGE_OVERHEAD - sum(count_tokens(p, model) for p in parts)
+                brief = self._brief(history[upto:start], max(0, avail), model)
+                if brief:
+                    parts.append(f"第 {upto + 1}-{start} 条消息（节选）：\n{brief}")
+            if parts:
+                content = "\n\n".join(parts)
+                out = [{"role": "system", "content": content}] + kept
+                used += count_tokens(content, model) + MESSAGE_OVERHEAD
+        if log.isEnabledFor(logging.INFO):
+            raw = sum(count_tokens(m.get("content") or "", model) + MESSAGE_OVERHEAD for m in history)
+            log.info("[context] %s: %d/%d messages, %d tokens (uncompacted %d, budget %d)",
+                     session_id or "-", len(kept), len(history), used, raw, budget)
+        return out
+
+    def history_text(self, session_id: str, history: list[dict], budget: int | None = None) -> str:
+        """history() rendered as "用户: …" / "助手: …" lines for text prompts."""
+        lines = []
+        for m in self.history(session_id, history, budget):
+            role = {"system": "摘要", "user": "用户"}.get(m["role"], "助手")
+            lines.append(f"{role}: {m['content']}")
+        return "\n".join(lines)
+
+    def schedule_summary(self, session_id: str, history: list[dict], provider: str = "mock") -> None:
+        """After a turn: fold the messages that no longer fit the budget into the session summary (async)."""
+        if not session_id or session_id.startswith("_"):
+            return
+        # 与 history() 相同的划分：摘要覆盖到保留窗口之前
+        _kept, start, _used = self._window(history, self.budget, _model_name())
+        _summary, upto = self._summary(session_id)
+        if start <= upto:
+            return
+        with self._lock:
+            if session_id in self._pending:
+                return
+            self._pending.add(session_id)
+        self._executor.submit(self._update_summary, session_id, list(history[:start]), provider)
+
+    def _update_summary(self, session_id: str, older: list[dict], provider: str) -> None:
+        try:
+            summary, upto = self._summary(session_id)
+            if len(older) <= upto:
+                return
+            new = [m for m in older[upto:] if m.get("role") in ("user", "assistant")]
+            summary = self._summarize(summary, new, provider)
+            from ai_pipeline.session_cache import get_session_cache
+            get_session_cache().update_meta(session_id, summary=summary, summary_upto=len(older))
+        except Exception as e:
+            log.warning("[context] summary for %s failed: %s", session_id, e)
+        finally:
+            with self._lock:
+                self._pending.discard(session_id)
+
+    def _summarize(self, previous: str, messages: list[dict], provider: str) -> str:
+        model = _model_name()
+        lines = [f"{'用户' if m['role'] == 'user' else '助手'}: {compact_message(m.get('content') or '')}"
+                 for m in messages]
+        if provider == "openai":
+            from ai_pipeline.llm.adapter import build_llm
+            from langchain_core.messages import HumanMessage
+
+            prompt = (
+                f"把下面的对话压缩成不超过 {self.summary_tokens} token 的要点摘要，用中文。"
+                "保留用户的需求与偏好、已确定的视觉方案和参数、音频分析结论、未解决的问题；代码只保留描述。\n\n"
+                + (f"已有摘要：\n{previous}\n\n" if previous else "")
+                + "新增对话：\n" + "\n".join(_clip(line, 600, model) for line in lines)
+            )
+            reply = build_llm(provider).invoke([HumanMessage(content=prompt)])
+            text = str(getattr(reply, "content", reply)).strip()
+            if text:
+                return _clip(text, self.summary_tokens, model)
+        # 无 LLM：每条消息取开头，超出上限时保留最新的部分
+        lines = ([previous] if previous else []) + [_clip(" ".join(line.split()), 60, model) for line in lines]
+        text = "\n".join(lines)
+        while len(lines) > 1 and count_tokens(text, model) > self.summary_tokens:
+            lines.pop(0)
+            text = "\n".join(lines)
+        return _clip(text, self.summary_tokens, model)
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+_manager: ContextManager | None = None
+_manager_lock = threading.Lock()
+
+
+def get_context_manager() -> ContextManager:
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            _manager = ContextManager()
+        return _manager
+
+
+def shutdown_context_manager() -> None:
+    global _manager
+    with _manager_lock:
+        manager, _manager = _manager, None
+    if manager is not None:
+        manager.shutdown()
+
+
+# ---- 自检：python -m ai_pipeline.context ----
+if __name__ == "__main__":
+    shader = "#version 330\nuniform float iTime;\nuniform sampler2D iChannel0;\n" \
+             "vec3 palette(float t){ return vec3(t); }\n" + "float f(vec2 p){ return length(p); }\n" * 80 + \
+             "void main(){ }\n"
+    history = []
+    for i in range(30):
+        history.append({"role": "user", "content": f"第 {i} 轮：把低频映射到圆环半径，颜色偏冷一些，节奏感更强"})
+        history.append({"role": "assistant", "content": shader if i % 2 else f"分析 {i}：" + "低频能量集中在 60-120Hz。" * 20})
+    model = _model_name()
+    raw = sum(count_tokens(m["content"], model) + MESSAGE_OVERHEAD for m in history[-20:])
+    kept, start, used = fit_history(history, CONTEXT_TOKENS, model)
+    print(f"tokenizer={'tiktoken' if _encoder(model) else 'estimate'}; last 20 raw messages: {raw} tokens; "
+          f"budgeted: {len(kept)} messages from #{start}, {used} tokens")
+    print(describe_code(shader))
+    manager = ContextManager()
+    print(manager._summarize("", history[:start][:6], "mock"))
+    # 没有摘要（或摘要落后）时，窗口之前的消息以节选补上
+    out = manager.history("", history)
+    first = out[0]["content"]
+    print(f"no summary yet: {len(out) - 1} kept messages + {first.count(chr(10))} brief lines")
+    assert out[0]["role"] == "system" and first.startswith("第 1-")
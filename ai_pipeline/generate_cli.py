@@ -7,15 +7,17 @@ import os
 import subprocess
 import sys
 from pathlib import Path
+from typing import Callable, Iterator
 
 from langchain_core.messages import HumanMessage
 
-from ai_pipeline.agent import build_shader_agent
+from ai_pipeline.agent import get_shader_agent, iter_events, run_agent
 from ai_pipeline.hooks.engine import GenerationHookEngine
 from ai_pipeline.llm.adapter import build_llm
+from ai_pipeline.shader_store import get_generated_store
 from ai_pipeline.tools import get_build_tools
 from ai_pipeline.tools.shader_tools import extract_glsl_code
-from ai_pipeline.types import GenerateRequest, GenerateResult
+from ai_pipeline.types import AgentEvent, GenerateRequest, GenerateResult
 
 
 def save_shader(code: str, out_dir: Path, name: str) -> Path:
@@ -51,11 +53,12 @@ def generate(
     audio_array: list[float] | None = None,
     analysis_context: str = "",
     history_context: str = "",
+    on_event: Callable[[AgentEvent], None] | None = None,
 ) -> GenerateResult:
-    # 构建 LLM + tools + agent
+    # LLM（客户端池）+ tools + agent（编译后的图按配置缓存）
     llm = build_llm(provider)
     tools = get_build_tools()
-    agent = build_shader_agent(llm, tools)
+    agent = get_shader_agent(llm, tools)
 
     # 构建用户消息
     audio_summary = ""
@@ -73,10 +76,12 @@ def generate(
         + "音频分析已在上一阶段完成。请根据分析上下文生成 GLSL 着色器。"
     )
 
-    # 运行 Agent
-    result = agent.invoke(
+    # 运行 Agent（on_event 不为空时实时回调 token / tool 事件）
+    result = run_agent(
+        agent,
         {"messages": [HumanMessage(content=user_content)]},
         config={"recursion_limit": 50},
+        on_event=on_event,
     )
 
     # 从 agent 消息中捕获 GLSL 代码
@@ -149,7 +154,9 @@ def generate(
     # 后处理：hooks + 保存 + 质量检查（保持与旧版一致）
     hook_engine = GenerationHookEngine(root)
     code = hook_engine.inject_header(code, req.style_profile)
-    out_path = save_shader(code, root / "shaders" / "generated", "ai_generated_latest")
+    # 每次生成写入内容寻址的工作文件（shaders/generated/ai_<hash>.glsl），并发构建互不覆盖；
+    # 引用名按会话记录，会话最新一次的结果保留，更早的由 gc 回收
+    out_path = get_generated_store().bind(f"session:{session_id}", code)
 
     hook_results = hook_engine.run_hooks(out_path)
     quality = run_quality(root, out_path)
@@ -167,6 +174,9 @@ def generate(
     diagnostics.extend([f"hook:{r.name}:{'ok' if r.ok else 'fail'}" for r in hook_results])
 
     tags = ["goodcase:baseline", f"style:{req.style_profile}", f"session:{session_id}"]
+    if on_event is not None:
+        on_event(AgentEvent("final_code", text=code, data={"diagnostics": diagnostics,
+                                                           "quality_ok": quality.get("returncode") == 0}))
     return GenerateResult(
         glsl_code=code,
         includes=[],
@@ -176,6 +186,12 @@ def generate(
     )
 
 
+def generate_stream(req: GenerateRequest, root: Path, **kwargs) -> Iterator[AgentEvent]:
+    """generate() 的事件迭代器版本：产出 token / tool / compile_result / final_code，
+    最后一个 done 事件的 data["result"] 为 GenerateResult。"""
+    return iter_events(lambda on_event: generate(req, root, on_event=on_event, **kwargs))
+
+
 def _load_audio_array(audio_path: str | None) -> list[float]:
     if not audio_path:
         return []
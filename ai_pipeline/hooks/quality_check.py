@@ -45,7 +45,11 @@ def collect_py_files(root: Path) -> list[Path]:
 def collect_glsl_files(root: Path, target: str | None) -> list[Path]:
     if target:
         return [Path(target).resolve()]
-    default_target = root / "shaders" / "generated" / "ai_generated_latest.glsl"
+    # 默认检查最近一次生成的文件（内容寻址存储中最新的一个），兼容旧的固定文件名
+    from ai_pipeline.shader_store import ShaderStore
+    default_target = ShaderStore(root / "shaders" / "generated", "ai_").latest()
+    if default_target is None:
+        default_target = root / "shaders" / "generated" / "ai_generated_latest.glsl"
     return [default_target] if default_target.is_file() else []
 
 
@@ -10,6 +10,8 @@ from langchain_core.messages import AIMessage, HumanMessage
 from langchain_core.runnables import RunnableLambda
 from langchain_openai import ChatOpenAI
 
+from ai_pipeline.llm.pool import get_llm_pool, key_digest
+
 
 def _mock_chat(messages: list[dict], **kwargs: Any) -> AIMessage:
     """保留旧 MockMcpAdapter 的关键词判断逻辑。"""
@@ -120,6 +122,10 @@ void main(){ mainImage(FragColor, gl_FragCoord.xy); }
     )
 
 
+# mock 无状态，共享一个实例（编译后的 Agent 图按 LLM 实例缓存）
+_MOCK_LLM = RunnableLambda(_mock_chat)
+
+
 def _get_settings():
     """延迟导入避免循环依赖。"""
     try:
@@ -129,25 +135,31 @@ def _get_settings():
         return None
 
 
-def build_llm(provider: str = "openai") -> BaseChatModel | RunnableLambda:
-    """构建 LLM 实例。
+def build_llm(provider: str = "openai", temperature: float = 0.45) -> BaseChatModel | RunnableLambda:
+    """获取 LLM 实例。
 
-    - provider == "openai" → ChatOpenAI（读环境变量 > settings.json > 默认值）
+    - provider == "openai" → ChatOpenAI（读环境变量 > settings.json > 默认值），
+      从客户端池复用：相同配置共享同一实例与 keep-alive 连接
     - 其他 → mock RunnableLambda
     """
     s = _get_settings()
     api_key = (s and s.api_key) or os.getenv("OPENAI_API_KEY", "").strip()
-    base_url = (s and s.base_url) or os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1").rstrip("/")
+    base_url = ((s and s.base_url) or os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1")).rstrip("/")
     model = (s and s.model) or os.getenv("OPENAI_MODEL", "gpt-4.1-mini")
 
     if provider == "openai" and api_key:
-        return ChatOpenAI(
-            model=model,
-            base_url=base_url,
-            api_key=api_key,
-            temperature=0.45,
-            timeout=90,
-            max_retries=2,
+        pool = get_llm_pool()
+        return pool.get(
+            (provider, base_url, model, key_digest(api_key), temperature),
+            lambda: ChatOpenAI(
+                model=model,
+                base_url=base_url,
+                api_key=api_key,
+                temperature=temperature,
+                timeout=90,
+                max_retries=2,
+                http_client=pool.http_client(base_url),
+            ),
         )
 
-    return RunnableLambda(_mock_chat)
+    return _MOCK_LLM
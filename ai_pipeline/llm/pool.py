@@ -0,0 +1,153 @@
+"""LLM 客户端池：按 (provider, base_url, model, key 哈希, temperature) 复用 ChatOpenAI 实例。
+
+每个 base_url 共享一个长连接的 httpx.Client（keep-alive 连接池；安装了 h2 时启用 HTTP/2，
+同一连接上多路复用并发请求），避免每次 analyze / plan / generate 都重新构建客户端、重新做 TLS 握手。
+设置页修改 api_key / base_url / model 时（Settings.subscribe）丢弃缓存的模型实例；
+HTTP 客户端按 base_url 保留，换 key 不需要新连接。
+metrics() 通过 httpcore 的 trace 扩展统计请求数、新建 TCP 连接数与 TLS 握手数，
+reuse_ratio = 复用已有连接的请求占比。
+"""
+from __future__ import annotations
+
+import hashlib
+import importlib.util
+import threading
+from collections import OrderedDict
+from typing import Callable
+
+import httpx
+
+# httpx 的 HTTP/2 支持依赖 h2
+HTTP2 = importlib.util.find_spec("h2") is not None
+
+# 缓存的模型实例上限（不同 model / temperature 组合）
+MAX_CLIENTS = 16
+# 每个 base_url 的连接池
+MAX_CONNECTIONS = 16
+MAX_KEEPALIVE_CONNECTIONS = 8
+KEEPALIVE_EXPIRY = 120.0
+# 与 ChatOpenAI(timeout=90) 一致；连接阶段单独设短一些
+HTTP_TIMEOUT = httpx.Timeout(90.0, connect=10.0)
+# 影响模型实例的设置项
+LLM_SETTINGS = ("api_key", "base_url", "model")
+
+
+def key_digest(api_key: str) -> str:
+    """池键中只保存 key 的哈希。"""
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:12]
+
+
+class LLMClientPool:
+    def __init__(self, capacity: int = MAX_CLIENTS):
+        self.capacity = max(1, capacity)
+        self._lock = threading.Lock()
+        self._llms: "OrderedDict[tuple, object]" = OrderedDict()
+        self._http: dict[str, httpx.Client] = {}
+        self._unsubscribe: Callable[[], None] | None = None
+        self._counts = {"hits": 0, "misses": 0, "invalidations": 0,
+                        "requests": 0, "connections": 0, "tls_handshakes": 0, "http2_requests": 0}
+
+    # ---- 连接统计 ----
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self._counts[name] += 1
+
+    def _trace(self, event_name: str, info: dict) -> None:
+        if event_name == "connection.connect_tcp.complete":
+            self._count("connections")
+        elif event_name == "connection.start_tls.complete":
+            self._count("tls_handshakes")
+        elif event_name == "http2.send_request_headers.started":
+            self._count("http2_requests")
+
+    def _on_request(self, request: httpx.Request) -> None:
+        request.extensions["trace"] = self._trace
+        self._count("requests")
+
+    # ---- 客户端 ----
+    def http_client(self, base_url: str) -> httpx.Client:
+        """The shared keep-alive HTTP client for base_url."""
+        base_url = base_url.rstrip("/")
+        with self._lock:
+            client = self._http.get(base_url)
+            if client is None:
+                client = httpx.Client(
+                    http2=HTTP2,
+                    timeout=HTTP_TIMEOUT,
+                    limits=httpx.Limits(max_connections=MAX_CONNECTIONS,
+                                        max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+                                        keepalive_expiry=KEEPALIVE_EXPIRY),
+                    event_hooks={"request": [self._on_request]},
+                )
+                self._http[base_url] = client
+            return client
+
+    def get(self, key: tuple, factory: Callable[[], object]) -> object:
+        """Cached client for key, built with factory() on first use."""
+        with self._lock:
+            llm = self._llms.get(key)
+            if llm is not None:
+                self._llms.move_to_end(key)
+                self._counts["hits"] += 1
+                return llm
+            self._counts["misses"] += 1
+        llm = factory()
+        with self._lock:
+            # 并发构建时保留先放入的实例
+            llm = self._llms.setdefault(key, llm)
+            self._llms.move_to_end(key)
+            while len(self._llms) > self.capacity:
+                self._llms.popitem(last=False)
+        return llm
+
+    def invalidate(self, changed: dict | None = None) -> None:
+        """Drop cached model clients (settings changed); HTTP connections stay pooled."""
+        with self._lock:
+            self._llms.clear()
+            self._counts["invalidations"] += 1
+
+    def metrics(self) -> dict:
+        with self._lock:
+            counts = dict(self._counts)
+            counts["clients"] = len(self._llms)
+            counts["http_clients"] = len(self._http)
+        requests = counts["requests"]
+        counts["http2"] = HTTP2
+        counts["reuse_ratio"] = round(1 - counts["connections"] / requests, 3) if requests else 0.0
+        return counts
+
+    def close(self) -> None:
+        if self._unsubscribe is not None:
+            self._unsubscribe()
+            self._unsubscribe = None
+        with self._lock:
+            clients = list(self._http.values())
+            self._http.clear()
+            self._llms.clear()
+        for client in clients:
+            client.close()
+
+
+_pool: LLMClientPool | None = None
+_pool_lock = threading.Lock()
+
+
+def get_llm_pool() -> LLMClientPool:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = LLMClientPool()
+            try:
+                from WebEngine.settings import get_settings
+                _pool._unsubscribe = get_settings().subscribe(_pool.invalidate, LLM_SETTINGS)
+            except Exception:
+                pass
+        return _pool
+
+
+def shutdown_llm_pool() -> None:
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.close()
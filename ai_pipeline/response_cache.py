@@ -0,0 +1,289 @@
+"""LLM 回复缓存：同一首曲子、相同 / 相近的分析请求与 Plan 对话直接返回上次的回复。
+
+键由五部分组成：规范化后的 prompt、引用文件的身份（解析后的路径 + mtime + 大小）、
+音频特征指纹（采样数组量化后的哈希）、技能模板哈希、模型；Analyze 与 Plan 的回复都依赖
+注入的对话历史，额外带上它的哈希（会话 A 的回复不会回放到会话 B）。除 prompt 外的部分合成“作用域”，两个不同的文件永远不共用作用域
+（即使音频没能加载、指纹为空）：
+- 精确命中：作用域 + 规范化 prompt 完全相同；
+- 近似命中（默认关闭）：MS_RESPONSE_CACHE_SIMILARITY 设为 0-1 之间的阈值后，同一作用域内
+  prompt 的哈希向量（字符 1-3 gram，离线、无需模型）余弦相似度达到阈值也算命中。
+  字符 n-gram 分不清只差一个词的相反需求（cooler / warmer 约 0.97，偏冷 / 偏暖约 0.94），
+  只适合 prompt 基本固定的场景。
+持久化在 .cache/response_cache.sqlite3；条目超过 MS_RESPONSE_CACHE_TTL 秒（默认 7 天）过期，
+超过 MS_RESPONSE_CACHE_SIZE 条（默认 1000）时淘汰最久未命中的。MS_RESPONSE_CACHE=0 关闭缓存。
+命中后由 stream_cached() 按小段回放为 token 事件，前端仍按 SSE 流式显示。
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import math
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+import zlib
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable
+
+from ai_pipeline.types import AgentEvent
+
+RESPONSE_DB = Path(__file__).resolve().parent.parent / ".cache" / "response_cache.sqlite3"
+ENABLED = os.environ.get("MS_RESPONSE_CACHE", "1") != "0"
+TTL = float(os.environ.get("MS_RESPONSE_CACHE_TTL", str(7 * 86400)))
+MAX_ENTRIES = int(os.environ.get("MS_RESPONSE_CACHE_SIZE", "1000"))
+SIMILARITY = float(os.environ.get("MS_RESPONSE_CACHE_SIMILARITY", "0"))
+# 哈希向量维度
+VECTOR_DIM = 4096
+# 命中回放时每个 token 事件的字符数
+REPLAY_CHUNK = 24
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    scope TEXT NOT NULL,
+    prompt TEXT NOT NULL,
+    vector TEXT NOT NULL,
+    response TEXT NOT NULL,
+    created REAL NOT NULL,
+    accessed REAL NOT NULL,
+    hits INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS responses_scope ON responses(scope);
+CREATE INDEX IF NOT EXISTS responses_accessed ON responses(accessed);
+"""
+
+_PUNCT_EDGE_RE = re.compile(r"^[\s\W_]+|[\s\W_]+$")
+
+
+def normalize_prompt(prompt: str) -> str:
+    """NFKC（全角转半角）、小写、合并空白、去掉首尾标点。"""
+    text = unicodedata.normalize("NFKC", prompt).lower()
+    text = " ".join(text.split())
+    return _PUNCT_EDGE_RE.sub("", text)
+
+
+def text_digest(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()[:16] if text else ""
+
+
+def audio_fingerprint(audio_array: list[float]) -> str:
+    """采样数组量化到 1e-3 后的哈希：同一首曲子（与文件名、路径无关）得到同一指纹。"""
+    if not audio_array:
+        return ""
+    import numpy as np
+    arr = np.round(np.asarray(audio_array, dtype=np.float32), 3)
+    return hashlib.sha1(arr.tobytes()).hexdigest()[:16]
+
+
+def file_identity(paths) -> str:
+    """引用文件的身份：解析后的路径 + mtime_ns + 大小的哈希；文件被替换或修改后随之变化。"""
+    parts = []
+    for path in paths:
+        path = Path(path).resolve()
+        try:
+            st = path.stat()
+        except OSError:
+            parts.append([str(path), 0, -1])
+            continue
+        parts.append([str(path), st.st_mtime_ns, st.st_size])
+    return text_digest(json.dumps(parts, ensure_ascii=False)) if parts else ""
+
+
+def hashing_vector(text: str) -> dict[int, float]:
+    """字符 1-3 gram 的哈希向量（L2 归一化），对中英文都可用。"""
+    chars = text.replace(" ", "")
+    counts: dict[int, float] = {}
+    for n in (1, 2, 3):
+        for i in range(len(chars) - n + 1):
+            idx = zlib.crc32(chars[i:i + n].encode("utf-8")) % VECTOR_DIM
+            counts[idx] = counts.get(idx, 0.0) + 1.0
+    norm = math.sqrt(sum(v * v for v in counts.values())) or 1.0
+    return {i: v / norm for i, v in counts.items()}
+
+
+def cosine(a: dict[int, float], b: dict[int, float]) -> float:
+    if len(a) > len(b):
+        a, b = b, a
+    return sum(v * b.get(i, 0.0) for i, v in a.items())
+
+
+@dataclass(slots=True)
+class CacheKey:
+    scope: str
+    prompt: str
+    key: str
+
+
+class ResponseCache:
+    def __init__(self, db_path: Path = RESPONSE_DB, ttl: float = TTL, capacity: int = MAX_ENTRIES,
+                 similarity: float = SIMILARITY):
+        self.ttl = ttl
+        self.capacity = max(1, capacity)
+        self.similarity = similarity
+        db_path = Path(db_path)
+        db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(str(db_path), check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        self._counts = {"lookups": 0, "exact_hits": 0, "similar_hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+        self._hit_ms = 0.0
+        with self._lock, self._db:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.executescript(_SCHEMA)
+
+    @staticmethod
+    def make_key(kind: str, prompt: str, audio: str = "", skill: str = "", model: str = "",
+                 context: str = "", source: str = "") -> CacheKey:
+        """source: file_identity() of the files the prompt refers to."""
+        scope = hashlib.sha1(json.dumps([kind, source, audio, skill, model, context]).encode("utf-8")).hexdigest()[:24]
+        norm = normalize_prompt(prompt)
+        return CacheKey(scope, norm, hashlib.sha1(f"{scope}\0{norm}".encode("utf-8")).hexdigest()[:32])
+
+    def lookup(self, key: CacheKey) -> str | None:
+        """Cached response for key (exact, then near-duplicate within the same scope), or None."""
+        t = time.perf_counter()
+        now = time.time()
+        with self._lock, self._db:
+            self._counts["lookups"] += 1
+            row = self._db.execute("SELECT key, response FROM responses WHERE key = ? AND created > ?",
+                                   (key.key, now - self.ttl)).fetchone()
+            kind = "exact_hits"
+            if row is None and self.similarity > 0 and key.prompt:
+                row = self._similar_locked(key, now)
+                kind = "similar_hits"
+            if row is None:
+                self._counts["misses"] += 1
+                return None
+            self._db.execute("UPDATE responses SET accessed = ?, hits = hits + 1 WHERE key = ?", (now, row["key"]))
+            self._counts[kind] += 1
+            self._hit_ms += (time.perf_counter() - t) * 1000
+            return row["response"]
+
+    def _similar_locked(self, key: CacheKey, now: float):
+        vector = hashing_vector(key.prompt)
+        best, best_score = None, self.similarity
+        for row in self._db.execute("SELECT key, vector, response FROM responses WHERE scope = ? AND created > ?",
+                                    (key.scope, now - self.ttl)):
+            other = {int(i): w for i, w in json.loads(row["vector"]).items()}
+            score = cosine(vector, other)
+            if score >= best_score:
+                best, best_score = row, score
+        return best
+
+    def store(self, key: CacheKey, response: str) -> None:
+        if not response:
+            return
+        now = time.time()
+        vector = json.dumps({i: round(w, 5) for i, w in hashing_vector(key.prompt).items()})
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses (key, scope, prompt, vector, response, created, accessed, hits) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, 0)",
+                (key.key, key.scope, key.prompt, vector, response, now, now),
+            )
+            self._counts["stores"] += 1
+            self._evict_locked(now)
+
+    def _evict_locked(self, now: float) -> None:
+        removed = self._db.execute("DELETE FROM responses WHERE created <= ?", (now - self.ttl,)).rowcount
+        count = self._db.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        if count > self.capacity:
+            removed += self._db.execute(
+                "DELETE FROM responses WHERE key IN (SELECT key FROM responses ORDER BY accessed LIMIT ?)",
+                (count - self.capacity,),
+            ).rowcount
+        self._counts["evictions"] += max(0, removed)
+
+    def clear(self) -> None:
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM responses")
+
+    def metrics(self) -> dict:
+        with self._lock:
+            counts = dict(self._counts)
+            counts["entries"] = self._db.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        hits = counts["exact_hits"] + counts["similar_hits"]
+        counts["hit_ratio"] = round(hits / counts["lookups"], 3) if counts["lookups"] else 0.0
+        counts["avg_hit_ms"] = round(self._hit_ms / hits, 2) if hits else 0.0
+        return counts
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+
+def stream_cached(text: str, on_event: Callable[[AgentEvent], None] | None) -> None:
+    """把缓存的回复按小段回放为 token 事件。"""
+    if on_event is None:
+        return
+    for i in range(0, len(text), REPLAY_CHUNK):
+        on_event(AgentEvent("token", text=text[i:i + REPLAY_CHUNK]))
+
+
+_cache: ResponseCache | None = None
+_cache_lock = threading.Lock()
+
+
+def get_response_cache() -> ResponseCache | None:
+    """The shared cache, or None when disabled (MS_RESPONSE_CACHE=0) or the database cannot be opened."""
+    global _cache
+    if not ENABLED:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            try:
+                _cache = ResponseCache()
+            except sqlite3.Error as e:
+                print(f"[response_cache] disabled: {e}")
+                return None
+        return _cache
+
+
+def shutdown_response_cache() -> None:
+    global _cache
+    with _cache_lock:
+        cache, _cache = _cache, None
+    if cache is not None:
+        cache.close()
+
+
+# ---- 自检：python -m ai_pipeline.response_cache ----
+if __name__ == "__main__":
+    import tempfile
+
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = ResponseCache(Path(tmp) / "responses.sqlite3", capacity=50)
+        audio = audio_fingerprint([0.1, 0.25, -0.3] * 1000)
+        key = cache.make_key("analyze", "分析一下 Hunter.mp3 的节奏和情绪", audio, text_digest("skill"), "gpt-4.1-mini")
+        assert cache.lookup(key) is None
+        cache.store(key, "BPM 128，情绪明亮……")
+        for prompt in ("分析一下 Hunter.mp3 的节奏和情绪。", "帮我分析一下 Hunter.mp3 的节奏和情绪", "生成一个霓虹圆环"):
+            k = cache.make_key("analyze", prompt, audio, text_digest("skill"), "gpt-4.1-mini")
+            print(f"{prompt!r}: similarity {cosine(hashing_vector(key.prompt), hashing_vector(k.prompt)):.2f} -> "
+                  f"{'hit' if cache.lookup(k) else 'miss'}")
+        other_track = cache.make_key("analyze", "分析一下 Hunter.mp3 的节奏和情绪", "other", text_digest("skill"),
+                                     "gpt-4.1-mini")
+        assert cache.lookup(other_track) is None, "different audio never matches"
+
+        # 默认只做精确匹配：只差一个词的相反需求不能命中
+        plan = cache.make_key("plan", "make the colors cooler")
+        cache.store(plan, "Shift the palette towards blue.")
+        assert cache.lookup(cache.make_key("plan", "make the colors warmer")) is None
+        # 不同文件不共用作用域，即使音频没加载出来（指纹为空）
+        song1, song2 = Path(tmp) / "song1.mp3", Path(tmp) / "song2.mp3"
+        song1.write_bytes(b"a" * 10)
+        song2.write_bytes(b"b" * 10)
+        k1 = cache.make_key("analyze", "analyze song.mp3", source=file_identity([song1]))
+        cache.store(k1, "song1 analysis")
+        assert cache.lookup(cache.make_key("analyze", "analyze song.mp3", source=file_identity([song2]))) is None
+        song1.write_bytes(b"c" * 12)
+        assert cache.lookup(cache.make_key("analyze", "analyze song.mp3", source=file_identity([song1]))) is None, \
+            "a modified file gets a new scope"
+        for i in range(80):
+            cache.store(cache.make_key("plan", f"问题 {i}"), f"回复 {i}")
+        print(cache.metrics())
+        cache.close()
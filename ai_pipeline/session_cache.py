@@ -0,0 +1,311 @@
+"""进程内会话缓存：解析后的消息与元数据常驻内存，保存由后台线程延迟回写（write-behind）。
+
+读取：每次访问只 stat 一次 sessions/index.json（SessionStore.version()），未变化时列表与消息
+直接取内存；其他进程（如 generate_cli.py）提交后版本变化，重新加载索引，并丢弃提交位置
+（size / 消息数 / 末条哈希）已变化的消息缓存。
+写入：save() 只更新内存并把会话标记为脏，后台线程在首次变脏后 flush_delay 秒内把到期的会话
+在一次 SessionStore.batch() 中写回（一次加锁、一次索引写入）；同一会话在窗口内的多次保存
+合并为一次追加。脏会话的读取返回内存中的最新版本。进程退出 / 服务关闭时 flush()。
+MS_SESSION_FLUSH_DELAY=0 时退化为同步写入。
+"""
+from __future__ import annotations
+
+import atexit
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable
+
+from ai_pipeline.session_store import SessionStore, get_session_store, infer_title, message_preview
+
+FLUSH_DELAY = float(os.environ.get("MS_SESSION_FLUSH_DELAY", "1.0"))
+# 缓存消息的会话数上限（脏会话不计入淘汰）
+MAX_CACHED_SESSIONS = 64
+
+
+def _now() -> str:
+    return time.strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _signature(entry: dict | None) -> tuple | None:
+    if entry is None:
+        return None
+    return entry.get("size", 0), entry.get("message_count", 0), entry.get("tail", "")
+
+
+class SessionCache:
+    def __init__(self, store: SessionStore | None = None, flush_delay: float = FLUSH_DELAY,
+                 capacity: int = MAX_CACHED_SESSIONS):
+        self.store = store or get_session_store()
+        self.flush_delay = flush_delay
+        self.capacity = max(1, capacity)
+        self.generation = 0
+        self._cond = threading.Condition(threading.RLock())
+        # 回写串行化：保证同一会话较旧的快照不会晚于较新的快照落盘
+        self._write_lock = threading.Lock()
+        self._version = None
+        self._loaded = False
+        self._meta: dict[str, dict] = {}
+        # session_id → (已提交的签名，脏或未知时为 None；消息列表)
+        self._messages: "OrderedDict[str, tuple[tuple | None, list[dict]]]" = OrderedDict()
+        # session_id → {"deadline", "title", "meta"}
+        self._pending: dict[str, dict] = {}
+        self._views: dict[Callable, tuple[int, object]] = {}
+        self._thread: threading.Thread | None = None
+        self._closed = False
+
+    # ---- 同步 ----
+    def _sync_locked(self) -> None:
+        version = self.store.version()
+        if self._loaded and version is not None and version == self._version:
+            return
+        self._meta = self.store.list_sessions()
+        self._version = self.store.version()
+        self._loaded = True
+        for sid in list(self._messages):
+            if sid not in self._pending and self._messages[sid][0] != _signature(self._meta.get(sid)):
+                del self._messages[sid]
+        for sid, pending in self._pending.items():
+            self._meta[sid] = {**self._meta.get(sid, {}), **pending["meta"]}
+        self.generation += 1
+
+    def _cache_locked(self, session_id: str, signature: tuple | None, messages: list[dict]) -> None:
+        self._messages[session_id] = (signature, messages)
+        self._messages.move_to_end(session_id)
+        for sid in list(self._messages):
+            if len(self._messages) <= self.capacity:
+                break
+            if sid not in self._pending:
+                del self._messages[sid]
+
+    # ---- 读取 ----
+    def list_sessions(self) -> dict[str, dict]:
+        """session_id → 元数据副本（含尚未回写的修改）。"""
+        with self._cond:
+            self._sync_locked()
+            return {sid: dict(entry) for sid, entry in self._meta.items()}
+
+    def view(self, build: Callable[[dict[str, dict]], object]):
+        """build(metadata) memoised until the metadata changes (e.g. the sorted conversation list)."""
+        with self._cond:
+            self._sync_locked()
+            cached = self._views.get(build)
+            if cached is None or cached[0] != self.generation:
+                cached = (self.generation, build(self._meta))
+                self._views[build] = cached
+            return cached[1]
+
+    def get(self, session_id: str) -> dict | None:
+        with self._cond:
+            self._sync_locked()
+            entry = self._meta.get(session_id)
+            return dict(entry) if entry is not None else None
+
+    def load(self, session_id: str) -> list[dict]:
+        """Messages of a session (a new list; the message dicts are shared with the cache)."""
+        with self._cond:
+            self._sync_locked()
+            cached = self._messages.get(session_id)
+            if cached is not None:
+                self._messages.move_to_end(session_id)
+                return list(cached[1])
+            entry = self.store.get(session_id)
+            messages = self.store.load(session_id)
+            if entry is not None and len(messages) == entry.get("message_count", 0):
+                self._cache_locked(session_id, _signature(entry), messages)
+            return list(messages)
+
+    # ---- 写入 ----
+    def save(self, session_id: str, messages: list[dict], title: str = "") -> None:
+        """Cache messages and schedule them for write-behind; title defaults to the inferred one."""
+        messages = [m for m in messages if isinstance(m, dict)]
+        now = _now()
+        with self._cond:
+            self._sync_locked()
+            pending = self._pending.get(session_id)
+            meta = {"updated_at": now, "message_count": len(messages), "auto_title": infer_title(messages),
+                    "preview": message_preview(messages)}
+            if not session_id.startswith("_"):
+                meta["title"] = title or meta["auto_title"]
+            base = self._meta.get(session_id) or {"title": "", "created_at": now, "pinned": False}
+            self._meta[session_id] = {**base, **meta}
+            self._pending[session_id] = {
+                "deadline": pending["deadline"] if pending else time.monotonic() + self.flush_delay,
+                "title": title, "meta": meta,
+            }
+            self._cache_locked(session_id, None, messages)
+            self.generation += 1
+            if self.flush_delay > 0 and not self._closed:
+                self._ensure_thread_locked()
+                self._cond.notify()
+                return
+        self.flush()
+
+    def replace(self, session_id: str, messages: list[dict]) -> None:
+        """Rewrite the whole session now (history was edited rather than appended to)."""
+        messages = [m for m in messages if isinstance(m, dict)]
+        with self._write_lock:
+            with self._cond:
+                self._pending.pop(session_id, None)
+                self._messages.pop(session_id, None)
+            self.store.replace(session_id, messages)
+            with self._cond:
+                self._sync_locked()
+
+    def update_meta(self, session_id: str, **fields) -> bool:
+        ok = self.store.update_meta(session_id, **fields)
+        with self._cond:
+            pending = self._pending.get(session_id)
+            if pending is not None:
+                pending["meta"].update(fields)
+        return ok
+
+    def create(self, session_id: str, title: str = "新对话") -> bool:
+        return self.store.create(session_id, title)
+
+    def delete(self, session_id: str) -> bool:
+        with self._write_lock:
+            with self._cond:
+                dropped = self._pending.pop(session_id, None) is not None
+                self._messages.pop(session_id, None)
+            ok = self.store.delete(session_id)
+            with self._cond:
+                self._sync_locked()
+            return ok or dropped
+
+    # ---- 回写 ----
+    def _ensure_thread_locked(self) -> None:
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="session-flush", daemon=True)
+            self._thread.start()
+
+    def _run(self) -> None:
+        with self._cond:
+            while not self._closed:
+                if not self._pending:
+                    self._cond.wait()
+                    continue
+                wait = min(p["deadline"] for p in self._pending.values()) - time.monotonic()
+                if wait > 0:
+                    self._cond.wait(wait)
+                    continue
+                self._cond.release()
+                try:
+                    self._flush(due_only=True)
+                finally:
+                    self._cond.acquire()
+
+    def flush(self) -> None:
+        """Write every dirty session now."""
+        self._flush(due_only=False)
+
+    def _flush(self, due_only: bool) -> None:
+        with self._write_lock:
+            now = time.monotonic()
+            with self._cond:
+                items = []
+                for sid, pending in list(self._pending.items()):
+                    if due_only and pending["deadline"] > now:
+                        continue
+                    del self._pending[sid]
+                    items.append((sid, self._messages[sid][1], pending))
+            if not items:
+                return
+            try:
+                self._write([(sid, messages, pending["title"]) for sid, messages, pending in items])
+            except Exception as e:
+                print(f"[session_cache] write-behind failed, retrying in {self.flush_delay:.1f}s: {e}")
+                with self._cond:
+                    for sid, _messages, pending in items:
+                        # 失败期间又被保存的会话已有更新的待写记录
+                        if sid not in self._pending:
+                            self._pending[sid] = {**pending, "deadline": time.monotonic() + self.flush_delay}
+                return
+            with self._cond:
+                for sid, messages, _pending in items:
+                    cached = self._messages.get(sid)
+                    if sid not in self._pending and cached is not None and cached[1] is messages:
+                        self._messages[sid] = (_signature(self.store.get(sid)), messages)
+                self._sync_locked()
+
+    def _write(self, items: list[tuple[str, list[dict], str]]) -> None:
+        store = self.store
+        with store.batch():
+            for sid, messages, title in items:
+                store.save(sid, messages)
+                if not sid.startswith("_"):
+                    meta = store.get(sid) or {}
+                    store.update_meta(sid, title=title or meta.get("auto_title") or "新对话")
+
+    def close(self) -> None:
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            thread.join(timeout=5)
+        self.flush()
+
+
+_cache: SessionCache | None = None
+_cache_lock = threading.Lock()
+
+
+def get_session_cache() -> SessionCache:
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = SessionCache()
+            # CLI 等短生命周期进程退出前写回
+            atexit.register(shutdown_session_cache)
+        return _cache
+
+
+def shutdown_session_cache() -> None:
+    global _cache
+    with _cache_lock:
+        cache, _cache = _cache, None
+    if cache is not None:
+        cache.close()
+
+
+# ---- 自检：python -m ai_pipeline.session_cache ----
+if __name__ == "__main__":
+    import tempfile
+    from pathlib import Path
+
+    with tempfile.TemporaryDirectory() as tmp:
+        store = SessionStore(Path(tmp), None, None)
+        for i in range(200):
+            store.save(f"s{i}", [{"role": "user", "content": f"请求 {i}"}, {"role": "assistant", "content": "x" * 2000}])
+        cache = SessionCache(store, flush_delay=0.2)
+
+        def listing(metas):
+            return sorted(metas, key=lambda sid: metas[sid].get("updated_at", ""), reverse=True)
+
+        n = 2000
+        t = time.perf_counter()
+        for _ in range(n):
+            cache.view(listing)
+        print(f"listing x{n}: {(time.perf_counter() - t) / n * 1e6:.1f}us/call")
+
+        history = cache.load("s0")
+        t = time.perf_counter()
+        for i in range(50):
+            history.append({"role": "user", "content": f"第 {i} 轮"})
+            cache.save("s0", history)
+        print(f"save x50: {(time.perf_counter() - t) / 50 * 1e6:.1f}us/call, "
+              f"on disk before flush: {store.get('s0')['message_count']} messages")
+        assert cache.load("s0") == history
+        time.sleep(0.5)
+        assert store.load("s0") == history, "flushed within the delay"
+
+        # 另一个进程（这里用另一个 SessionStore 实例模拟）写入后缓存失效
+        other = SessionStore(Path(tmp), None, None)
+        other.save("s1", other.load("s1") + [{"role": "user", "content": "来自 CLI"}])
+        assert cache.load("s1")[-1]["content"] == "来自 CLI"
+        cache.save("s2", cache.load("s2") + [{"role": "user", "content": "退出前"}])
+        cache.close()
+        assert other.load("s2")[-1]["content"] == "退出前"
+        print("invalidation / write-behind / close: ok")
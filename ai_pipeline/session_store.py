@@ -0,0 +1,384 @@
+"""会话存储：每个会话一个追加写的 JSONL 文件 + 一个紧凑索引（元数据与提交位置）。
+
+sessions/<文件名>.jsonl 每行一条消息；sessions/index.json 记录每个会话的标题、时间、置顶、
+最后一条消息摘要、消息数、已提交字节数 size 与第一条 / 最后一条消息的哈希 head / tail。
+保存消息时若已存储的消息是新列表的前缀（按消息数 + 首尾两条消息的哈希判断），只追加新增的行：
+截断上次写入中途崩溃留下的未提交尾部 → 追加并 fsync → 原子替换索引（ai_pipeline/storage.atomic_write）。
+索引即提交记录，读取只读到 size 字节为止；因此追加是 O(新消息)，元数据更新是 O(会话数)。
+消息被修改需要整体重写时，写到新一代文件名 <会话>~<代数>.jsonl，随索引提交切换 file，
+提交后再删除旧文件：任何时刻已提交的索引都指向完整的文件，不加锁的读者也不会读到新旧混合的内容。
+写入在 sessions/.lock 文件锁内完成“重新加载索引 → 修改 → 提交”，Web 服务与 generate_cli.py
+同时运行也不会互相覆盖；读取不加锁。batch() 把多个修改合并为一次加锁与一次索引写入。
+首次使用时从旧的 conversations.json / conversations_meta.json 一次性迁移（旧文件保留，不再写入）。
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import re
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+from ai_pipeline.storage import FileLock, atomic_write, atomic_write_json, fsync_file
+
+_AI_PIPELINE_DIR = Path(__file__).resolve().parent
+SESSIONS_DIR = _AI_PIPELINE_DIR / "sessions"
+LEGACY_CONVERSATIONS = _AI_PIPELINE_DIR / "conversations.json"
+LEGACY_META = _AI_PIPELINE_DIR / "conversations_meta.json"
+
+INDEX_FORMAT = 1
+_SAFE_ID_RE = re.compile(r"^[A-Za-z0-9_.-]{1,80}$")
+
+
+def _now() -> str:
+    return time.strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _line(message: dict) -> bytes:
+    return (json.dumps(message, ensure_ascii=False) + "\n").encode("utf-8")
+
+
+def _message_hash(message: dict) -> str:
+    return hashlib.sha1(_line(message)).hexdigest()[:16]
+
+
+def infer_title(messages: list) -> str:
+    """从消息列表推断标题：取第一条 user 消息前 50 字符。"""
+    for m in messages:
+        if isinstance(m, dict) and m.get("role") == "user":
+            text = (m.get("content") or "").strip()
+            if text:
+                return text[:50] + ("…" if len(text) > 50 else "")
+    return "新对话"
+
+
+def message_preview(messages: list, limit: int = 80) -> str:
+    """最后一条消息的单行摘要（会话列表用）。"""
+    for m in reversed(messages):
+        if isinstance(m, dict) and isinstance(m.get("content"), str) and m["content"].strip():
+            text = " ".join(m["content"].split())
+            return text[:limit] + ("…" if len(text) > limit else "")
+    return ""
+
+
+def _file_name(session_id: str) -> str:
+    if _SAFE_ID_RE.match(session_id) and not session_id.startswith("."):
+        return f"{session_id}.jsonl"
+    return "s_" + hashlib.sha1(session_id.encode("utf-8")).hexdigest()[:16] + ".jsonl"
+
+
+class SessionStore:
+    def __init__(self, root: Path = SESSIONS_DIR, legacy_conversations: Path | None = LEGACY_CONVERSATIONS,
+                 legacy_meta: Path | None = LEGACY_META):
+        self.root = Path(root)
+        self.index_path = self.root / "index.json"
+        self._legacy = (legacy_conversations, legacy_meta)
+        self._lock = threading.RLock()
+        self._file_lock = FileLock(self.root / ".lock")
+        self._sessions: dict[str, dict] = {}
+        self._stamp: tuple[int, int, int] | None = None
+        self._depth = 0
+        self._dirty = False
+        # 已被重写替代、等索引提交后删除的旧会话文件
+        self._obsolete: list[str] = []
+
+    # ---- 索引 ----
+    def version(self) -> tuple[int, int, int] | None:
+        """(inode, mtime_ns, size) of the index file; changes whenever any session is committed.
+
+        索引总是整体 rename 替换，inode 随之变化，同一时钟刻度内的两次提交也能区分。
+        """
+        try:
+            st = self.index_path.stat()
+        except OSError:
+            return None
+        return st.st_ino, st.st_mtime_ns, st.st_size
+
+    def _refresh(self) -> None:
+        """索引文件被其他进程更新时重新加载（调用方持有 _lock）。"""
+        stamp = self.version()
+        if stamp is None and self._stamp is None:
+            with self._file_lock:
+                # 另一个进程可能刚完成迁移
+                stamp = self.version()
+                if stamp is None:
+                    self._migrate()
+                    return
+        if stamp is None or stamp == self._stamp:
+            return
+        try:
+            data = json.loads(self.index_path.read_text(encoding="utf-8"))
+        except (OSError, json.JSONDecodeError) as e:
+            # 索引只会被整体替换，读到坏文件说明被外部改动；保留内存中的版本
+            print(f"[session_store] cannot read {self.index_path}: {e}")
+            return
+        self._sessions = data.get("sessions", {})
+        self._stamp = stamp
+
+    def _commit(self) -> None:
+        """原子替换索引文件（调用方持有 _lock 与 _file_lock）。"""
+        atomic_write_json(self.index_path, {"format": INDEX_FORMAT, "sessions": self._sessions})
+        self._stamp = self.version()
+        self._dirty = False
+        obsolete, self._obsolete = self._obsolete, []
+        for name in obsolete:
+            try:
+                (self.root / name).unlink(missing_ok=True)
+            except OSError as e:
+                # Windows 上文件可能正被读取；留下的孤立文件不被索引引用，不影响读取
+                print(f"[session_store] cannot remove {name}: {e}")
+
+    @contextmanager
+    def batch(self):
+        """Hold the store lock across several updates and write the index once at the end.
+
+        最外层进入时加文件锁并重新加载索引，保证修改基于其他进程的最新提交。
+        """
+        with self._lock, self._file_lock:
+            if not self._depth:
+                self._refresh()
+            self._depth += 1
+            try:
+                yield self
+            finally:
+                self._depth -= 1
+                if not self._depth and self._dirty:
+                    self._commit()
+
+    def _migrate(self) -> None:
+        conv_path, meta_path = self._legacy
+        convs = self._read_legacy(conv_path)
+        metas = self._read_legacy(meta_path)
+        self._sessions = {}
+        for sid, messages in convs.items():
+            if not isinstance(messages, list):
+                continue
+            meta = metas.get(sid) if isinstance(metas.get(sid), dict) else {}
+            entry = {
+                "file": _file_name(sid),
+                "title": meta.get("title", sid),
+                "created_at": meta.get("created_at", ""),
+                "updated_at": meta.get("updated_at", ""),
+                "pinned": bool(meta.get("pinned", False)),
+                "auto_title": infer_title(messages),
+                "preview": message_preview(messages),
+            }
+            self._sessions[sid] = entry
+            self._rewrite(entry, [m for m in messages if isinstance(m, dict)])
+        self._commit()
+        if convs:
+            print(f"[session_store] migrated {len(self._sessions)} sessions from {conv_path.name}")
+
+    @staticmethod
+    def _read_legacy(path: Path | None) -> dict:
+        if path is None or not path.is_file():
+            return {}
+        try:
+            data = json.loads(path.read_text(encoding="utf-8-sig"))
+        except (OSError, json.JSONDecodeError):
+            return {}
+        return data if isinstance(data, dict) else {}
+
+    # ---- 消息文件 ----
+    def _rewrite(self, entry: dict, messages: list[dict]) -> None:
+        """整体重写一个会话（消息被修改而非追加时）：写到新一代文件，更新 entry 的文件名与提交位置。
+
+        旧文件在索引提交之后才删除（见 _commit）；文件还不存在（新会话、迁移）时直接写原文件名。
+        """
+        data = b"".join(_line(m) for m in messages)
+        name = entry["file"]
+        if (self.root / name).exists():
+            stem, _, gen = name.removesuffix(".jsonl").partition("~")
+            self._obsolete.append(name)
+            name = f"{stem}~{int(gen or 0) + 1}.jsonl"
+        atomic_write(self.root / name, data)
+        entry.update(file=name, size=len(data), message_count=len(messages),
+                     head=_message_hash(messages[0]) if messages else "",
+                     tail=_message_hash(messages[-1]) if messages else "")
+
+    def _append(self, entry: dict, messages: list[dict]) -> None:
+        fp = self.root / entry["file"]
+        size = entry.get("size", 0)
+        data = b"".join(_line(m) for m in messages)
+        with open(fp, "ab") as f:
+            if f.tell() != size:
+                # 上次追加写到一半没有提交：丢弃未提交的尾部
+                f.truncate(size)
+                f.seek(size)
+            f.write(data)
+            # 数据先落盘，再提交引用它的索引
+            fsync_file(f)
+        if not size:
+            entry["head"] = _message_hash(messages[0])
+        entry.update(size=size + len(data), message_count=entry.get("message_count", 0) + len(messages),
+                     tail=_message_hash(messages[-1]))
+
+    def _read(self, entry: dict) -> list[dict]:
+        size = entry.get("size", 0)
+        if not size:
+            return []
+        try:
+            with open(self.root / entry["file"], "rb") as f:
+                data = f.read(size)
+        except OSError:
+            return []
+        messages = []
+        for line in data.splitlines():
+            try:
+                messages.append(json.loads(line))
+            except json.JSONDecodeError:
+                continue
+        return messages
+
+    # ---- 公共接口 ----
+    def list_sessions(self) -> dict[str, dict]:
+        """session_id → 元数据副本（含内部会话，调用方自行过滤 "_" 前缀）。"""
+        with self._lock:
+            self._refresh()
+            return {sid: dict(entry) for sid, entry in self._sessions.items()}
+
+    def get(self, session_id: str) -> dict | None:
+        with self._lock:
+            self._refresh()
+            entry = self._sessions.get(session_id)
+            return dict(entry) if entry is not None else None
+
+    def load(self, session_id: str) -> list[dict]:
+        with self._lock:
+            for _ in range(3):
+                self._refresh()
+                entry = self._sessions.get(session_id)
+                messages = self._read(entry) if entry is not None else []
+                # 读取期间其他进程整体重写了该会话：按新索引重读
+                if self.version() == self._stamp:
+                    break
+            return messages
+
+    def save(self, session_id: str, messages: list[dict]) -> None:
+        """Persist messages; only the new tail is written when the stored ones are a prefix.
+
+        历史消息按只追加使用；改动了中间某条消息（首尾未变）时请用 replace() 整体重写。
+        """
+        self._save(session_id, messages, rewrite=False)
+
+    def replace(self, session_id: str, messages: list[dict]) -> None:
+        """Rewrite the whole session file with messages."""
+        self._save(session_id, messages, rewrite=True)
+
+    def _save(self, session_id: str, messages: list[dict], rewrite: bool) -> None:
+        messages = [m for m in messages if isinstance(m, dict)]
+        with self.batch():
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                entry = {"file": _file_name(session_id), "title": "", "created_at": _now(), "pinned": False}
+            else:
+                entry = dict(entry)
+            count = entry.get("message_count", 0)
+            fp = self.root / entry["file"]
+            prefix_ok = (not rewrite and count > 0 and len(messages) >= count and fp.is_file()
+                         and fp.stat().st_size >= entry.get("size", 0)
+                         and _message_hash(messages[count - 1]) == entry.get("tail")
+                         and _message_hash(messages[0]) == entry.get("head"))
+            if prefix_ok:
+                if len(messages) > count:
+                    self._append(entry, messages[count:])
+            else:
+                self._rewrite(entry, messages)
+            entry["updated_at"] = _now()
+            entry["auto_title"] = infer_title(messages)
+            entry["preview"] = message_preview(messages)
+            self._sessions[session_id] = entry
+            self._dirty = True
+
+    def update_meta(self, session_id: str, **fields) -> bool:
+        """Update metadata fields of an existing session in one atomic index write."""
+        with self.batch():
+            if session_id not in self._sessions:
+                return False
+            self._sessions[session_id] = {**self._sessions[session_id], **fields}
+            self._dirty = True
+            return True
+
+    def create(self, session_id: str, title: str = "新对话") -> bool:
+        """Register an empty session; False if session_id already exists."""
+        with self.batch():
+            if session_id in self._sessions:
+                return False
+            now = _now()
+            self._sessions[session_id] = {"file": _file_name(session_id), "title": title, "created_at": now,
+                                          "updated_at": now, "pinned": False, "size": 0, "message_count": 0,
+                                          "head": "", "tail": ""}
+            self._dirty = True
+            return True
+
+    def delete(self, session_id: str) -> bool:
+        with self.batch():
+            entry = self._sessions.pop(session_id, None)
+            if entry is None:
+                return False
+            self._commit()
+            (self.root / entry["file"]).unlink(missing_ok=True)
+            return True
+
+
+_store: SessionStore | None = None
+_store_lock = threading.Lock()
+
+
+def get_session_store() -> SessionStore:
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = SessionStore()
+        return _store
+
+
+# ---- 自检：python -m ai_pipeline.session_store ----
+if __name__ == "__main__":
+    import tempfile
+
+    with tempfile.TemporaryDirectory() as tmp:
+        root = Path(tmp)
+        legacy = {f"s{i}": [{"role": "user", "content": f"请求 {i} " + "x" * 400},
+                            {"role": "assistant", "content": "好的 " + "y" * 2000}] * 5 for i in range(60)}
+        (root / "conversations.json").write_text(json.dumps(legacy, ensure_ascii=False, indent=2), encoding="utf-8")
+        (root / "meta.json").write_text(json.dumps({"s1": {"title": "旧标题", "pinned": True}}), encoding="utf-8")
+        legacy_bytes = (root / "conversations.json").stat().st_size
+
+        store = SessionStore(root / "sessions", root / "conversations.json", root / "meta.json")
+        t = time.perf_counter()
+        entries = store.list_sessions()
+        print(f"migrated {len(entries)} sessions in {(time.perf_counter() - t) * 1000:.1f}ms; "
+              f"s1 = {entries['s1']['title']!r} pinned={entries['s1']['pinned']}")
+
+        history = store.load("s0")
+        t = time.perf_counter()
+        for i in range(50):
+            history.append({"role": "user", "content": f"第 {i} 轮"})
+            store.save("s0", history)
+        per_turn = (time.perf_counter() - t) / 50 * 1000
+        print(f"append: {per_turn:.2f}ms/turn (legacy rewrite was {legacy_bytes / 1024:.0f} KB per turn), "
+              f"s0 has {len(store.load('s0'))} messages")
+
+        # 模拟追加写到一半崩溃：文件尾部有未提交的半行
+        with open(root / "sessions" / "s0.jsonl", "ab") as f:
+            f.write(b'{"role": "user", "content": "tor')
+        other = SessionStore(root / "sessions", None, None)
+        assert len(other.load("s0")) == len(history)
+        history.append({"role": "assistant", "content": "恢复后继续"})
+        other.save("s0", history)
+        assert store.load("s0") == history, "second instance sees the change"
+        history[0] = {"role": "user", "content": "改写第一条"}
+        store.save("s0", history)
+        assert other.load("s0")[0]["content"] == "改写第一条"
+        history[5] = {"role": "user", "content": "改写中间一条"}
+        before = store.get("s0")["file"]
+        store.replace("s0", history)
+        assert other.load("s0") == history
+        after = store.get("s0")["file"]
+        assert after != before and not (root / "sessions" / before).exists(), "rewrite switches to a new file"
+        store.update_meta("s0", title="新标题")
+        store.delete("s2")
+        print("after crash/rewrite/rename/delete:", other.get("s0")["title"], "s2" in other.list_sessions())
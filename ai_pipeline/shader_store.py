@@ -0,0 +1,197 @@
+"""内容寻址的 shader 文件存储：同样的代码只落盘一次，按引用名计数，无引用的旧文件自动回收。
+
+文件名为 <前缀><sha256 前 16 位>.glsl，平铺在目标目录中（#include 仍按原目录解析）：
+- shaders/_preview/applied_<hash>.glsl：外部窗口启动的预览，重复启动同一份代码复用同一个文件；
+- shaders/generated/ai_<hash>.glsl：每次生成 / 质量检查的工作文件，并发构建互不覆盖。
+引用表 .refs.json 记录 引用名 → 文件名（如 "launch"、"session:<id>"、临时工作文件），
+在跨进程文件锁内修改；一个文件的引用计数 = 指向它的引用名个数。重新绑定引用名即释放旧文件。
+gc() 删除没有引用且超过 GC_MIN_AGE 秒未被写入 / 复用的文件；只处理本存储命名格式的文件，
+目录中其他文件（手动保存的 shader、旧的时间戳预览）不受影响。
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+
+from ai_pipeline.storage import FileLock, atomic_write, atomic_write_json
+
+SHADERS_DIR = Path(__file__).resolve().parent.parent / "shaders"
+# 无引用文件的最短保留时间（秒）：刚启动的查看器可能还在读取
+GC_MIN_AGE = float(os.environ.get("MS_SHADER_GC_AGE", str(24 * 3600)))
+# 同一进程两次自动回收的最小间隔（秒）
+GC_INTERVAL = 600.0
+# 临时工作文件的引用在进程崩溃后可能残留，超过该时间视为失效
+TEMP_REF_TTL = 3600.0
+TEMP_REF_PREFIX = "tmp:"
+
+
+class ShaderStore:
+    def __init__(self, directory: Path, prefix: str, min_age: float = GC_MIN_AGE):
+        self.directory = Path(directory)
+        self.prefix = prefix
+        self.min_age = min_age
+        self._refs_path = self.directory / ".refs.json"
+        self._file_lock = FileLock(self.directory / ".refs.lock")
+        self._name_re = re.compile(rf"^{re.escape(prefix)}[0-9a-f]{{16}}\.glsl$")
+        self._last_gc = 0.0
+        self._gc_lock = threading.Lock()
+
+    def path_for(self, code: str) -> Path:
+        digest = hashlib.sha256(code.encode("utf-8")).hexdigest()[:16]
+        return self.directory / f"{self.prefix}{digest}.glsl"
+
+    def put(self, code: str) -> Path:
+        """Store code (once) and return its content-addressed path."""
+        path = self.path_for(code)
+        try:
+            # 已存在：只刷新 mtime，让 gc 知道它刚被使用
+            os.utime(path)
+        except FileNotFoundError:
+            atomic_write(path, code)
+        return path
+
+    # ---- 引用 ----
+    def _read_refs(self) -> dict[str, list]:
+        try:
+            data = json.loads(self._refs_path.read_text(encoding="utf-8"))
+        except (OSError, json.JSONDecodeError):
+            return {}
+        return data if isinstance(data, dict) else {}
+
+    def bind(self, name: str, code: str) -> Path:
+        """Point reference name at the file for code (releasing whatever it pointed at) and return the path."""
+        path = self.put(code)
+        with self._file_lock:
+            refs = self._read_refs()
+            refs[name] = [path.name, time.time()]
+            atomic_write_json(self._refs_path, refs)
+        self.maybe_gc()
+        return path
+
+    def release(self, name: str) -> None:
+        with self._file_lock:
+            refs = self._read_refs()
+            if refs.pop(name, None) is not None:
+                atomic_write_json(self._refs_path, refs)
+
+    def refcount(self, path: Path) -> int:
+        return sum(1 for ref in self._read_refs().values() if ref[0] == Path(path).name)
+
+    @contextmanager
+    def working_file(self, code: str):
+        """A file holding code that stays referenced (and therefore on disk) for the duration of the block."""
+        name = f"{TEMP_REF_PREFIX}{os.getpid()}:{uuid.uuid4().hex[:12]}"
+        path = self.bind(name, code)
+        try:
+            yield path
+        finally:
+            self.release(name)
+
+    # ---- 回收 ----
+    def gc(self, min_age: float | None = None) -> list[str]:
+        """Delete unreferenced files older than min_age seconds; returns the removed names."""
+        min_age = self.min_age if min_age is None else min_age
+        now = time.time()
+        removed = []
+        with self._file_lock:
+            refs = self._read_refs()
+            stale = [n for n, ref in refs.items() if n.startswith(TEMP_REF_PREFIX) and now - ref[1] > TEMP_REF_TTL]
+            for name in stale:
+                del refs[name]
+            if stale:
+                atomic_write_json(self._refs_path, refs)
+            referenced = {ref[0] for ref in refs.values()}
+            try:
+                entries = list(os.scandir(self.directory))
+            except OSError:
+                return removed
+            for entry in entries:
+                if not self._name_re.match(entry.name) or entry.name in referenced:
+                    continue
+                try:
+                    if now - entry.stat().st_mtime >= min_age:
+                        os.unlink(entry.path)
+                        removed.append(entry.name)
+                except OSError:
+                    continue
+        return removed
+
+    def maybe_gc(self) -> None:
+        """gc() at most once per GC_INTERVAL in this process."""
+        with self._gc_lock:
+            if time.monotonic() - self._last_gc < GC_INTERVAL and self._last_gc:
+                return
+            self._last_gc = time.monotonic()
+        try:
+            removed = self.gc()
+        except OSError as e:
+            print(f"[shader_store] gc in {self.directory} failed: {e}")
+            return
+        if removed:
+            print(f"[shader_store] removed {len(removed)} unreferenced files from {self.directory.name}/")
+
+    def latest(self) -> Path | None:
+        """Most recently written / reused file of this store."""
+        try:
+            entries = [e for e in os.scandir(self.directory) if self._name_re.match(e.name)]
+        except OSError:
+            return None
+        if not entries:
+            return None
+        return Path(max(entries, key=lambda e: e.stat().st_mtime).path)
+
+
+_stores: dict[str, ShaderStore] = {}
+_stores_lock = threading.Lock()
+
+
+def _get_store(key: str, directory: Path, prefix: str) -> ShaderStore:
+    with _stores_lock:
+        store = _stores.get(key)
+        if store is None:
+            store = _stores[key] = ShaderStore(directory, prefix)
+        return store
+
+
+def get_preview_store() -> ShaderStore:
+    """shaders/_preview：外部窗口启动的预览。"""
+    return _get_store("preview", SHADERS_DIR / "_preview", "applied_")
+
+
+def get_generated_store() -> ShaderStore:
+    """shaders/generated：生成结果与质量检查的工作文件。"""
+    return _get_store("generated", SHADERS_DIR / "generated", "ai_")
+
+
+# ---- 自检：python -m ai_pipeline.shader_store ----
+if __name__ == "__main__":
+    import tempfile
+    from concurrent.futures import ThreadPoolExecutor
+
+    with tempfile.TemporaryDirectory() as tmp:
+        store = ShaderStore(Path(tmp), "applied_", min_age=0)
+        code = "#version 330\nvoid main(){}\n"
+        a = store.bind("launch", code)
+        b = store.bind("launch", code)
+        print("identical launches share a file:", a == b, "files:", len(list(Path(tmp).glob("applied_*"))))
+
+        def build(i: int) -> tuple[Path, str]:
+            src = f"#version 330\n// job {i}\nvoid main(){{}}\n"
+            with store.working_file(src) as path:
+                return path, path.read_text(encoding="utf-8") == src
+
+        with ThreadPoolExecutor(8) as pool:
+            results = list(pool.map(build, range(32)))
+        print("parallel builds: distinct files", len({p for p, _ in results}), "all intact", all(ok for _, ok in results))
+        current = store.bind("launch", "#version 330\n// other\nvoid main(){}\n")
+        removed = store.gc()
+        print(f"gc removed {len(removed)} unreferenced files; current launch kept: {current.exists()}, "
+              f"refs {store.refcount(current)}")
+        assert len(removed) == 33 and current.exists()
@@ -0,0 +1,168 @@
+"""持久化工具：崩溃安全的原子写入与跨进程文件锁（会话存储、settings.json 共用）。
+
+atomic_write：写同目录临时文件 → flush + fsync → os.replace → fsync 目录；任何时刻读者看到的
+要么是旧文件要么是完整的新文件，断电后也不会留下半个 JSON。
+FileLock：旁路 .lock 文件上的建议锁（POSIX flock / Windows msvcrt.locking），Web 服务与
+generate_cli.py 同时运行时串行化“读取 → 修改 → 写回”；同一进程内可重入，读者无需加锁。
+MS_FSYNC=0 可关闭 fsync（只保留原子替换），用于慢速网络盘等场景。
+"""
+from __future__ import annotations
+
+import json
+import os
+import threading
+import time
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+FSYNC = os.environ.get("MS_FSYNC", "1") != "0"
+# 非阻塞加锁失败后的重试间隔（秒）
+_LOCK_POLL = 0.01
+
+
+def fsync_file(f) -> None:
+    """Flush a binary file object and, unless MS_FSYNC=0, force it to disk."""
+    f.flush()
+    if FSYNC:
+        os.fsync(f.fileno())
+
+
+def fsync_dir(path: Path) -> None:
+    """持久化目录项（rename 之后）；Windows 不支持打开目录，直接跳过。"""
+    if not FSYNC or os.name == "nt":
+        return
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def atomic_write(path: Path, data: bytes | str, encoding: str = "utf-8") -> None:
+    """Replace path with data so that readers and crashes only ever see the old or the new content."""
+    path = Path(path)
+    if isinstance(data, str):
+        data = data.encode(encoding)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    try:
+        with open(tmp, "wb") as f:
+            f.write(data)
+            fsync_file(f)
+        os.replace(tmp, path)
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+    fsync_dir(path.parent)
+
+
+def atomic_write_json(path: Path, obj, **dumps_kwargs) -> None:
+    dumps_kwargs.setdefault("ensure_ascii", False)
+    atomic_write(path, json.dumps(obj, **dumps_kwargs))
+
+
+class FileLock:
+    """Exclusive cross-process lock on a sidecar file; reentrant within one process.
+
+    同一进程内先用 RLock 串行化线程，最外层 acquire 才去拿文件锁。
+    同一文件应只创建一个 FileLock 实例：flock 对同一进程内的两个文件描述符同样互斥。
+    """
+
+    def __init__(self, path: Path, timeout: float | None = None):
+        self.path = Path(path)
+        self.timeout = timeout
+        self._lock = threading.RLock()
+        self._depth = 0
+        self._fd: int | None = None
+
+    def acquire(self) -> None:
+        if not self._lock.acquire(timeout=-1 if self.timeout is None else self.timeout):
+            raise TimeoutError(f"lock busy: {self.path}")
+        if self._depth:
+            self._depth += 1
+            return
+        try:
+            self._fd = self._lock_file()
+        except BaseException:
+            self._lock.release()
+            raise
+        self._depth = 1
+
+    def release(self) -> None:
+        self._depth -= 1
+        if not self._depth:
+            fd, self._fd = self._fd, None
+            try:
+                self._unlock_file(fd)
+            finally:
+                os.close(fd)
+        self._lock.release()
+
+    def __enter__(self) -> "FileLock":
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.release()
+
+    def _lock_file(self) -> int:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        deadline = None if self.timeout is None else time.monotonic() + self.timeout
+        try:
+            while True:
+                try:
+                    if fcntl is not None:
+                        fcntl.flock(fd, fcntl.LOCK_EX | (fcntl.LOCK_NB if deadline is not None else 0))
+                    else:
+                        os.lseek(fd, 0, os.SEEK_SET)
+                        msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+                    return fd
+                except OSError:
+                    if deadline is not None and time.monotonic() >= deadline:
+                        raise TimeoutError(f"lock busy: {self.path}") from None
+                    time.sleep(_LOCK_POLL)
+        except BaseException:
+            os.close(fd)
+            raise
+
+    @staticmethod
+    def _unlock_file(fd: int) -> None:
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+        else:
+            os.lseek(fd, 0, os.SEEK_SET)
+            msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+
+
+# ---- 自检：python -m ai_pipeline.storage ----
+if __name__ == "__main__":
+    import multiprocessing
+    import tempfile
+
+    def _bump(path: str, rounds: int) -> None:
+        lock = FileLock(Path(path + ".lock"))
+        for _ in range(rounds):
+            with lock:
+                data = json.loads(Path(path).read_text(encoding="utf-8"))
+                data["n"] += 1
+                atomic_write_json(Path(path), data)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        target = Path(tmp) / "counter.json"
+        atomic_write_json(target, {"n": 0})
+        t = time.perf_counter()
+        procs = [multiprocessing.Process(target=_bump, args=(str(target), 50)) for _ in range(4)]
+        for p in procs:
+            p.start()
+        for p in procs:
+            p.join()
+        n = json.loads(target.read_text(encoding="utf-8"))["n"]
+        print(f"4 processes x 50 locked increments -> {n} in {time.perf_counter() - t:.2f}s, "
+              f"leftover tmp files: {[p.name for p in Path(tmp).glob('*.tmp')]}")
+        assert n == 200
@@ -9,6 +9,8 @@ from pathlib import Path
 
 from langchain_core.tools import tool
 
+from ai_pipeline.shader_store import get_generated_store
+
 
 @tool
 def validate_glsl_keywords(glsl_code: str = "") -> str:
@@ -41,7 +43,8 @@ def validate_glsl_keywords(glsl_code: str = "") -> str:
 def run_full_quality_check(glsl_code: str = "") -> str:
     """以子进程方式运行完整 AI 管线质量检查。
 
-    将代码写入临时文件后运行 `python -m ai_pipeline.hooks.quality_check`。
+    将代码写入本次检查独占的工作文件（shaders/generated/ai_<hash>.glsl）后运行
+    `python -m ai_pipeline.hooks.quality_check`，检查结束即释放。
 
     Args:
         glsl_code: GLSL 源码字符串
@@ -53,17 +56,13 @@ def run_full_quality_check(glsl_code: str = "") -> str:
         return json.dumps({"returncode": 1, "stdout": "", "stderr": "空代码"})
 
     root = Path(__file__).resolve().parent.parent.parent
-    temp_dir = root / "shaders" / "generated"
-    temp_dir.mkdir(parents=True, exist_ok=True)
-    temp_path = temp_dir / "ai_generated_latest.glsl"
-    temp_path.write_text(glsl_code, encoding="utf-8")
-
-    cmd = [
-        sys.executable, "-m", "ai_pipeline.hooks.quality_check",
-        "--root", str(root),
-        "--target-glsl", str(temp_path),
-    ]
-    result = subprocess.run(cmd, capture_output=True, text=True, timeout=30, cwd=root)
+    with get_generated_store().working_file(glsl_code) as temp_path:
+        cmd = [
+            sys.executable, "-m", "ai_pipeline.hooks.quality_check",
+            "--root", str(root),
+            "--target-glsl", str(temp_path),
+        ]
+        result = subprocess.run(cmd, capture_output=True, text=True, timeout=30, cwd=root)
 
     return json.dumps(
         {"returncode": result.returncode, "stdout": result.stdout.strip(), "stderr": result.stderr.strip()},
@@ -4,6 +4,9 @@ from __future__ import annotations
 from dataclasses import dataclass, field
 from typing import Any
 
+# AgentEvent.kind 取值
+EVENT_KINDS = ("token", "tool_call_started", "tool_result", "compile_result", "final_code", "done")
+
 
 @dataclass(slots=True)
 class GenerateRequest:
@@ -49,3 +52,31 @@ class CaseSpec:
     input: dict[str, Any]
     expected_signals: list[str]
     known_risks: list[str] = field(default_factory=list)
+
+
+@dataclass(slots=True)
+class AgentEvent:
+    """Agent 运行过程中的流式事件。
+
+    - token: LLM 文本增量（text）
+    - tool_call_started: 开始调用工具（name, data.args, data.id）
+    - tool_result: 工具返回（name, text 为结果预览）
+    - compile_result: 编译检查结果（data.success / data.errors）
+    - final_code: 最终提取的 GLSL（text, data.diagnostics）
+    - done: 运行结束（data.state 为最终 state，仅供内部使用，不发往前端）
+    """
+
+    kind: str
+    text: str = ""
+    name: str = ""
+    data: dict[str, Any] = field(default_factory=dict)
+
+    def to_dict(self) -> dict[str, Any]:
+        out: dict[str, Any] = {"event": self.kind}
+        if self.text:
+            out["text"] = self.text
+        if self.name:
+            out["name"] = self.name
+        if self.data:
+            out["data"] = self.data
+        return out
@@ -1,5 +1,19 @@
-from .uniforms import ShaderToyUniforms
-from .audio import AudioSource
-from .shader import ShaderViewer
+# 子模块按需导入：`python -m shadertoy` 或仅使用 daemon_client 时不必加载 PyAudio/OpenGL
+_EXPORTS = {
+    'ShaderToyUniforms': '.uniforms',
+    'AudioSource': '.audio',
+    'ShaderViewer': '.shader',
+    'ShaderToyApp': '.app',
+}
 
-__all__ = ['ShaderToyUniforms', 'AudioSource', 'ShaderViewer']
\ No newline at end of file
+__all__ = ['ShaderToyUniforms', 'AudioSource', 'ShaderViewer', 'ShaderToyApp']
+
+
+def __getattr__(name):
+    module = _EXPORTS.get(name)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    from importlib import import_module
+    value = getattr(import_module(module, __name__), name)
+    globals()[name] = value
+    return value
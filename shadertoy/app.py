@@ -0,0 +1,299 @@
+"""
+ShaderToy-like application: ShaderToyApp and its StartupProfiler.
+应用类放在普通模块里：`python -m shadertoy`、multiwindow、daemon 与 WebEngine.launch 都从这里导入，
+避免再次导入 __main__（会重新执行模块、重置 _T0，启动时间线丢失此前的耗时）
+"""
+import sys
+import os
+from pathlib import Path
+import threading
+import time
+import datetime
+
+_T0 = time.perf_counter()
+
+# Add parent directory to Python path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from shadertoy.shader import ShaderViewer
+from shadertoy.uniforms import ShaderToyUniforms, TextureChannel
+
+# 与 AudioSource 默认值一致：音频子系统尚未就绪时也能按最终尺寸创建纹理
+AUDIO_CHUNK_SIZE = 4096
+AUDIO_FFT_SIZE = 1024
+
+
+class StartupProfiler:
+    """Collect named timestamps during startup and print them as a timeline."""
+
+    def __init__(self, enabled: bool = False, t0: float | None = None):
+        self.enabled = enabled
+        self.t0 = _T0 if t0 is None else t0
+        self._marks: list[tuple[float, str, str]] = []
+        self._lock = threading.Lock()
+        self._reported = False
+
+    def mark(self, name: str) -> None:
+        if not self.enabled:
+            return
+        with self._lock:
+            self._marks.append((time.perf_counter() - self.t0, threading.current_thread().name, name))
+
+    def report(self) -> None:
+        if not self.enabled or self._reported:
+            return
+        self._reported = True
+        with self._lock:
+            marks = sorted(self._marks)
+        print("[startup] timeline (ms since process start):")
+        for t, thread, name in marks:
+            print(f"[startup] {t * 1000:8.1f}  {thread:<14} {name}")
+
+
+class ShaderToyApp:
+    """Main application class managing uniforms and rendering
+
+    Startup is staged: the window opens and the shader compiles first, so the
+    first frame is shown immediately; audio (PyAudio) and gesture (MediaPipe,
+    OpenCV) are imported and initialized on background threads and picked up
+    by update_uniforms() once ready.
+    """
+    def __init__(self, shader_path: str, width: int = 1920, height: int = 480, borderless: bool = False,
+                 monitor_index: int | None = None, center: bool = False, offset: tuple[int, int] | None = None,
+                 gesture_mode: str = "native", audio: bool = True, gesture: bool = True,
+                 profile_startup: bool = False):
+        self.profiler = StartupProfiler(profile_startup)
+        self.profiler.mark("imports done")
+        self.viewer = ShaderViewer(width, height, borderless=borderless)
+        if monitor_index is not None:
+            # place window on monitor before loading heavy resources
+            self.viewer.place_on_monitor(monitor_index, center=center, offset=offset)
+        self.profiler.mark("window created")
+        self.viewer.load_shader(shader_path)
+        self.profiler.mark("shader compiled")
+
+        # 音频与手势在后台线程初始化；就绪前这些属性保持为 None/False
+        self.audio = None
+        self.gesture = None
+        self._audio_started = False
+        self._gesture_started = False
+        self._gesture_mode = gesture_mode
+        self._init_threads: list[threading.Thread] = []
+        if audio:
+            self._start_init_thread("audio-init", self._init_audio)
+        else:
+            print("[audio] disabled (--no-audio)")
+        if gesture:
+            self._start_init_thread("gesture-init", self._init_gesture)
+        else:
+            print("[gesture] tracking disabled for this process")
+
+        # Initialize uniforms
+        self.uniforms = ShaderToyUniforms()
+        self.start_time = time.time()
+        self.last_time = self.start_time
+        self.frame_count = 0
+
+        # Setup audio channel
+        self.setup_audio_channel()
+
+    def _start_init_thread(self, name: str, target) -> None:
+        t = threading.Thread(target=target, name=name, daemon=True)
+        self._init_threads.append(t)
+        t.start()
+
+    def _init_audio(self):
+        try:
+            from shadertoy.audio import AudioSource
+            self.profiler.mark("audio module imported")
+            audio = AudioSource(chunk_size=AUDIO_CHUNK_SIZE, fft_size=AUDIO_FFT_SIZE)
+            audio.start_capture()
+            self.audio = audio
+            self._audio_started = True
+            self.profiler.mark("audio capture started")
+            print("[audio] capture started")
+        except Exception as e:
+            self._audio_started = False
+            self.profiler.mark("audio failed")
+            print(f"[audio] capture not started: {e}")
+
+    def _init_gesture(self):
+        # GestureTracker will handle modes: 'native', 'remote' or 'replay'
+        try:
+            from shadertoy.gesture import GestureTracker
+            gesture = GestureTracker(mode=self._gesture_mode)
+        except Exception as e:
+            self.profiler.mark("gesture failed")
+            print(f"[gesture] tracking disabled for this process: {e}")
+            return
+        # Try to start gesture tracking; if it fails we continue with audio-only mode
+        try:
+            gesture.start_capture()
+            self.gesture = gesture
+            self._gesture_started = True
+            self.profiler.mark("gesture tracking started")
+            print("[gesture] tracking started (mode=%s)" % getattr(gesture, 'mode', 'unknown'))
+        except Exception as e:
+            self._gesture_started = False
+            self.profiler.mark("gesture failed")
+            print(f"[gesture] tracking not started: {e}")
+
+    def _check_startup_done(self):
+        """Print the startup timeline once the first frame is up and all subsystems settled."""
+        if self.profiler.enabled and not self.profiler._reported:
+            if not any(t.is_alive() for t in self._init_threads):
+                self.profiler.report()
+
+    def setup_audio_channel(self):
+        """Setup audio as iChannel0"""
+        import OpenGL.GL as GL
+        # Create two textures: iChannel0 for time-domain waveform, iChannel1 for FFT spectrum
+        tex_time = GL.glGenTextures(1)
+        GL.glBindTexture(GL.GL_TEXTURE_2D, tex_time)
+        GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_MIN_FILTER, GL.GL_LINEAR)
+        GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_MAG_FILTER, GL.GL_LINEAR)
+        GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_WRAP_S, GL.GL_CLAMP_TO_EDGE)
+        GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_WRAP_T, GL.GL_CLAMP_TO_EDGE)
+
+        tex_fft = GL.glGenTextures(1)
+        GL.glBindTexture(GL.GL_TEXTURE_2D, tex_fft)
+        GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_MIN_FILTER, GL.GL_LINEAR)
+        GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_MAG_FILTER, GL.GL_LINEAR)
+        GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_WRAP_S, GL.GL_CLAMP_TO_EDGE)
+        GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_WRAP_T, GL.GL_CLAMP_TO_EDGE)
+
+        # iChannel0: time-domain buffer (width = chunk_size, height = 1)
+        self.uniforms.iChannels[0] = TextureChannel(
+            texture_id=tex_time,
+            resolution=(AUDIO_CHUNK_SIZE, 1, 0)
+        )
+        # iChannel1: FFT spectrum (width = fft_size, height = 1)
+        self.uniforms.iChannels[1] = TextureChannel(
+            texture_id=tex_fft,
+            resolution=(AUDIO_FFT_SIZE, 1, 0)
+        )
+
+    def update_uniforms(self):
+        """Update uniform values"""
+        current_time = time.time()
+        
+        # Update time uniforms
+        self.uniforms.iTime = current_time - self.start_time
+        self.uniforms.iTimeDelta = current_time - self.last_time
+        self.last_time = current_time
+        
+        # Update resolution
+        w, h = self.viewer.get_window_size()
+        self.uniforms.iResolution = (float(w), float(h), 0.0)
+        
+        # Update frame counter
+        self.uniforms.iFrame = self.frame_count
+        self.frame_count += 1
+
+        # Update hand tracking uniforms
+        if getattr(self, '_gesture_started', False) and self.gesture is not None:
+            hand_pos, hand_action, hand_depth_ref = self.gesture.get_gesture_data()
+            self.uniforms.iHandPos = (
+                float(hand_pos[0]),
+                float(hand_pos[1]),
+                float(hand_pos[2]),
+            )
+            self.uniforms.iHandAction = float(hand_action)
+            self.uniforms.iHandDepthRef = float(hand_depth_ref)
+            self.uniforms.iPinchEnabled = 1.0 if self.gesture.is_pinch_enabled() else 0.0
+        else:
+            self.uniforms.iHandPos = (0.0, 0.0, 0.0)
+            self.uniforms.iHandAction = 0.0
+            self.uniforms.iHandDepthRef = 0.0
+            self.uniforms.iPinchEnabled = 1.0
+        
+        # Update date
+        now = datetime.datetime.now()
+        self.uniforms.iDate = (
+            float(now.year),
+            float(now.month - 1),
+            float(now.day),
+            float(now.hour*3600 + now.minute*60 + now.second)
+        )
+        
+        # Update audio channel(s); until the audio thread is ready the textures stay empty
+        if not self._audio_started or self.audio is None:
+            return
+        self.audio.update()
+        # FFT texture data (shape: 1 x fft_size x 4)
+        texdata_fft = self.audio.get_texture_data()
+
+        # Time-domain buffer: copy current audio buffer into a 1xchunk_size RGBA texture
+        import numpy as _np
+        with self.audio._lock:
+            td = self.audio._audio_buffer.copy()
+        # Ensure correct length
+        if td.size != self.audio.chunk_size:
+            a = _np.zeros(self.audio.chunk_size, dtype=_np.float32)
+            a[:td.size] = td
+            td = a
+        texdata_time = _np.zeros((1, td.size, 4), dtype=_np.float32)
+        texdata_time[0, :, 0] = td  # R channel holds time-domain samples
+
+        # Assign into uniform channels
+        # iChannel0 -> FFT spectrum (ShaderToy standard: iChannel0 = frequency data)
+        self.uniforms.iChannels[0].data = texdata_fft
+        self.uniforms.iChannels[0].time = self.uniforms.iTime
+        # iChannel1 -> time-domain waveform
+        self.uniforms.iChannels[1].data = texdata_time
+        self.uniforms.iChannels[1].time = self.uniforms.iTime
+        # fill audio-related uniforms - only sample rate
+        try:
+            self.uniforms.iSampleRate = float(self.audio.sample_rate)
+        except Exception:
+            pass
+
+        # Log a basic diagnostic every 60 frames so user can confirm capture
+        if self.frame_count % 300 == 0:
+            try:
+                import numpy as _np
+                peak = float(_np.max(texdata_fft)) if texdata_fft is not None else 0.0
+                # Also report raw audio buffer amplitude (before FFT/normalization)
+                try:
+                    with self.audio._lock:
+                        buf = self.audio._audio_buffer.copy()
+                    buf_peak = float(_np.max(_np.abs(buf)))
+                except Exception:
+                    buf_peak = 0.0
+
+                # print a concise message to console with running_peak
+                running_pk = getattr(self.audio, '_running_peak', 0.0)
+                print(f"[audio] frame={self.frame_count} tex_peak={peak:.6f} buf_peak={buf_peak:.6f} running_peak={running_pk:.6f}")
+            except Exception:
+                pass
+
+    def run(self):
+        """Main application loop"""
+        try:
+            while not self.viewer.should_close():
+                self.viewer.poll_events()
+                self.update_uniforms()
+                self.viewer.render(self.uniforms)
+                if self.frame_count == 1:
+                    self.profiler.mark("first frame")
+                self._check_startup_done()
+        finally:
+            self.shutdown()
+
+    def shutdown(self):
+        """Stop audio/gesture capture and release the GL windows."""
+        # 等待仍在初始化的子系统结束，避免关闭后才打开设备
+        for t in getattr(self, '_init_threads', []):
+            t.join(timeout=5.0)
+        # Stop audio capture if we started it
+        try:
+            if getattr(self, '_audio_started', False):
+                self.audio.stop_capture()
+        except Exception:
+            pass
+        try:
+            if getattr(self, '_gesture_started', False) and self.gesture is not None:
+                self.gesture.stop_capture()
+        except Exception:
+            pass
+        self.viewer.cleanup()
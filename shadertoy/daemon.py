@@ -0,0 +1,351 @@
+"""
+Persistent shader viewer daemon.
+常驻渲染进程：音频/摄像头/窗口只初始化一次，WebEngine 通过本地 socket 下发控制命令
+
+Commands (dicts sent over multiprocessing.connection, see daemon_client.py):
+    {"cmd": "ping"}
+    {"cmd": "load", "path": str | None, "code": str | None, "swap": bool = True}
+    {"cmd": "swap"}                         activate the last staged program
+    {"cmd": "set_uniform", "name": str, "value": float | list[float] | None}
+    {"cmd": "screenshot", "path": str | None}   (path relative to shaders/_preview, .png only)
+    {"cmd": "stop"}
+    {"cmd": "telemetry", "hz": float = 20}  switch this connection to telemetry streaming
+Every command gets a reply dict with at least an "ok" key, except "telemetry": the
+connection then carries packed telemetry frames (send_bytes, see telemetry.py) at
+most hz times per second, and accepts fire-and-forget messages in the other direction:
+    {"cmd": "set_uniform", "name": str, "value": ..., "seq": int}   applied before the next frame
+    {"cmd": "rate", "hz": float}
+"""
+import os
+import queue
+import struct
+import sys
+import threading
+import time
+import zlib
+from multiprocessing.connection import Listener
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import glfw
+
+from shadertoy.app import ShaderToyApp
+from shadertoy.daemon_client import DAEMON_HOST, daemon_address, daemon_authkey
+from shadertoy.telemetry import DEFAULT_HZ, MAX_HZ, TelemetryPublisher
+from shadertoy.uniforms import BUILTIN_UNIFORMS, coerce_uniform
+
+SCREENSHOT_DIR = Path(__file__).resolve().parent.parent / "shaders" / "_preview"
+
+
+def write_png(path: str, rgba) -> None:
+    """Encode an (h, w, 4) uint8 array as PNG using only zlib/struct."""
+    h, w = rgba.shape[:2]
+    raw = b"".join(b"\x00" + rgba[y].tobytes() for y in range(h))
+
+    def chunk(tag: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data) & 0xFFFFFFFF)
+
+    png = b"\x89PNG\r\n\x1a\n"
+    png += chunk(b"IHDR", struct.pack(">IIBBBBB", w, h, 8, 6, 0, 0, 0))
+    png += chunk(b"IDAT", zlib.compress(raw, 6))
+    png += chunk(b"IEND", b"")
+    with open(path, "wb") as f:
+        f.write(png)
+
+
+class _Command:
+    """A control command handed from a connection thread to the render thread."""
+
+    def __init__(self, msg: dict):
+        self.msg = msg
+        self.reply: dict | None = None
+        self.done = threading.Event()
+
+    def resolve(self, reply: dict) -> None:
+        self.reply = reply
+        self.done.set()
+
+
+class ViewerDaemon(ShaderToyApp):
+    """ShaderToyApp that stays alive and takes load/swap/set_uniform/screenshot/stop commands.
+
+    Shaders are preprocessed, compiled and linked on a worker thread with a
+    hidden context sharing objects with the viewer, so the render loop never
+    stalls; the render thread only swaps program handles.
+    """
+
+    def __init__(self, shader_path: str, width: int = 1920, height: int = 480, borderless: bool = True,
+                 monitor_index: int | None = None, gesture_mode: str = "native",
+                 address: tuple[str, int] | None = None, authkey: bytes | None = None, **app_options):
+        super().__init__(shader_path, width, height, borderless=borderless,
+                         monitor_index=monitor_index, gesture_mode=gesture_mode, **app_options)
+        self.current_path = shader_path
+        self._commands: "queue.Queue[_Command]" = queue.Queue()
+        self._compile_jobs: "queue.Queue[_Command | None]" = queue.Queue()
+        self._staged: tuple[int, dict, str] | None = None
+        self._uniform_overrides: dict[str, object] = {}
+        self._telemetry = TelemetryPublisher()
+        self._running = True
+
+        self._compile_window = self.viewer.create_shared_context()
+        self.viewer.make_current()
+        self._compile_thread = threading.Thread(target=self._compile_loop, daemon=True)
+        self._compile_thread.start()
+
+        self.listener = Listener(address or daemon_address(), authkey=authkey or daemon_authkey())
+        self._accept_thread = threading.Thread(target=self._accept_loop, daemon=True)
+        self._accept_thread.start()
+        print(f"[daemon] listening on {self.listener.address}")
+
+    # ---------------- IPC -----------------
+    def _accept_loop(self):
+        while self._running:
+            try:
+                conn = self.listener.accept()
+            except Exception:
+                if not self._running:
+                    return
+                continue
+            threading.Thread(target=self._serve_conn, args=(conn,), daemon=True).start()
+
+    def _serve_conn(self, conn):
+        try:
+            while self._running:
+                try:
+                    msg = conn.recv()
+                except (EOFError, OSError):
+                    return
+                if not isinstance(msg, dict) or "cmd" not in msg:
+                    conn.send({"ok": False, "error": "bad request"})
+                    continue
+                if msg["cmd"] == "ping":
+                    conn.send({"ok": True, "pid": os.getpid(), "path": self.current_path,
+                               "frame": self.frame_count})
+                    continue
+                if msg["cmd"] == "telemetry":
+                    self._stream_telemetry(conn, msg.get("hz", DEFAULT_HZ))
+                    return
+                cmd = _Command(msg)
+                if msg["cmd"] == "load":
+                    # 编译在后台线程完成，不占用渲染线程
+                    self._compile_jobs.put(cmd)
+                else:
+                    self._commands.put(cmd)
+                cmd.done.wait()
+                conn.send(cmd.reply)
+        finally:
+            conn.close()
+
+    def _stream_telemetry(self, conn, hz) -> None:
+        """Push the latest telemetry frame every 1/hz s; control messages are read in between."""
+        def clamp(value) -> float:
+            try:
+                return min(MAX_HZ, max(1.0, float(value)))
+            except (TypeError, ValueError):
+                return DEFAULT_HZ
+
+        interval = 1.0 / clamp(hz)
+        sent_seq = 0
+        next_send = time.perf_counter()
+        self._telemetry.subscribe()
+        try:
+            while self._running:
+                timeout = next_send - time.perf_counter()
+                if timeout > 0 and conn.poll(timeout):
+                    msg = conn.recv()
+                    if not isinstance(msg, dict):
+                        continue
+                    if msg.get("cmd") == "set_uniform":
+                        # 不等待回复：渲染线程在下一帧开始前应用
+                        self._commands.put(_Command(msg))
+                    elif msg.get("cmd") == "rate":
+                        interval = 1.0 / clamp(msg.get("hz"))
+                    continue
+                next_send = max(next_send + interval, time.perf_counter())
+                seq, data = self._telemetry.latest()
+                if seq != sent_seq:
+                    sent_seq = seq
+                    conn.send_bytes(data)
+        except (EOFError, OSError):
+            pass
+        finally:
+            self._telemetry.unsubscribe()
+
+    # ---------------- background compile -----------------
+    def _write_code(self, code: str) -> str:
+        SCREENSHOT_DIR.mkdir(parents=True, exist_ok=True)
+        path = SCREENSHOT_DIR / "daemon_current.glsl"
+        code = code.lstrip('\ufeff')
+        if not code.lstrip().startswith('#version'):
+            code = '#version 330\n' + code
+        path.write_text(code if code.endswith("\n") else code + "\n", encoding="utf-8")
+        return str(path)
+
+    def _compile_loop(self):
+        import OpenGL.GL as GL
+
+        glfw.make_context_current(self._compile_window)
+        while True:
+            cmd = self._compile_jobs.get()
+            if cmd is None:
+                return
+            msg = cmd.msg
+            t0 = time.perf_counter()
+            try:
+                path = msg.get("path")
+                if not path:
+                    if not msg.get("code"):
+                        raise ValueError("load needs 'path' or 'code'")
+                    path = self._write_code(msg["code"])
+                if not os.path.isfile(path):
+                    raise FileNotFoundError(path)
+                program, locations = self.viewer.build_program(self.viewer.preprocess_source(path))
+                # 确保程序对象在共享上下文中完全就绪后再交给渲染线程
+                GL.glFinish()
+            except Exception as e:
+                cmd.resolve({"ok": False, "error": str(e)})
+                continue
+            compile_ms = (time.perf_counter() - t0) * 1000.0
+            staged = _Command({"cmd": "_staged", "program": program, "locations": locations, "path": path,
+                               "swap": msg.get("swap", True), "compile_ms": compile_ms})
+            self._commands.put(staged)
+            staged.done.wait()
+            cmd.resolve(staged.reply)
+
+    # ---------------- render-thread command handling -----------------
+    def _drain_commands(self):
+        while True:
+            try:
+                cmd = self._commands.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                cmd.resolve(self._handle(cmd.msg))
+            except Exception as e:
+                cmd.resolve({"ok": False, "error": str(e)})
+
+    def _handle(self, msg: dict) -> dict:
+        name = msg["cmd"]
+        if name == "_staged":
+            if self._staged is not None:
+                self.viewer.make_current()
+                import OpenGL.GL as GL
+                GL.glDeleteProgram(self._staged[0])
+            self._staged = (msg["program"], msg["locations"], msg["path"])
+            reply = {"ok": True, "path": msg["path"], "compile_ms": round(msg["compile_ms"], 1), "swapped": False}
+            if msg["swap"]:
+                self._swap()
+                reply["swapped"] = True
+            return reply
+        if name == "swap":
+            if self._staged is None:
+                return {"ok": False, "error": "nothing staged"}
+            return {"ok": True, "path": self._swap()}
+        if name == "set_uniform":
+            reply = self._set_uniform(msg.get("name", ""), msg.get("value"))
+            if reply["ok"] and isinstance(msg.get("seq"), int):
+                self._telemetry.ack = msg["seq"]
+            return reply
+        if name == "screenshot":
+            try:
+                return {"ok": True, "path": self._screenshot(msg.get("path"))}
+            except ValueError as e:
+                return {"ok": False, "error": str(e)}
+        if name == "stop":
+            self._running = False
+            return {"ok": True}
+        return {"ok": False, "error": f"unknown command: {name}"}
+
+    def _swap(self) -> str:
+        program, locations, path = self._staged
+        self._staged = None
+        self.viewer.set_program(program, locations)
+        self.current_path = path
+        print(f"[daemon] now showing {path}")
+        return path
+
+    def _set_uniform(self, name: str, value) -> dict:
+        if not name:
+            return {"ok": False, "error": "missing uniform name"}
+        if value is None:
+            # None 表示取消覆盖
+            self._uniform_overrides.pop(name, None)
+            self.viewer.extra_uniforms.pop(name, None)
+            return {"ok": True}
+        # 形状不对的值会让下一帧的 glUniform / 遥测打包抛异常并结束渲染循环，这里先拒绝
+        try:
+            value = coerce_uniform(name, value)
+        except ValueError as e:
+            return {"ok": False, "error": str(e)}
+        if name in BUILTIN_UNIFORMS:
+            self._uniform_overrides[name] = value
+        else:
+            self.viewer.extra_uniforms[name] = value
+        return {"ok": True}
+
+    def _screenshot(self, path: str | None) -> str:
+        """Write a PNG inside SCREENSHOT_DIR; a client path may only name a file there."""
+        SCREENSHOT_DIR.mkdir(parents=True, exist_ok=True)
+        root = SCREENSHOT_DIR.resolve()
+        if not path:
+            path = time.strftime("screenshot_%Y%m%d_%H%M%S.png")
+        target = (root / path).resolve()
+        if not target.is_relative_to(root) or target.suffix.lower() != ".png":
+            raise ValueError(f"screenshot path must be a .png inside {SCREENSHOT_DIR}")
+        target.parent.mkdir(parents=True, exist_ok=True)
+        path = str(target)
+        self.viewer.render(self.uniforms, swap=False)
+        write_png(path, self.viewer.read_pixels())
+        self.viewer.swap_buffers()
+        return path
+
+    def update_uniforms(self):
+        super().update_uniforms()
+        for name, value in self._uniform_overrides.items():
+            setattr(self.uniforms, name, value)
+
+    def run(self):
+        """Render loop; commands are applied between frames"""
+        try:
+            while self._running and not self.viewer.should_close():
+                self.viewer.poll_events()
+                self._drain_commands()
+                self.update_uniforms()
+                self.viewer.render(self.uniforms)
+                self._telemetry.frame_done(self)
+                self._check_startup_done()
+        finally:
+            self._running = False
+            self._compile_jobs.put(None)
+            try:
+                self.listener.close()
+            except Exception:
+                pass
+            glfw.destroy_window(self._compile_window)
+            self.shutdown()
+
+
+def main():
+    import argparse
+
+    default_shader = Path(__file__).resolve().parent.parent / "shaders" / "ink_wash.glsl"
+    parser = argparse.ArgumentParser(description="Persistent shader viewer daemon")
+    parser.add_argument("shader", nargs="?", default=str(default_shader))
+    parser.add_argument("--port", type=int, default=None)
+    parser.add_argument("--monitor", type=int, default=None)
+    parser.add_argument("--decorated", action="store_true", help="open a decorated window instead of borderless")
+    parser.add_argument("--no-audio", action="store_true")
+    parser.add_argument("--no-gesture", action="store_true")
+    parser.add_argument("--profile-startup", action="store_true")
+    args = parser.parse_args()
+
+    address = (DAEMON_HOST, args.port) if args.port else None
+    daemon = ViewerDaemon(args.shader, borderless=not args.decorated, monitor_index=args.monitor, address=address,
+                          audio=not args.no_audio, gesture=not args.no_gesture,
+                          profile_startup=args.profile_startup)
+    daemon.run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+"""
+Client side of the shader viewer daemon (see daemon.py).
+轻量客户端：不导入 OpenGL/glfw，可直接在 WebEngine 进程中使用
+"""
+import os
+import secrets
+import subprocess
+import sys
+import threading
+import time
+from multiprocessing.connection import Client
+from pathlib import Path
+
+DAEMON_HOST = "127.0.0.1"
+DEFAULT_DAEMON_PORT = 18110
+DAEMON_KEY_FILE = Path(__file__).resolve().parent.parent / ".cache" / "shadertoy_daemon.key"
+# 启动失败后的冷却时间（秒）：期间直接报不可用，调用方立即回退到独立进程
+DAEMON_RETRY_COOLDOWN = float(os.environ.get("SHADERTOY_DAEMON_RETRY_COOLDOWN", "60"))
+
+
+def daemon_address() -> tuple[str, int]:
+    return DAEMON_HOST, int(os.environ.get("SHADERTOY_DAEMON_PORT", str(DEFAULT_DAEMON_PORT)))
+
+
+def daemon_authkey() -> bytes:
+    """Shared secret for the daemon connection (HMAC challenge before anything is unpickled).
+
+    SHADERTOY_DAEMON_KEY overrides it; otherwise a random key is generated once per install
+    and kept in .cache/shadertoy_daemon.key (mode 0600), so other users / hosts cannot
+    talk to the daemon.
+    """
+    env_key = os.environ.get("SHADERTOY_DAEMON_KEY", "")
+    if env_key:
+        return env_key.encode("utf-8")
+    for _ in range(50):
+        try:
+            key = DAEMON_KEY_FILE.read_bytes().strip()
+        except FileNotFoundError:
+            key = b""
+        if key:
+            return key
+        _create_key_file()
+        time.sleep(0.01)
+    raise RuntimeError(f"cannot read daemon key: {DAEMON_KEY_FILE}")
+
+
+def _create_key_file() -> None:
+    # 先写 0600 临时文件再硬链接到目标：并发创建时只有一个成功，读者不会看到半个文件
+    DAEMON_KEY_FILE.parent.mkdir(parents=True, exist_ok=True)
+    tmp = DAEMON_KEY_FILE.with_name(f".{DAEMON_KEY_FILE.name}.{os.getpid()}.{threading.get_ident()}")
+    fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(secrets.token_hex(32).encode("ascii"))
+        try:
+            os.link(tmp, DAEMON_KEY_FILE)
+        except FileExistsError:
+            pass
+    finally:
+        tmp.unlink(missing_ok=True)
+
+
+class DaemonClient:
+    """Synchronous request/reply client; one connection shared under a lock."""
+
+    def __init__(self, address: tuple[str, int] | None = None, authkey: bytes | None = None):
+        self.address = address or daemon_address()
+        self.authkey = authkey or daemon_authkey()
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        if self._conn is None:
+            self._conn = Client(self.address, authkey=self.authkey)
+        return self._conn
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                try:
+                    self._conn.close()
+                except Exception:
+                    pass
+                self._conn = None
+
+    def request(self, cmd: str, **kwargs) -> dict:
+        """Send one command and wait for its reply; raises ConnectionError if the daemon is gone."""
+        with self._lock:
+            try:
+                conn = self._connect()
+                conn.send({"cmd": cmd, **kwargs})
+                return conn.recv()
+            except (OSError, EOFError) as e:
+                self._conn = None
+                raise ConnectionError(f"viewer daemon unavailable: {e}") from e
+
+    def ping(self) -> dict:
+        return self.request("ping")
+
+    def load(self, path: str | None = None, code: str | None = None, swap: bool = True) -> dict:
+        return self.request("load", path=path, code=code, swap=swap)
+
+    def swap(self) -> dict:
+        return self.request("swap")
+
+    def set_uniform(self, name: str, value) -> dict:
+        return self.request("set_uniform", name=name, value=value)
+
+    def screenshot(self, path: str | None = None) -> dict:
+        return self.request("screenshot", path=path)
+
+    def stop(self) -> dict:
+        try:
+            return self.request("stop")
+        finally:
+            self.close()
+
+    def is_alive(self) -> bool:
+        try:
+            return bool(self.ping().get("ok"))
+        except ConnectionError:
+            return False
+
+
+def telemetry_connection(hz: float = 20.0, address: tuple[str, int] | None = None,
+                         authkey: bytes | None = None):
+    """Open a dedicated connection streaming telemetry frames (recv_bytes) from the daemon.
+
+    The same connection takes fire-and-forget control messages via send(), e.g.
+    {"cmd": "set_uniform", "name": "iSatControl", "value": 0.5, "seq": 1}.
+    Raises ConnectionError if the daemon is not running.
+    """
+    try:
+        conn = Client(address or daemon_address(), authkey=authkey or daemon_authkey())
+        conn.send({"cmd": "telemetry", "hz": hz})
+    except (OSError, EOFError) as e:
+        raise ConnectionError(f"viewer daemon unavailable: {e}") from e
+    return conn
+
+
+_client: DaemonClient | None = None
+_client_lock = threading.Lock()
+_failed_at = 0.0
+
+
+def _reap(proc: subprocess.Popen) -> None:
+    """Stop (if still running) and wait for a daemon child that failed to come up."""
+    if proc.poll() is None:
+        proc.terminate()
+        try:
+            proc.wait(timeout=2)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            proc.wait()
+
+
+def ensure_daemon(shader_path: str | None = None, timeout: float = 20.0) -> DaemonClient:
+    """Return a client connected to a running daemon, spawning `python -m shadertoy.daemon` if needed.
+
+    If the daemon failed to start (no GL, port in use, ...), further calls raise
+    ConnectionError immediately for DAEMON_RETRY_COOLDOWN seconds instead of
+    spawning and waiting again.
+    """
+    global _client, _failed_at
+    with _client_lock:
+        if _client is None:
+            _client = DaemonClient()
+        if _client.is_alive():
+            _failed_at = 0.0
+            return _client
+        if _failed_at and time.monotonic() - _failed_at < DAEMON_RETRY_COOLDOWN:
+            raise ConnectionError("viewer daemon failed to start recently; not retrying yet")
+
+        root = Path(__file__).resolve().parent.parent
+        args = [sys.executable, "-m", "shadertoy.daemon"]
+        if shader_path:
+            args.append(shader_path)
+        proc = subprocess.Popen(args, cwd=str(root))
+
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            if _client.is_alive():
+                return _client
+            if proc.poll() is not None:
+                # 子进程已退出（多半是 GL 不可用或端口被占用），不必等到超时
+                break
+            time.sleep(0.2)
+        _reap(proc)
+        _failed_at = time.monotonic()
+        raise ConnectionError(f"viewer daemon did not start (exit code {proc.returncode})")
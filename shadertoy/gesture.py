@@ -6,6 +6,72 @@ from pathlib import Path
 
 import numpy as np
 
+from .gestureUtils import build_position_filter, extrapolate
+
+# 录制文件格式：16 字节头 + 定长记录（小端），回放时以 np.memmap 直接映射
+RECORDING_MAGIC = b"STGR"
+RECORDING_VERSION = 1
+RECORDING_HEADER = 16
+RECORDING_DTYPE = np.dtype([
+    ("t", "<f8"),                       # 相对录制开始的秒数
+    ("present", "u1"),                  # 该帧是否检测到手
+    ("landmarks", "<f4", (21, 3)),      # MediaPipe 归一化坐标 (x, y, z)
+])
+
+
+class GestureRecorder:
+    """Append timestamped hand-landmark frames to a compact binary file."""
+
+    def __init__(self, path: str, flush_every: int = 30):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._file = open(self.path, "wb")
+        header = RECORDING_MAGIC + np.array([RECORDING_VERSION], dtype="<u2").tobytes()
+        self._file.write(header.ljust(RECORDING_HEADER, b"\0"))
+        self._lock = threading.Lock()
+        self._flush_every = flush_every
+        self._count = 0
+
+    def write(self, t: float, points: np.ndarray | None) -> None:
+        rec = np.zeros(1, dtype=RECORDING_DTYPE)
+        rec["t"] = t
+        if points is not None:
+            rec["present"] = 1
+            rec["landmarks"][0] = points
+        with self._lock:
+            if self._file is None:
+                return
+            self._file.write(rec.tobytes())
+            self._count += 1
+            if self._count % self._flush_every == 0:
+                self._file.flush()
+
+    @property
+    def frame_count(self) -> int:
+        return self._count
+
+    def close(self) -> None:
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+def load_gesture_recording(path: str) -> np.ndarray:
+    """Memory-map a recording written by GestureRecorder (structured RECORDING_DTYPE array)."""
+    with open(path, "rb") as f:
+        header = f.read(RECORDING_HEADER)
+    if not header.startswith(RECORDING_MAGIC):
+        raise ValueError(f"not a gesture recording: {path}")
+    version = int(np.frombuffer(header[4:6], dtype="<u2")[0])
+    if version != RECORDING_VERSION:
+        raise ValueError(f"unsupported gesture recording version {version}: {path}")
+    size = Path(path).stat().st_size - RECORDING_HEADER
+    count = size // RECORDING_DTYPE.itemsize
+    if count <= 0:
+        return np.zeros(0, dtype=RECORDING_DTYPE)
+    return np.memmap(path, dtype=RECORDING_DTYPE, mode="r", offset=RECORDING_HEADER, shape=(count,))
+
 
 class GestureTracker:
     """Background thread for tracking hand gestures using MediaPipe Tasks."""
@@ -19,16 +85,31 @@ class GestureTracker:
         model_path: str | None = None,
         mode: str = "native",
         pipe_name: str | None = None,
+        record_path: str | None = None,
+        replay_path: str | None = None,
+        replay_speed: float | None = None,
+        replay_loop: bool = True,
     ):
         """
         mode: 'native' -> capture via camera + mediapipe
               'remote' -> receive gesture packets from native publisher via Windows named pipe
+              'replay' -> feed landmark frames from a recording (no camera / mediapipe needed)
         pipe_name: named pipe address. Defaults to SHADERTOY_GESTURE_PIPE or \\.\pipe\shadertoy_gesture.
+        record_path: in native mode, also record landmark frames to this file
+                     (defaults to SHADERTOY_GESTURE_RECORD).
+        replay_path / replay_speed: recording to replay and its speed factor
+                     (default SHADERTOY_GESTURE_REPLAY / SHADERTOY_GESTURE_REPLAY_SPEED, 1.0).
         """
         self.camera_index = camera_index
         self.mode = mode
         self.pipe_name = pipe_name or os.environ.get("SHADERTOY_GESTURE_PIPE", self.DEFAULT_PIPE_NAME)
         self.model_path = self._resolve_model_path(model_path) if mode == "native" else None
+        self.record_path = record_path or os.environ.get("SHADERTOY_GESTURE_RECORD") or None
+        self.replay_path = replay_path or os.environ.get("SHADERTOY_GESTURE_REPLAY") or None
+        self.replay_speed = float(
+            replay_speed if replay_speed is not None else os.environ.get("SHADERTOY_GESTURE_REPLAY_SPEED", "1.0")
+        )
+        self.replay_loop = replay_loop
 
         self._running = False
         self._lock = threading.Lock()
@@ -38,11 +119,25 @@ class GestureTracker:
         self._hand_depth_ref = 0.0  # 手掌中心深度参考，用于补偿深度变化导致的xy跳变
         self._pinch_enabled = True  # 握拳检测开关（默认开启）
 
+        # 位置滤波 + 延迟补偿：按 capture→render 的实测延迟把手部位置外推到渲染时刻
+        self._pos_filter = build_position_filter()
+        self._hand_velocity = np.zeros(3, dtype=np.float32)
+        self._sample_time = 0.0          # 最新一帧的采集时间戳 (perf_counter)
+        self._present_frames = 0         # 连续检测到手的帧数，重新出现的头几帧不外推
+        # 手离开画面时位置在滤波器之外按该系数衰减回原点（与历史上 EMA 追零的效果一致）
+        self._absent_decay = float(os.environ.get("SHADERTOY_GESTURE_POS_ALPHA", "0.45"))
+        self._max_predict = float(os.environ.get("SHADERTOY_GESTURE_MAX_PREDICT_MS", "20")) / 1000.0
+        self._camera_latency = float(os.environ.get("SHADERTOY_GESTURE_CAMERA_LATENCY_MS", "0")) / 1000.0
+        self._latency_ema = 0.0
+        self._smooth_action = 0.0
+        self._alpha_action = float(os.environ.get("SHADERTOY_GESTURE_ACTION_ALPHA", "0.4"))
+
         self.thread = None
         self.cap = None
         self._landmarker = None
         self._pub_thread = None
         self._pipe_listener = None
+        self._recorder = None
         self._frame_log_counter = 0
 
     def _resolve_model_path(self, model_path: str | None) -> Path:
@@ -73,10 +168,27 @@ class GestureTracker:
             "请将 hand_landmarker.task 固定到仓库路径，或通过 SHADERTOY_HAND_LANDMARKER_MODEL 指定本地文件。"
         )
 
-    def get_gesture_data(self):
-        """Return a copy of the current gesture data thread-safely."""
+    def get_gesture_data(self, render_time: float | None = None):
+        """Return a copy of the current gesture data thread-safely.
+
+        render_time: perf_counter timestamp the caller will present at; defaults
+        to now. With a velocity-aware filter (one_euro / kalman) the hand
+        position is extrapolated from the capture timestamp to render_time.
+        """
+        if render_time is None:
+            render_time = time.perf_counter()
+        with self._lock:
+            pos = self._hand_pos.copy()
+            if self._present_frames >= 2 and self._sample_time > 0.0:
+                horizon = render_time - self._sample_time + self._camera_latency
+                self._latency_ema = self._latency_ema * 0.95 + horizon * 0.05
+                pos = extrapolate(pos, self._hand_velocity, horizon, self._max_predict)
+            return pos, self._hand_action, self._hand_depth_ref
+
+    def get_latency_ms(self) -> float:
+        """Smoothed capture-to-render latency measured by get_gesture_data()."""
         with self._lock:
-            return self._hand_pos.copy(), self._hand_action, self._hand_depth_ref
+            return self._latency_ema * 1000.0
 
     def set_pinch_enabled(self, enabled: bool):
         """Enable or disable pinch/grip detection."""
@@ -131,6 +243,10 @@ class GestureTracker:
             )
             self._landmarker = vision.HandLandmarker.create_from_options(options)
 
+            if self.record_path:
+                self._recorder = GestureRecorder(self.record_path)
+                print(f"[gesture] recording landmarks to {self.record_path}")
+
             self._running = True
             self.thread = threading.Thread(target=self._capture_loop, daemon=True)
             self.thread.start()
@@ -143,6 +259,18 @@ class GestureTracker:
             self.thread = threading.Thread(target=self._pipe_client_loop, daemon=True)
             self.thread.start()
 
+        elif self.mode == "replay":
+            if not self.replay_path or not Path(self.replay_path).is_file():
+                raise RuntimeError(f"gesture replay file not found: {self.replay_path}")
+            self._running = True
+            self.thread = threading.Thread(target=self._replay_loop, daemon=True)
+            self.thread.start()
+
+            # 回放结果同样发布到命名管道，外部窗口无需区分数据来源
+            if os.name == "nt":
+                self._pub_thread = threading.Thread(target=self._pipe_publisher_loop, daemon=True)
+                self._pub_thread.start()
+
         else:
             raise ValueError(f"Unknown GestureTracker mode: {self.mode}")
 
@@ -162,6 +290,10 @@ class GestureTracker:
         if self.cap:
             self.cap.release()
 
+        if self._recorder is not None:
+            self._recorder.close()
+            self._recorder = None
+
         if self._landmarker is not None:
             try:
                 self._landmarker.close()
@@ -175,6 +307,72 @@ class GestureTracker:
             except Exception:
                 pass
 
+    def _landmarks_to_targets(self, points: np.ndarray | None):
+        """Map one hand's (21, 3) landmarks to (pos, action, depth_ref) targets."""
+        if points is None:
+            return np.array([0.0, 0.0, 0.0], dtype=np.float32), 0.0, 0.0
+
+        # 焦点坐标：使用手腕(landmark 0)而非手指尖(landmark 8)作为焦点源
+        # 原因: 手腕随手部整体运动，不受手指弯曲影响，更稳定
+        wrist = points[0]
+        target_pos = np.array([wrist[0], 1.0 - wrist[1], wrist[2]], dtype=np.float32)
+
+        # 计算手掌中心深度参考: 手腕(0) + 中指尖(12) + 无名指尖(16) 的平均
+        # 用作深度感知补偿的参考值
+        target_depth_ref = float((points[0][2] + points[12][2] + points[16][2]) / 3.0)
+
+        # 握拳检测：只基于xy距离（忽略z方向波动）
+        # 这样可以避免深度变化导致的握拳状态频繁抖动
+        # 握拳时=默认大小，张开时=放大
+        target_action = 0.0
+        if self._pinch_enabled:
+            dx = float(points[4][0] - points[8][0])
+            dy = float(points[4][1] - points[8][1])
+            # 仅使用xy平面距离，忽略z方向噪声
+            dist = (dx**2 + dy**2) ** 0.5
+
+            pinch_max = 0.02
+            pinch_min = 0.1
+            if dist <= pinch_max:
+                target_action = 1.0
+            elif dist >= pinch_min:
+                target_action = 0.0
+            else:
+                target_action = 1.0 - (dist - pinch_max) / (pinch_min - pinch_max)
+        # 握拳检测关闭时保持为握拳状态（target_action = 0.0）
+
+        return target_pos, target_action, target_depth_ref
+
+    def _apply_landmarks(self, points: np.ndarray | None, capture_ts: float) -> None:
+        """Filter one landmark frame and publish it as the current gesture state."""
+        target_pos, target_action, target_depth_ref = self._landmarks_to_targets(points)
+        self._smooth_action = self._smooth_action * (1 - self._alpha_action) + target_action * self._alpha_action
+
+        if points is None:
+            # 没有手：不更新位置滤波器（喂 [0,0,0] 会污染 one_euro / kalman 的速度估计，
+            # 重新出现时朝错误方向外推），只在滤波器之外让位置衰减回原点
+            with self._lock:
+                self._hand_pos = (self._hand_pos * (1.0 - self._absent_decay)).astype(np.float32)
+                self._hand_velocity = np.zeros(3, dtype=np.float32)
+                self._sample_time = capture_ts
+                self._present_frames = 0
+                self._hand_action = self._smooth_action
+                self._hand_depth_ref = target_depth_ref
+            return
+
+        if self._present_frames == 0:
+            # 重新出现：丢弃消失前的滤波状态，从当前测量重新开始
+            self._pos_filter.reset()
+        smooth_pos = self._pos_filter.update(target_pos, capture_ts)
+
+        with self._lock:
+            self._hand_pos = smooth_pos
+            self._hand_velocity = self._pos_filter.velocity
+            self._sample_time = capture_ts
+            self._present_frames += 1
+            self._hand_action = self._smooth_action
+            self._hand_depth_ref = target_depth_ref
+
     def _capture_loop(self):
         import cv2
         import mediapipe as mp
@@ -184,13 +382,7 @@ class GestureTracker:
             self._running = False
             return
 
-        smooth_pos = np.array([0.0, 0.0, 0.0], dtype=np.float32)
-        smooth_action = 0.0
-        # 降低平滑带来的时滞，位置比动作更重要
-        # 改进：手腕比手指尖更稳定，可以用更强的平滑（更小的alpha）来消除微小波动
-        alpha_pos = float(os.environ.get("SHADERTOY_GESTURE_POS_ALPHA", "0.45"))
-        alpha_action = float(os.environ.get("SHADERTOY_GESTURE_ACTION_ALPHA", "0.4"))
-
+        record_start = time.perf_counter()
         try:
             while self._running:
                 loop_start = time.perf_counter()
@@ -198,7 +390,8 @@ class GestureTracker:
                 if not success:
                     time.sleep(0.01)
                     continue
-                read_ms = (time.perf_counter() - loop_start) * 1000.0
+                capture_ts = time.perf_counter()
+                read_ms = (capture_ts - loop_start) * 1000.0
 
                 detect_start = time.perf_counter()
                 image = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
@@ -214,62 +407,25 @@ class GestureTracker:
                         break
                     raise
 
-                target_pos = np.array([0.0, 0.0, 0.0], dtype=np.float32)
-                target_action = 0.0
-                target_depth_ref = 0.0
-
+                points = None
                 if results.hand_landmarks:
-                    hand_landmarks = results.hand_landmarks[0]
-                    
-                    # 焦点坐标：使用手腕(landmark 0)而非手指尖(landmark 8)作为焦点源
-                    # 原因: 手腕随手部整体运动，不受手指弯曲影响，更稳定
-                    wrist = hand_landmarks[0]
-                    target_pos = np.array([wrist.x, 1.0 - wrist.y, wrist.z], dtype=np.float32)
-                    
-                    # 计算手掌中心深度参考: 手腕(0) + 中指尖(12) + 无名指尖(16) 的平均
-                    # 用作深度感知补偿的参考值
-                    palm_depth = (hand_landmarks[0].z + hand_landmarks[12].z + hand_landmarks[16].z) / 3.0
-                    target_depth_ref = float(palm_depth)
-
-                    # 握拳检测：只基于xy距离（忽略z方向波动）
-                    # 这样可以避免深度变化导致的握拳状态频繁抖动
-                    # 握拳时=默认大小，张开时=放大
-                    if self._pinch_enabled:
-                        thumb_tip = hand_landmarks[4]
-                        index_tip = hand_landmarks[8]
-                        dx = thumb_tip.x - index_tip.x
-                        dy = thumb_tip.y - index_tip.y
-                        # 仅使用xy平面距离，忽略z方向噪声
-                        dist = (dx**2 + dy**2) ** 0.5
-
-                        pinch_max = 0.02
-                        pinch_min = 0.1
-                        if dist <= pinch_max:
-                            target_action = 1.0
-                        elif dist >= pinch_min:
-                            target_action = 0.0
-                        else:
-                            target_action = 1.0 - (dist - pinch_max) / (pinch_min - pinch_max)
-                    else:
-                        # 握拳检测关闭，保持为握拳状态（target_action = 0.0）
-                        target_action = 0.0
+                    points = np.array(
+                        [(lm.x, lm.y, lm.z) for lm in results.hand_landmarks[0]], dtype=np.float32
+                    )
 
                 detect_ms = (time.perf_counter() - detect_start) * 1000.0
 
-                smooth_pos = smooth_pos * (1 - alpha_pos) + target_pos * alpha_pos
-                smooth_action = smooth_action * (1 - alpha_action) + target_action * alpha_action
-
-                with self._lock:
-                    self._hand_pos = smooth_pos
-                    self._hand_action = smooth_action
-                    self._hand_depth_ref = target_depth_ref
+                if self._recorder is not None:
+                    self._recorder.write(capture_ts - record_start, points)
+                self._apply_landmarks(points, capture_ts)
 
                 self._frame_log_counter += 1
                 if self._frame_log_counter % 60 == 0:
                     total_ms = (time.perf_counter() - loop_start) * 1000.0
                     print(
                         f"[gesture] frame={self._frame_log_counter} read_ms={read_ms:.1f} "
-                        f"detect_ms={detect_ms:.1f} total_ms={total_ms:.1f}"
+                        f"detect_ms={detect_ms:.1f} total_ms={total_ms:.1f} "
+                        f"render_latency_ms={self.get_latency_ms():.1f}"
                     )
 
         finally:
@@ -279,6 +435,47 @@ class GestureTracker:
                 except Exception:
                     pass
 
+    def _replay_loop(self):
+        """Feed recorded landmark frames back with their original (or scaled) timing.
+
+        replay_speed > 0 scales wall-clock timing (2.0 = twice as fast);
+        replay_speed <= 0 replays as fast as possible using the recorded
+        timestamps (offset to perf_counter, like the timed mode) as the
+        filter clock, which is what benchmarks want; it still yields the GIL
+        once per frame so a render thread in the same process keeps running.
+        """
+        frames = load_gesture_recording(self.replay_path)
+        if len(frames) == 0:
+            print(f"[gesture] replay file is empty: {self.replay_path}")
+            self._running = False
+            return
+        print(f"[gesture] replaying {len(frames)} frames from {self.replay_path} (speed={self.replay_speed})")
+
+        while self._running:
+            start = time.perf_counter()
+            for rec in frames:
+                if not self._running:
+                    return
+                if self.replay_speed > 0:
+                    capture_ts = start + float(rec["t"]) / self.replay_speed
+                    delay = capture_ts - time.perf_counter()
+                    if delay > 0:
+                        time.sleep(delay)
+                else:
+                    # 与 get_gesture_data 的 perf_counter 时钟对齐，外推时长才有意义
+                    capture_ts = start + float(rec["t"])
+                points = np.array(rec["landmarks"]) if rec["present"] else None
+                self._apply_landmarks(points, capture_ts)
+                self._frame_log_counter += 1
+                if self.replay_speed <= 0:
+                    # 全速回放不 sleep，每帧让出一次 GIL，避免饿死渲染线程
+                    time.sleep(0)
+            if not self.replay_loop:
+                break
+            # 循环回放时重置滤波器，避免首尾跳变被当成速度
+            self._pos_filter.reset()
+        self._running = False
+
     def _pipe_publisher_loop(self):
         """Publish latest gesture data to a Windows named pipe."""
         listener = None
@@ -297,14 +494,15 @@ class GestureTracker:
 
                 try:
                     while self._running:
-                        with self._lock:
-                            payload = (
-                                float(self._hand_pos[0]),
-                                float(self._hand_pos[1]),
-                                float(self._hand_pos[2]),
-                                float(self._hand_action),
-                                float(self._hand_depth_ref),
-                            )
+                        # 发布外推后的位置，订阅端按到达即渲染处理
+                        pos, action, depth_ref = self.get_gesture_data()
+                        payload = (
+                            float(pos[0]),
+                            float(pos[1]),
+                            float(pos[2]),
+                            float(action),
+                            float(depth_ref),
+                        )
 
                         try:
                             conn.send(payload)
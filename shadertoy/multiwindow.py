@@ -0,0 +1,83 @@
+"""
+Single-process multi-window renderer.
+单进程多窗口：一份音频分析、一份手势跟踪、每帧一次纹理上传，供所有窗口复用
+"""
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from shadertoy.app import ShaderToyApp
+from shadertoy.shader import ShaderViewer
+
+
+class MultiWindowApp(ShaderToyApp):
+    """Drive several GLFW windows from one process.
+
+    The first shader opens the primary window (which owns audio, gesture and
+    the channel textures); every extra shader opens a window whose GL context
+    shares objects with the primary one. Per frame the uniforms are computed
+    once and the textures uploaded once, then each window only binds them and
+    draws. Secondary windows run with swap interval 0 so only the primary
+    window waits for vsync.
+    """
+
+    def __init__(self, shader_paths: list[str], width: int = 1920, height: int = 480, borderless: bool = False,
+                 monitor_index: int | None = None, gesture_mode: str = "native", **app_options):
+        if not shader_paths:
+            raise ValueError("at least one shader path is required")
+        super().__init__(shader_paths[0], width, height, borderless=borderless,
+                         monitor_index=monitor_index, gesture_mode=gesture_mode, **app_options)
+        self.windows: list[ShaderViewer] = []
+        for i, path in enumerate(shader_paths[1:], start=1):
+            # 默认沿纵向错开，避免窗口完全重叠
+            self.add_window(path, width, height, borderless=borderless,
+                            monitor_index=monitor_index, offset=(0, i * (height + 40)))
+
+    def add_window(self, shader_path: str, width: int = 1920, height: int = 480, borderless: bool = False,
+                   monitor_index: int | None = None, offset: tuple[int, int] | None = None) -> ShaderViewer:
+        """Open another window sharing the primary context and load shader_path into it."""
+        viewer = ShaderViewer(width, height, title=Path(shader_path).name, borderless=borderless,
+                              share=self.viewer)
+        if monitor_index is not None:
+            viewer.place_on_monitor(monitor_index, offset=offset)
+        viewer.load_shader(shader_path)
+        self.windows.append(viewer)
+        return viewer
+
+    def run(self):
+        """Main loop: one uniform/texture update per frame, N draws"""
+        try:
+            while not self.viewer.should_close():
+                self.viewer.poll_events()
+                self.update_uniforms()
+                self.viewer.upload_textures(self.uniforms)
+
+                primary_resolution = self.uniforms.iResolution
+                for viewer in list(self.windows):
+                    if viewer.should_close():
+                        viewer.destroy()
+                        self.windows.remove(viewer)
+                        continue
+                    w, h = viewer.get_window_size()
+                    self.uniforms.iResolution = (float(w), float(h), 0.0)
+                    viewer.render(self.uniforms, upload_textures=False)
+                self.uniforms.iResolution = primary_resolution
+
+                # 主窗口最后绘制：它的 swap_buffers 承担 vsync 节流
+                self.viewer.render(self.uniforms, upload_textures=False)
+                if self.frame_count == 1:
+                    self.profiler.mark("first frame")
+                self._check_startup_done()
+        finally:
+            for viewer in self.windows:
+                viewer.destroy()
+            self.windows.clear()
+            self.shutdown()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python -m shadertoy.multiwindow shader_a.glsl [shader_b.glsl ...]")
+        sys.exit(1)
+    MultiWindowApp(sys.argv[1:]).run()
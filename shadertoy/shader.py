@@ -8,6 +8,7 @@ from typing import Dict
 import numpy as np
 import glfw
 from OpenGL import GL
+from OpenGL.error import GLError
 import re
 from pathlib import Path
 
@@ -27,7 +28,11 @@ class ShaderViewer:
     }
     '''
 
-    def __init__(self, width: int = 1920, height: int = 480, title: str = 'ShaderToy-like Viewer', borderless: bool = False):
+    def __init__(self, width: int = 1920, height: int = 480, title: str = 'ShaderToy-like Viewer', borderless: bool = False,
+                 share: 'ShaderViewer | None' = None, visible: bool = True):
+        """share: another viewer whose GL context shares objects (textures, programs) with this one.
+        visible=False creates a hidden window (offscreen rendering into an FBO, e.g. thumbnails).
+        """
         if not glfw.init():
             raise RuntimeError('glfw.init() failed')
 
@@ -38,10 +43,11 @@ class ShaderViewer:
         glfw.window_hint(glfw.CONTEXT_VERSION_MINOR, 3)
         glfw.window_hint(glfw.OPENGL_PROFILE, glfw.OPENGL_CORE_PROFILE)
         
-        if borderless:
-            glfw.window_hint(glfw.DECORATED, glfw.FALSE)
+        glfw.window_hint(glfw.DECORATED, glfw.FALSE if borderless else glfw.TRUE)
+        glfw.window_hint(glfw.VISIBLE, glfw.TRUE if visible else glfw.FALSE)
 
-        self.window = glfw.create_window(width, height, title, None, None)
+        self.window = glfw.create_window(width, height, title, None, share.window if share is not None else None)
+        glfw.window_hint(glfw.VISIBLE, glfw.TRUE)
         if not self.window:
             glfw.terminate()
             raise RuntimeError('Failed to create window')
@@ -49,6 +55,10 @@ class ShaderViewer:
         glfw.make_context_current(self.window)
         self.width = width
         self.height = height
+        self.shared = share is not None
+        if self.shared:
+            # 多窗口时仅主窗口等待垂直同步，避免 N 个窗口串行等待 N 次 vsync
+            glfw.swap_interval(0)
 
         # 检测实际获得的 GL 版本，若为 ES 则启用兼容适配
         gl_ver = GL.glGetString(GL.GL_VERSION)
@@ -64,6 +74,9 @@ class ShaderViewer:
         glfw.set_key_callback(self.window, self._on_key)
         self.setup_quad()
         self.uniforms: Dict[str, int] = {}
+        # 自定义 uniform（名称 -> float 或 2/3/4 维元组），由外部控制端写入
+        self.extra_uniforms: Dict[str, tuple] = {}
+        self.extra_uniforms_loc: Dict[str, int] = {}
 
     # ---------------- input & window placement helpers -----------------
     def _on_key(self, window, key, scancode, action, mods):
@@ -123,7 +136,15 @@ class ShaderViewer:
         """Load and compile shader program"""
         if not os.path.isfile(path):
             raise FileNotFoundError(path)
-            
+        self.make_current()
+        program, locations = self.build_program(self.preprocess_source(path))
+        self.set_program(program, locations)
+
+    def preprocess_source(self, path: str) -> str:
+        """Read a fragment shader, inline #include files and adapt it to the current GL flavour.
+
+        Needs a current GL context (any context sharing objects with this viewer).
+        """
         with open(path, 'r', encoding='utf-8') as f:
             fs_src = f.read()
 
@@ -192,10 +213,20 @@ class ShaderViewer:
                 '\nout vec4 fragColor;'
             )
 
-        # Compile shaders
+        return fs_src
+
+    def build_program(self, fs_src: str) -> tuple[int, Dict[str, int]]:
+        """Compile and link fs_src, returning (program, uniform locations).
+
+        Does not touch the program currently in use, so it can run on a worker
+        thread whose current context shares objects with this viewer.
+        """
         vs = self._compile_shader(self.VERTEX_SRC, GL.GL_VERTEX_SHADER)
         fs = self._compile_shader(fs_src, GL.GL_FRAGMENT_SHADER)
-        self.program = self._link_program(vs, fs)
+        program = self._link_program(vs, fs)
+        # 链接完成后着色器对象即可释放
+        GL.glDeleteShader(vs)
+        GL.glDeleteShader(fs)
 
         # Get uniform locations
         uniform_names = [
@@ -203,14 +234,25 @@ class ShaderViewer:
             'iMouse', 'iDate', 'iSampleRate', 'iHandPos', 'iHandAction',
             'iHandDepthRef', 'iPinchEnabled', 'iSatControl', 'iDisturbControl'
         ]
-        self.uniforms = {
-            name: GL.glGetUniformLocation(self.program, name)
+        locations = {
+            name: GL.glGetUniformLocation(program, name)
             for name in uniform_names
         }
-        
+
         # Get channel uniform locations
         for i in range(4):
-            self.uniforms[f'iChannel{i}'] = GL.glGetUniformLocation(self.program, f'iChannel{i}')
+            locations[f'iChannel{i}'] = GL.glGetUniformLocation(program, f'iChannel{i}')
+        return program, locations
+
+    def set_program(self, program: int, locations: Dict[str, int]) -> None:
+        """Switch to an already linked program; the previous one is deleted."""
+        old = getattr(self, 'program', None)
+        self.program = program
+        self.uniforms = locations
+        self.extra_uniforms_loc: Dict[str, int] = {}
+        if old and old != program:
+            self.make_current()
+            GL.glDeleteProgram(old)
 
     def _compile_shader(self, src: str, shader_type: int) -> int:
         shader = GL.glCreateShader(shader_type)
@@ -237,7 +279,7 @@ class ShaderViewer:
             raise RuntimeError('Program link error:\n' + log)
         return prog
 
-    def update_uniforms(self, uniforms: ShaderToyUniforms) -> None:
+    def update_uniforms(self, uniforms: ShaderToyUniforms, upload_textures: bool = True) -> None:
         """Update shader uniforms from ShaderToyUniforms object"""
         GL.glUseProgram(self.program)
         
@@ -271,19 +313,63 @@ class ShaderViewer:
         if self.uniforms['iDisturbControl'] != -1:
             GL.glUniform1f(self.uniforms['iDisturbControl'], uniforms.iDisturbControl)
 
+        for name, value in list(self.extra_uniforms.items()):
+            loc = self.extra_uniforms_loc.get(name)
+            if loc is None:
+                loc = self.extra_uniforms_loc[name] = GL.glGetUniformLocation(self.program, name)
+            if loc == -1:
+                continue
+            try:
+                if len(value) == 1:
+                    GL.glUniform1f(loc, *value)
+                elif len(value) == 2:
+                    GL.glUniform2f(loc, *value)
+                elif len(value) == 3:
+                    GL.glUniform3f(loc, *value)
+                elif len(value) == 4:
+                    GL.glUniform4f(loc, *value)
+            except (GLError, TypeError, ValueError) as e:
+                # 分量数与 GLSL 声明不一致（或类型不对）：丢弃这个覆盖，不中断渲染
+                print(f"[shader] dropping uniform {name}={value!r}: {e}")
+                self.extra_uniforms.pop(name, None)
+
         # Update channel textures
         for i, channel in enumerate(uniforms.iChannels):
             if channel.data is not None and channel.texture_id != -1:
                 GL.glActiveTexture(GL.GL_TEXTURE0 + i)
                 GL.glBindTexture(GL.GL_TEXTURE_2D, channel.texture_id)
-                GL.glTexImage2D(GL.GL_TEXTURE_2D, 0, GL.GL_RGBA32F,
-                            channel.data.shape[1], channel.data.shape[0], 0,
-                            GL.GL_RGBA, GL.GL_FLOAT, channel.data)
+                if upload_textures:
+                    GL.glTexImage2D(GL.GL_TEXTURE_2D, 0, GL.GL_RGBA32F,
+                                channel.data.shape[1], channel.data.shape[0], 0,
+                                GL.GL_RGBA, GL.GL_FLOAT, channel.data)
                 if self.uniforms[f'iChannel{i}'] != -1:
                     GL.glUniform1i(self.uniforms[f'iChannel{i}'], i)
 
-    def render(self, uniforms: ShaderToyUniforms) -> None:
-        """Render one frame with given uniforms"""
+    def upload_textures(self, uniforms: ShaderToyUniforms) -> None:
+        """Upload channel data once; windows sharing this context reuse the textures."""
+        self.make_current()
+        for i, channel in enumerate(uniforms.iChannels):
+            if channel.data is not None and channel.texture_id != -1:
+                GL.glActiveTexture(GL.GL_TEXTURE0 + i)
+                GL.glBindTexture(GL.GL_TEXTURE_2D, channel.texture_id)
+                GL.glTexImage2D(GL.GL_TEXTURE_2D, 0, GL.GL_RGBA32F,
+                                channel.data.shape[1], channel.data.shape[0], 0,
+                                GL.GL_RGBA, GL.GL_FLOAT, channel.data)
+
+    def make_current(self) -> None:
+        """Make this window's GL context current on the calling thread."""
+        if glfw.get_current_context() != self.window:
+            glfw.make_context_current(self.window)
+
+    def render(self, uniforms: ShaderToyUniforms, upload_textures: bool = True, swap: bool = True) -> None:
+        """Render one frame with given uniforms.
+
+        upload_textures=False skips glTexImage2D when the channel textures were
+        already uploaded this frame via upload_textures() on a shared context.
+        swap=False leaves the frame in the back buffer (e.g. for read_pixels());
+        call swap_buffers() afterwards.
+        """
+        self.make_current()
         # Enable alpha blending so shaders can output transparent pixels
         GL.glEnable(GL.GL_BLEND)
         GL.glBlendFunc(GL.GL_SRC_ALPHA, GL.GL_ONE_MINUS_SRC_ALPHA)
@@ -291,13 +377,42 @@ class ShaderViewer:
         GL.glClearColor(0.0, 0.0, 0.0, 0.0)
         GL.glClear(GL.GL_COLOR_BUFFER_BIT)
 
-        self.update_uniforms(uniforms)
+        self.update_uniforms(uniforms, upload_textures=upload_textures)
         
         GL.glBindVertexArray(self.vao)
         GL.glDrawArrays(GL.GL_TRIANGLE_STRIP, 0, 4)
 
+        if swap:
+            glfw.swap_buffers(self.window)
+
+    def swap_buffers(self) -> None:
         glfw.swap_buffers(self.window)
 
+    def read_pixels(self) -> np.ndarray:
+        """Read the back buffer (render(..., swap=False) first) as an (h, w, 4) uint8 array, top row first."""
+        self.make_current()
+        w, h = self.get_window_size()
+        GL.glReadBuffer(GL.GL_BACK)
+        GL.glPixelStorei(GL.GL_PACK_ALIGNMENT, 1)
+        raw = GL.glReadPixels(0, 0, w, h, GL.GL_RGBA, GL.GL_UNSIGNED_BYTE)
+        img = np.frombuffer(raw, dtype=np.uint8).reshape(h, w, 4)
+        return img[::-1].copy()
+
+    def create_shared_context(self):
+        """Create a hidden 1x1 window whose context shares objects with this viewer.
+
+        Must be called on the main thread; the returned window can then be made
+        current on a worker thread to compile programs in the background.
+        """
+        glfw.window_hint(glfw.VISIBLE, glfw.FALSE)
+        try:
+            win = glfw.create_window(1, 1, 'shader-compile', None, self.window)
+        finally:
+            glfw.window_hint(glfw.VISIBLE, glfw.TRUE)
+        if not win:
+            raise RuntimeError('Failed to create shared context')
+        return win
+
     def should_close(self) -> bool:
         """Check if window should close"""
         return glfw.window_should_close(self.window)
@@ -310,6 +425,12 @@ class ShaderViewer:
         """Get current window size"""
         return glfw.get_framebuffer_size(self.window)
 
+    def destroy(self) -> None:
+        """Close this window only (other windows in the process keep running)."""
+        if self.window:
+            glfw.destroy_window(self.window)
+            self.window = None
+
     def cleanup(self) -> None:
         """Clean up resources"""
         glfw.terminate()
@@ -0,0 +1,137 @@
+"""
+Runtime telemetry for the viewer daemon.
+运行时遥测：渲染线程每帧记录耗时，有订阅者时按上限频率打包为定长二进制帧（小端，88 字节）
+
+Frame layout (TELEMETRY_STRUCT, little endian):
+    u8 version, u8 flags (bit0 audio, bit1 gesture), u16 band count, u32 frame,
+    u32 ack (seq of the last applied control message),
+    f32 iTime, fps, frame_ms (mean since last frame sent), frame_ms_max,
+    f32 hand x, y, z, hand action, iSatControl, iDisturbControl, audio level,
+    f32 x 8 band energies (log-spaced over the FFT texture, 0..1)
+No OpenGL imports: WebEngine uses unpack() / the layout constants as well.
+"""
+import struct
+import threading
+import time
+
+import numpy as np
+
+TELEMETRY_VERSION = 1
+TELEMETRY_BANDS = 8
+TELEMETRY_FIELDS = (
+    "version", "flags", "band_count", "frame", "ack",
+    "time", "fps", "frame_ms", "frame_ms_max",
+    "hand_x", "hand_y", "hand_z", "hand_action", "sat", "disturb", "level",
+)
+TELEMETRY_STRUCT = struct.Struct(f"<BBHII11f{TELEMETRY_BANDS}f")
+FLAG_AUDIO = 1
+FLAG_GESTURE = 2
+
+# 推送频率：默认 / 上限（Hz）
+DEFAULT_HZ = 20.0
+MAX_HZ = 60.0
+
+
+def band_energies(fft_texture, bands: int = TELEMETRY_BANDS) -> list[float]:
+    """Average the FFT texture's R channel over log-spaced bins."""
+    if fft_texture is None:
+        return [0.0] * bands
+    spectrum = np.asarray(fft_texture, dtype=np.float32).reshape(-1, 4)[:, 0]
+    edges = np.unique(np.geomspace(1, len(spectrum), bands + 1).astype(int))
+    values = [float(spectrum[lo:max(hi, lo + 1)].mean()) for lo, hi in zip(edges[:-1], edges[1:])]
+    return (values + [0.0] * bands)[:bands]
+
+
+def unpack(data: bytes) -> dict:
+    values = TELEMETRY_STRUCT.unpack(data)
+    n = len(TELEMETRY_FIELDS)
+    out = dict(zip(TELEMETRY_FIELDS, values[:n]))
+    out["bands"] = list(values[n:])
+    return out
+
+
+class TelemetryPublisher:
+    """Frame-time bookkeeping plus the latest packed telemetry frame.
+
+    frame_done() runs on the render thread after every frame; it only packs a
+    new frame while someone is subscribed, at most MAX_HZ times per second.
+    Streaming threads read latest() at their own (lower) rate.
+    """
+
+    def __init__(self):
+        self.ack = 0
+        self._subscribers = 0
+        self._lock = threading.Lock()
+        self._last_frame: float | None = None
+        self._last_pack = 0.0
+        self._count = 0
+        self._sum = 0.0
+        self._max = 0.0
+        self._latest: tuple[int, bytes] = (0, b"")
+
+    def subscribe(self) -> None:
+        with self._lock:
+            self._subscribers += 1
+
+    def unsubscribe(self) -> None:
+        with self._lock:
+            self._subscribers = max(0, self._subscribers - 1)
+
+    def latest(self) -> tuple[int, bytes]:
+        """(sequence number, packed frame); the sequence increases with every new frame."""
+        return self._latest
+
+    def frame_done(self, app) -> None:
+        now = time.perf_counter()
+        if self._last_frame is not None:
+            dt = now - self._last_frame
+            self._count += 1
+            self._sum += dt
+            self._max = max(self._max, dt)
+        self._last_frame = now
+        if not self._subscribers or now - self._last_pack < 1.0 / MAX_HZ or not self._count:
+            return
+        self._last_pack = now
+        data = self.pack(app)
+        self._latest = (self._latest[0] + 1, data)
+        self._count, self._sum, self._max = 0, 0.0, 0.0
+
+    def pack(self, app) -> bytes:
+        u = app.uniforms
+        flags = (FLAG_AUDIO if getattr(app, "_audio_started", False) else 0) \
+            | (FLAG_GESTURE if getattr(app, "_gesture_started", False) else 0)
+        level = 0.0
+        td = u.iChannels[1].data if len(u.iChannels) > 1 else None
+        if flags & FLAG_AUDIO and td is not None:
+            samples = np.asarray(td, dtype=np.float32).reshape(-1, 4)[:, 0]
+            level = float(np.sqrt(np.mean(samples * samples))) if len(samples) else 0.0
+        mean = self._sum / self._count
+        return TELEMETRY_STRUCT.pack(
+            TELEMETRY_VERSION, flags, TELEMETRY_BANDS, app.frame_count & 0xFFFFFFFF, self.ack & 0xFFFFFFFF,
+            float(u.iTime), 1.0 / mean if mean > 0 else 0.0, mean * 1000.0, self._max * 1000.0,
+            *(float(v) for v in u.iHandPos), float(u.iHandAction),
+            float(u.iSatControl), float(u.iDisturbControl), level,
+            *band_energies(u.iChannels[0].data if flags & FLAG_AUDIO else None),
+        )
+
+
+if __name__ == "__main__":
+    from types import SimpleNamespace
+
+    from shadertoy.uniforms import ShaderToyUniforms
+
+    uniforms = ShaderToyUniforms()
+    fft = np.zeros((1, 1024, 4), dtype=np.float32)
+    fft[0, :, 0] = np.linspace(1.0, 0.0, 1024)
+    uniforms.iChannels[0].data = fft
+    app = SimpleNamespace(uniforms=uniforms, frame_count=0, _audio_started=True, _gesture_started=False)
+    pub = TelemetryPublisher()
+    pub.subscribe()
+    t0 = time.perf_counter()
+    for i in range(120):
+        app.frame_count = i
+        pub.frame_done(app)
+        time.sleep(1 / 240)
+    seq, data = pub.latest()
+    print(f"{TELEMETRY_STRUCT.size} bytes, {seq} frames packed in {time.perf_counter() - t0:.2f}s")
+    print(unpack(data))
@@ -0,0 +1,125 @@
+"""
+Headless thumbnail renderer.
+离屏缩略图：隐藏窗口 + FBO，在固定的几个 iTime 下用预设频谱纹理渲染，输出纵向拼接的 PNG 帧序列
+
+Meant to run inside worker processes (see WebEngine/thumbnails.py): call
+init_worker() once per process, then render_thumbnail() per shader.
+"""
+import sys
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+THUMB_WIDTH = 256
+THUMB_HEIGHT = 64          # 与默认 1920x480 窗口同为 4:1
+THUMB_TIMES = (1.0, 4.0, 9.0, 16.0)
+
+_viewer = None
+_fbo = None
+_textures: tuple[int, int] | None = None
+
+
+def canned_spectrum(t: float, fft_size: int = 1024, chunk_size: int = 4096) -> tuple[np.ndarray, np.ndarray]:
+    """Deterministic stand-in for live audio: (fft RGBA texture, time-domain RGBA texture)."""
+    x = np.linspace(0.0, 1.0, fft_size, dtype=np.float32)
+    # 低频能量高、随频率衰减，叠加随时间移动的几个峰，让动画帧之间有变化
+    spectrum = 0.9 * np.exp(-4.0 * x)
+    for k, centre in enumerate((0.05, 0.18, 0.42)):
+        amp = 0.5 + 0.5 * np.sin(t * (1.3 + k) + k)
+        spectrum += 0.35 * amp * np.exp(-((x - centre) ** 2) / 0.002)
+    fft = np.zeros((1, fft_size, 4), dtype=np.float32)
+    fft[0, :, 0] = np.clip(spectrum, 0.0, 1.0)
+
+    s = np.arange(chunk_size, dtype=np.float32) / 44100.0
+    wave = 0.4 * np.sin(2 * np.pi * 110.0 * (s + t)) + 0.2 * np.sin(2 * np.pi * 440.0 * (s + t))
+    td = np.zeros((1, chunk_size, 4), dtype=np.float32)
+    td[0, :, 0] = wave
+    return fft, td
+
+
+def init_worker(width: int = THUMB_WIDTH, height: int = THUMB_HEIGHT) -> None:
+    """Create the hidden GL context, FBO and channel textures for this process."""
+    global _viewer, _fbo, _textures
+    from OpenGL import GL
+    from shadertoy.shader import ShaderViewer
+
+    _viewer = ShaderViewer(1, 1, title="shader-thumbnail", visible=False)
+    color = GL.glGenTextures(1)
+    GL.glBindTexture(GL.GL_TEXTURE_2D, color)
+    GL.glTexImage2D(GL.GL_TEXTURE_2D, 0, GL.GL_RGBA8, width, height, 0, GL.GL_RGBA, GL.GL_UNSIGNED_BYTE, None)
+    _fbo = GL.glGenFramebuffers(1)
+    GL.glBindFramebuffer(GL.GL_FRAMEBUFFER, _fbo)
+    GL.glFramebufferTexture2D(GL.GL_FRAMEBUFFER, GL.GL_COLOR_ATTACHMENT0, GL.GL_TEXTURE_2D, color, 0)
+    if GL.glCheckFramebufferStatus(GL.GL_FRAMEBUFFER) != GL.GL_FRAMEBUFFER_COMPLETE:
+        raise RuntimeError("thumbnail framebuffer incomplete")
+
+    ids = []
+    for _ in range(2):
+        tex = GL.glGenTextures(1)
+        GL.glBindTexture(GL.GL_TEXTURE_2D, tex)
+        GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_MIN_FILTER, GL.GL_LINEAR)
+        GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_MAG_FILTER, GL.GL_LINEAR)
+        GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_WRAP_S, GL.GL_CLAMP_TO_EDGE)
+        GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_WRAP_T, GL.GL_CLAMP_TO_EDGE)
+        ids.append(tex)
+    _textures = (ids[0], ids[1])
+
+
+def render_thumbnail(shader_path: str, out_path: str, width: int = THUMB_WIDTH, height: int = THUMB_HEIGHT,
+                     times: tuple[float, ...] = THUMB_TIMES) -> dict:
+    """Render shader_path at each iTime and write the frames stacked vertically to out_path.
+
+    Returns {"ok": True, "frames": n} or {"ok": False, "error": ...}; never raises for shader errors.
+    """
+    from OpenGL import GL
+    from shadertoy.daemon import write_png
+    from shadertoy.uniforms import ShaderToyUniforms, TextureChannel
+
+    if _viewer is None:
+        init_worker(width, height)
+    try:
+        program, locations = _viewer.build_program(_viewer.preprocess_source(shader_path))
+    except Exception as e:
+        return {"ok": False, "error": str(e)}
+    _viewer.set_program(program, locations)
+
+    uniforms = ShaderToyUniforms()
+    uniforms.iResolution = (float(width), float(height), 0.0)
+    uniforms.iChannels[0] = TextureChannel(texture_id=_textures[0])
+    uniforms.iChannels[1] = TextureChannel(texture_id=_textures[1])
+
+    GL.glBindFramebuffer(GL.GL_FRAMEBUFFER, _fbo)
+    GL.glViewport(0, 0, width, height)
+    GL.glPixelStorei(GL.GL_PACK_ALIGNMENT, 1)
+    frames = []
+    for i, t in enumerate(times):
+        fft, td = canned_spectrum(t)
+        uniforms.iTime = t
+        uniforms.iFrame = i
+        uniforms.iChannels[0].data = fft
+        uniforms.iChannels[0].resolution = (float(fft.shape[1]), 1.0, 0.0)
+        uniforms.iChannels[1].data = td
+        uniforms.iChannels[1].resolution = (float(td.shape[1]), 1.0, 0.0)
+        _viewer.render(uniforms, swap=False)
+        GL.glFinish()
+        raw = GL.glReadPixels(0, 0, width, height, GL.GL_RGBA, GL.GL_UNSIGNED_BYTE)
+        frame = np.frombuffer(raw, dtype=np.uint8).reshape(height, width, 4)[::-1].copy()
+        # 透明像素在页面上按黑底显示
+        frame[..., 3] = 255
+        frames.append(frame)
+
+    out = Path(out_path)
+    out.parent.mkdir(parents=True, exist_ok=True)
+    tmp = out.with_suffix(".tmp")
+    write_png(str(tmp), np.concatenate(frames, axis=0))
+    tmp.replace(out)
+    return {"ok": True, "frames": len(frames)}
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3:
+        print("Usage: python -m shadertoy.thumbnails shader.glsl out.png")
+        sys.exit(1)
+    print(render_thumbnail(sys.argv[1], sys.argv[2]))
@@ -1,7 +1,8 @@
 """
 ShaderToy uniform variables definitions
 """
-from dataclasses import dataclass, field
+import math
+from dataclasses import MISSING, dataclass, field, fields
 from typing import List, Tuple, Optional
 import numpy as np
 
@@ -33,4 +34,39 @@ class ShaderToyUniforms:
 
     iChannels: List[TextureChannel] = field(default_factory=lambda: [
         TextureChannel() for _ in range(4)
-    ])
\ No newline at end of file
+    ])
+
+
+# 可被外部覆盖的内置 uniform → 默认值（决定形状：标量 float / int，或定长元组）
+BUILTIN_UNIFORMS = {
+    f.name: f.default for f in fields(ShaderToyUniforms) if f.default is not MISSING
+}
+
+
+def coerce_uniform(name: str, value):
+    """Validate an override value for uniform name; returns the value to store or raises ValueError.
+
+    Builtins must match their field (scalar, int for iFrame, or a tuple of the field's length);
+    other names take 1-4 components and are stored as a float tuple. Bools and non-finite
+    numbers are rejected.
+    """
+    items = list(value) if isinstance(value, (list, tuple)) else [value]
+    for v in items:
+        if isinstance(v, bool) or not isinstance(v, (int, float)) or not math.isfinite(v):
+            raise ValueError(f"{name}: values must be finite numbers")
+    default = BUILTIN_UNIFORMS.get(name)
+    if default is None:
+        if not 1 <= len(items) <= 4:
+            raise ValueError(f"{name}: value must have 1-4 components")
+        return tuple(float(v) for v in items)
+    if isinstance(default, tuple):
+        if not isinstance(value, (list, tuple)) or len(items) != len(default):
+            raise ValueError(f"{name}: expected {len(default)} components")
+        return tuple(float(v) for v in items)
+    if isinstance(value, (list, tuple)):
+        raise ValueError(f"{name}: expected a scalar")
+    if isinstance(default, int):
+        if float(value) != int(value):
+            raise ValueError(f"{name}: expected an integer")
+        return int(value)
+    return float(value)